@@ -1,10 +1,18 @@
 # SPDX-FileCopyrightText: 2022-2023 Espressif Systems (Shanghai) CO LTD
 # SPDX-License-Identifier: Apache-2.0
+import json
+import os
+from datetime import datetime
+
 import click
 
-from idf_component_manager.utils import print_info
-from idf_component_tools.file_cache import FileCache
+from idf_component_manager.utils import print_info, print_warn
+from idf_component_tools.errors import GitError
+from idf_component_tools.file_cache import FileCache, cache_max_age, cache_max_size
+from idf_component_tools.file_lock import FileLock
 from idf_component_tools.file_tools import human_readable_size
+from idf_component_tools.git_client import GitClient, mirror_lock_path
+from idf_component_tools.sources import GitSource
 
 
 def init_cache():
@@ -32,14 +40,158 @@ def init_cache():
 
     @cache.command()
     @click.option('--bytes', is_flag=True, default=False, help='Print size in bytes')
-    def size(bytes):
+    @click.option(
+        '--recompute', is_flag=True, default=False, help='Measure all entries of the cache instead of using the ledger')
+    def size(bytes, recompute):
         """
         Print the cache size in human readable format.
         """
-        size = FileCache().size()
+        if recompute:
+            size = sum(entry.size for entry in FileCache().entries(recompute=True))
+        else:
+            size = FileCache().size()
         if bytes:
             print_info(str(size))
         else:
             print_info(human_readable_size(size))
 
+    @cache.command()
+    @click.option('--dry-run', is_flag=True, default=False, help='Print entries and projects that would be removed')
+    def gc(dry_run):
+        """
+        Remove cached components and git worktrees not referenced by lock files of projects using the cache.
+        """
+        result = FileCache().gc(dry_run=dry_run)
+        for lock_path in result.projects:
+            print_info(
+                '{} project with missing lock file {}'.format(
+                    'Would unregister' if dry_run else 'Unregistered', lock_path))
+        for entry in result.entries:
+            print_info(
+                '{} {} ({})'.format(
+                    'Would remove' if dry_run else 'Removed', entry.key, human_readable_size(entry.size)))
+
+        print_info(
+            '{} {} unreferenced cache entries, {} {}'.format(
+                'Would remove' if dry_run else 'Removed', len(result.entries),
+                human_readable_size(sum(entry.size for entry in result.entries)),
+                'would be reclaimed' if dry_run else 'reclaimed'))
+        if result.blobs_size:
+            print_info(
+                '{} {} of files not used by cache entries'.format(
+                    'Would remove' if dry_run else 'Removed', human_readable_size(result.blobs_size)))
+
+    @cache.command()
+    @click.option('--json', 'as_json', is_flag=True, default=False, help='Print statistics in JSON format')
+    def stats(as_json):
+        """
+        Print cumulative statistics of cache hits and misses, and of downloaded and reused data.
+        """
+        stats = FileCache().stats()
+        if as_json:
+            print_info(json.dumps(stats, indent=2, sort_keys=True))
+            return
+
+        def hit_rate(hits, misses):  # type: (int, int) -> str
+            total = hits + misses
+            return '{:.1f}%'.format(100.0 * hits / total) if total else 'n/a'
+
+        print_info(
+            'Cache statistics since {}:'.format(datetime.fromtimestamp(stats['since']).strftime('%Y-%m-%d %H:%M')))
+        print_info(
+            '  Registry API responses: {} hits, {} misses, hit rate {}, {} served from cache, {} downloaded'.format(
+                stats['api_hits'], stats['api_misses'], hit_rate(stats['api_hits'], stats['api_misses']),
+                human_readable_size(stats['api_bytes_served']), human_readable_size(stats['api_bytes_downloaded'])))
+        print_info(
+            '  Component archives: {} hits, {} misses, hit rate {}, {} served from cache, {} downloaded, '
+            '{} deduplicated'.format(
+                stats['archive_hits'], stats['archive_misses'],
+                hit_rate(stats['archive_hits'], stats['archive_misses']),
+                human_readable_size(stats['archive_bytes_served']),
+                human_readable_size(stats['archive_bytes_downloaded']),
+                human_readable_size(stats['archive_bytes_deduplicated'])))
+        print_info(
+            '  Git repositories: {} fetches, {} skipped, {} fetched'.format(
+                stats['git_fetches'], stats['git_fetches_skipped'], human_readable_size(stats['git_bytes_fetched'])))
+        print_info(
+            'Total: {} served from cache, {} downloaded'.format(
+                human_readable_size(stats['api_bytes_served'] + stats['archive_bytes_served']),
+                human_readable_size(
+                    stats['api_bytes_downloaded'] + stats['archive_bytes_downloaded'] + stats['git_bytes_fetched'])))
+
+    @cache.command()
+    @click.option(
+        '--prune-refs', is_flag=True, default=False, help='Remove branches and tags deleted in remote repositories')
+    def maintain(prune_refs):
+        """
+        Repack cached git repositories of dependencies and write their commit-graphs.
+        """
+        repositories = GitSource.cached_repositories(FileCache().path())
+        if not repositories:
+            print_info('No git repositories found in the cache')
+            return
+
+        file_cache = FileCache()
+        client = GitClient()
+        maintained, size_before, size_after = 0, 0, 0
+        for bare_path in repositories:
+            try:
+                with FileLock(mirror_lock_path(bare_path)):
+                    stats = client.maintain(bare_path, prune_refs=prune_refs)
+                    file_cache.record_update(bare_path)
+            except GitError as e:
+                print_warn('Failed to maintain the repository {}:\n{}'.format(bare_path, e))
+                continue
+
+            maintained += 1
+            size_before += stats.before.size
+            size_after += stats.after.size
+            print_info(
+                '{}: {} -> {}, loose objects: {} -> {}, packs: {} -> {}, done in {:.1f}s'.format(
+                    os.path.basename(bare_path), human_readable_size(stats.before.size),
+                    human_readable_size(stats.after.size), stats.before.loose_objects, stats.after.loose_objects,
+                    stats.before.packs, stats.after.packs, stats.duration))
+
+        print_info(
+            'Maintained {} git repositories, size changed from {} to {}'.format(
+                maintained, human_readable_size(size_before), human_readable_size(size_after)))
+
+    @cache.command()
+    @click.option(
+        '--max-size',
+        type=int,
+        default=None,
+        help='Maximum size of the cache in megabytes, IDF_COMPONENT_CACHE_MAX_SIZE_MB by default')
+    @click.option(
+        '--max-age',
+        type=int,
+        default=None,
+        help='Remove entries not used for more than this number of days, IDF_COMPONENT_CACHE_MAX_AGE_DAYS by default')
+    @click.option('--dry-run', is_flag=True, default=False, help='Print entries that would be removed')
+    def prune(max_size, max_age, dry_run):
+        """
+        Remove least recently used entries from the cache to fit the maximum size and age.
+        """
+        max_size_bytes = max_size * 1024 * 1024 if max_size is not None else cache_max_size()
+        max_age_seconds = max_age * 24 * 60 * 60 if max_age is not None else cache_max_age()
+        if not max_size_bytes and not max_age_seconds:
+            print_warn(
+                'Neither maximum size nor maximum age of the cache is set. '
+                'Use --max-size and --max-age options '
+                'or IDF_COMPONENT_CACHE_MAX_SIZE_MB and IDF_COMPONENT_CACHE_MAX_AGE_DAYS environment variables.')
+            return
+
+        file_cache = FileCache()
+        removed = file_cache.prune(max_size=max_size_bytes, max_age=max_age_seconds, dry_run=dry_run)
+        for entry in removed:
+            print_info(
+                '{} {} ({}, last used {})'.format(
+                    'Would remove' if dry_run else 'Removed', entry.key, human_readable_size(entry.size),
+                    datetime.fromtimestamp(entry.accessed).strftime('%Y-%m-%d %H:%M')))
+
+        print_info(
+            '{} {} cache entries, {} {}'.format(
+                'Would remove' if dry_run else 'Removed', len(removed),
+                human_readable_size(sum(entry.size for entry in removed)), 'would be freed' if dry_run else 'freed'))
+
     return cache
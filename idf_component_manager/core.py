@@ -358,6 +358,7 @@ class ComponentManager(object):
             return
 
         undeleted_components = []
+        component_changes = {}
         for component_dir in managed_components_dir.glob('*/'):
 
             if not (managed_components_dir / component_dir).is_dir():
@@ -366,13 +367,16 @@ class ComponentManager(object):
             try:
                 validate_managed_component_hash(str(managed_components_dir / component_dir))
                 shutil.rmtree(str(managed_components_dir / component_dir))
-            except (HashNotEqualError, HashNotSHA256Error):
+            except HashNotEqualError as e:
+                undeleted_components.append(component_dir.name)
+                component_changes[component_dir.name] = e.changes
+            except HashNotSHA256Error:
                 undeleted_components.append(component_dir.name)
             except HashDoesNotExistError:
                 pass
 
         if undeleted_components:
-            raise_component_modified_error(str(managed_components_dir), undeleted_components)
+            raise_component_modified_error(str(managed_components_dir), undeleted_components, component_changes)
 
         elif any(managed_components_dir.iterdir()) == 0:
             shutil.rmtree(str(managed_components_dir))
@@ -13,6 +13,14 @@ from idf_component_tools.manifest import Manifest
 from idf_component_tools.manifest.constants import SLUG_BODY_REGEX
 from idf_component_tools.semver import SimpleSpec
 
+try:
+    from typing import Dict, List, Tuple
+except ImportError:
+    pass
+
+# Maximum number of modified files listed for every component
+MAX_LISTED_CHANGES = 10
+
 CREATE_PROJECT_FROM_EXAMPLE_NAME_REGEX = (
     r'^((?P<namespace>{slug})\/)?'
     r'(?P<component>{slug})'
@@ -37,7 +45,12 @@ def archive_filename(manifest):  # type: (Manifest) -> str
     return '{}.tgz'.format(dist_name(manifest))
 
 
-def raise_component_modified_error(managed_components_dir, components):  # type: (str, list[str]) -> None
+def raise_component_modified_error(
+        managed_components_dir,  # type: str
+        components,  # type: list[str]
+        changes=None,  # type: Dict[str, List[Tuple[str, str]]] | None
+):
+    # type: (...) -> None
     project_path = Path(managed_components_dir).parent
     component_example_name = components[0].replace('/', '__')
     managed_component_dir = Path(managed_components_dir, component_example_name)
@@ -59,6 +72,22 @@ def raise_component_modified_error(managed_components_dir, components):  # type:
             component_dir=component_dir,
             hash_path=hash_path,
             hash_filename=HASH_FILENAME)
+
+    changed_files = []
+    for component in components:
+        component_changes = (changes or {}).get(component)
+        if not component_changes:
+            continue
+
+        changed_files.append('Changes in "{}":'.format(component))
+        for path, change in component_changes[:MAX_LISTED_CHANGES]:
+            changed_files.append('  {}: {}'.format(change, path))
+        if len(component_changes) > MAX_LISTED_CHANGES:
+            changed_files.append('  and {} more'.format(len(component_changes) - MAX_LISTED_CHANGES))
+
+    if changed_files:
+        error = '{}\n{}'.format(error, '\n'.join(changed_files))
+
     raise ComponentModifiedError(error)
 
 
@@ -14,10 +14,13 @@ from idf_component_tools.build_system_tools import build_name
 from idf_component_tools.environment import getenv_bool
 from idf_component_tools.errors import (
     ComponentModifiedError, FetchingError, InvalidComponentHashError, SolverError, hint, warn)
+from idf_component_tools.file_cache import FileCache
 from idf_component_tools.hash_tools import ValidatingHashError, validate_managed_component_hash
 from idf_component_tools.lock import LockManager
-from idf_component_tools.manifest import HashedComponentVersion, ProjectRequirements, SolvedComponent, SolvedManifest
+from idf_component_tools.manifest import (
+    ComponentRequirement, HashedComponentVersion, ProjectRequirements, SolvedComponent, SolvedManifest)
 from idf_component_tools.sources.fetcher import ComponentFetcher
+from idf_component_tools.sources.git import prefetch_git_repositories
 
 
 def check_manifests_targets(project_requirements):  # type: (ProjectRequirements) -> None
@@ -87,6 +90,9 @@ def is_solve_required(project_requirements, solution):
             'Target changed from {} to {}, solving dependencies.'.format(solution.target, project_requirements.target))
         return True
 
+    prefetch_git_repositories(
+        ComponentRequirement(component.name, component.source) for component in solution.dependencies)
+
     for component in solution.dependencies:
         try:
             component_version = component.source.versions(component.name).versions[0]  # type: HashedComponentVersion
@@ -122,6 +128,24 @@ def print_dot():
     print_info('.', nl=False)
 
 
+def register_project_in_cache(lock_path, solution):  # type: (str, SolvedManifest) -> None
+    '''Register the lock file in caches used by solved components, to keep their entries on garbage collection'''
+    caches = {}  # type: dict[str, dict[str, dict]]
+    for component in solution.dependencies:
+        entries = component.source.cache_entries(component)
+        if not entries:
+            continue
+
+        caches.setdefault(component.source.system_cache_path, {})[component.name] = {
+            'version': str(component.version),
+            'component_hash': component.component_hash,
+            'entries': entries,
+        }
+
+    for cache_path, components in caches.items():
+        FileCache(cache_path).register_project(lock_path, components)
+
+
 def download_project_dependencies(project_requirements, lock_path, managed_components_path):
     # type: (ProjectRequirements, str, str) -> tuple[set[str], dict[str, str]]
     '''Solves dependencies and download components'''
@@ -174,6 +198,7 @@ def download_project_dependencies(project_requirements, lock_path, managed_compo
     if requirement_dependencies:
         number_of_components = len(requirement_dependencies)
         changed_components = []
+        component_changes = {}
         print_info('Processing {} dependencies:'.format(number_of_components))
 
         for index, component in enumerate(requirement_dependencies):
@@ -186,10 +211,13 @@ def download_project_dependencies(project_requirements, lock_path, managed_compo
                     downloaded_component_paths.add(download_path)
                     # Save versions of downloadable components
                     downloaded_component_version_dict[download_path] = str(component.version)
-            except ComponentModifiedError:
+            except ComponentModifiedError as e:
                 changed_components.append(component.name)
+                component_changes[component.name] = e.changes
 
         if changed_components:
-            raise_component_modified_error(managed_components_path, changed_components)
+            raise_component_modified_error(managed_components_path, changed_components, component_changes)
+
+    register_project_in_cache(lock_path, solution)
 
     return downloaded_component_paths, downloaded_component_version_dict
@@ -5,6 +5,7 @@ from idf_component_tools.errors import DependencySolveError, SolverError
 from idf_component_tools.manifest import (
     ComponentRequirement, Manifest, ProjectRequirements, SolvedComponent, SolvedManifest)
 from idf_component_tools.sources import LocalSource
+from idf_component_tools.sources.git import prefetch_git_repositories
 
 from ..utils import print_info
 from .helper import PackageSource
@@ -48,6 +49,10 @@ class VersionSolver(object):
                     else:
                         self._local_root_requirements[requirement.name] = requirement
 
+        # Git repositories are updated in parallel, before solving dependencies one by one
+        prefetch_git_repositories(
+            requirement for manifest in self.requirements.manifests for requirement in manifest.dependencies)
+
         for manifest in self.requirements.manifests:
             self.solve_manifest(manifest)
 
@@ -62,6 +62,54 @@ def env_cache_time():
         return DEFAULT_API_CACHE_EXPIRATION_MINUTES
 
 
+def _file_size(path):  # type: (str) -> int
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class LedgerFileCache(FileCache):
+    """
+    Cache of API responses that accounts changes of its size in the ledger of the component cache,
+    and marks it as recently used on hits, to keep it on pruning of the cache
+    """
+    def __init__(self, directory, component_cache):  # type: (str, ComponentFileCache) -> None
+        super(LedgerFileCache, self).__init__(directory)
+        self._component_cache = component_cache
+
+    def get(self, key):  # type: (str) -> Any
+        value = super(LedgerFileCache, self).get(key)
+        if value is not None:
+            self._component_cache.record_access(self._fn(key))
+        return value
+
+    def set(self, key, *args, **kwargs):  # type: (str, Any, Any) -> None
+        path = self._fn(key)
+        size = _file_size(path)
+        super(LedgerFileCache, self).set(key, *args, **kwargs)
+        self._component_cache.record_growth(path, _file_size(path) - size)
+
+    def delete(self, key):  # type: (str) -> None
+        path = self._fn(key)
+        size = _file_size(path)
+        super(LedgerFileCache, self).delete(key)
+        self._component_cache.record_growth(path, _file_size(path) - size)
+
+
+def record_cache_stats(component_cache):  # type: (ComponentFileCache) -> Callable[..., requests.Response]
+    """Hook of the session counting responses served from the cache and downloaded from the registry"""
+    def hook(response, *args, **kwargs):  # type: (requests.Response, Any, Any) -> requests.Response
+        size = len(response.content or b'')
+        if getattr(response, 'from_cache', False):
+            component_cache.record_stats(api_hits=1, api_bytes_served=size)
+        else:
+            component_cache.record_stats(api_misses=1, api_bytes_downloaded=size)
+        return response
+
+    return hook
+
+
 def create_session(
         cache=False,  # type: bool
         cache_path=None,  # type: str | None
@@ -69,22 +117,23 @@ def create_session(
         token=None,  # type: str | None
 ):  # type: (...) -> requests.Session
 
-    if cache_path is None:
-        cache_path = ComponentFileCache().path()
+    component_cache = ComponentFileCache(cache_path)
+    cache_path = component_cache.path()
+
+    session = requests.Session()
+    session.headers['User-Agent'] = user_agent()
+    session.auth = TokenAuth(token)
 
     cache_time = cache_time or env_cache_time()
     if cache and cache_time:
         api_adapter = CacheControlAdapter(
             max_retries=MAX_RETRIES,
             heuristic=ExpiresAfter(minutes=cache_time),
-            cache=FileCache(os.path.join(cache_path, '.api_client')))
+            cache=LedgerFileCache(os.path.join(cache_path, '.api_client'), component_cache))
+        session.hooks['response'].append(record_cache_stats(component_cache))
     else:
         api_adapter = HTTPAdapter(max_retries=MAX_RETRIES)
 
-    session = requests.Session()
-    session.headers['User-Agent'] = user_agent()
-    session.auth = TokenAuth(token)
-
     session.mount('http://', api_adapter)
     session.mount('https://', api_adapter)
     session.mount('file://', FileAdapter())
@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: 2023 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+"""Copying files with the fastest method supported by file systems"""
+import errno
+import os
+import shutil
+import sys
+import threading
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from idf_component_tools.environment import getenv_int
+
+try:
+    from typing import Callable, List, Set, Tuple
+except ImportError:
+    pass
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None  # type: ignore
+
+# ioctl of Linux sharing extents of files on copy-on-write file systems (btrfs, XFS)
+FICLONE = 0x40049409
+# Errors meaning that the copy method is not supported by file systems of the source and the destination
+UNSUPPORTED_ERRNOS = frozenset(
+    getattr(errno, name) for name in ('EXDEV', 'EINVAL', 'ENOTTY', 'EOPNOTSUPP', 'ENOTSUP', 'ENOSYS', 'EBADF')
+    if hasattr(errno, name))
+
+COPY_BUFFER_SIZE = 1048576
+# Maximum default number of threads copying files
+DEFAULT_COPY_JOBS = 8
+# Fewer files are copied in the calling thread
+PARALLEL_COPY_MIN_FILES = 16
+
+REFLINK = 'reflink'
+COPY_FILE_RANGE = 'copy_file_range'
+
+_lock = threading.Lock()
+# Methods that failed for pairs of devices of sources and destinations, they are not tried again
+_unsupported = set()  # type: Set[Tuple[str, int, int]]
+
+
+def _reflink(source_fd, destination_fd, size):  # type: (int, int, int) -> bool
+    fcntl.ioctl(destination_fd, FICLONE, source_fd)
+    return True
+
+
+def _copy_file_range(source_fd, destination_fd, size):  # type: (int, int, int) -> bool
+    copied = 0
+    while copied < size:
+        count = os.copy_file_range(source_fd, destination_fd, size - copied)  # type: ignore
+        if not count:
+            break
+        copied += count
+
+    # The file may be shorter than expected, or its end is copied by reading
+    return copied == size
+
+
+def _methods():  # type: () -> List[Tuple[str, Callable[[int, int, int], bool]]]
+    methods = []  # type: List[Tuple[str, Callable[[int, int, int], bool]]]
+    if fcntl is not None and sys.platform.startswith('linux'):
+        methods.append((REFLINK, _reflink))
+    if hasattr(os, 'copy_file_range'):
+        methods.append((COPY_FILE_RANGE, _copy_file_range))
+    return methods
+
+
+def copy_file(source, destination):  # type: (str, str) -> None
+    """
+    Copy file with its permissions and timestamps, like `shutil.copy2`.
+    Extents are shared on copy-on-write file systems, then data is copied by the kernel with `copy_file_range`,
+    methods not supported by file systems fall back to reading and writing the file.
+    """
+    with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+        source_fd, destination_fd = source_file.fileno(), destination_file.fileno()
+        size = os.fstat(source_fd).st_size
+        devices = (os.fstat(source_fd).st_dev, os.fstat(destination_fd).st_dev)
+
+        for name, copy in _methods():
+            if (name, ) + devices in _unsupported:
+                continue
+
+            try:
+                if copy(source_fd, destination_fd, size):
+                    break
+            except (IOError, OSError) as e:
+                if e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+
+                with _lock:
+                    _unsupported.add((name, ) + devices)
+
+            # Start again from the beginning with the next method
+            os.lseek(source_fd, 0, os.SEEK_SET)
+            os.lseek(destination_fd, 0, os.SEEK_SET)
+            os.ftruncate(destination_fd, 0)
+        else:
+            # None of the methods is supported
+            shutil.copyfileobj(source_file, destination_file, COPY_BUFFER_SIZE)
+
+    shutil.copystat(source, destination)
+
+
+def copy_jobs():  # type: () -> int
+    """Number of threads copying files from IDF_COMPONENT_COPY_JOBS, by default number of CPUs"""
+    return max(getenv_int('IDF_COMPONENT_COPY_JOBS', min(cpu_count(), DEFAULT_COPY_JOBS)), 1)
+
+
+def copy_files(pairs):  # type: (List[Tuple[str, str]]) -> None
+    """Copy pairs of source and destination files in parallel, destination directories must exist"""
+    jobs = min(copy_jobs(), len(pairs))
+    if jobs > 1 and len(pairs) >= PARALLEL_COPY_MIN_FILES:
+        pool = ThreadPool(jobs)
+        try:
+            pool.map(lambda pair: copy_file(*pair), pairs)
+        finally:
+            pool.close()
+            pool.join()
+        return
+
+    for source, destination in pairs:
+        copy_file(source, destination)
@@ -110,7 +110,10 @@ class GitError(ProcessingError):
 
 
 class ComponentModifiedError(ProcessingError):
-    pass
+    def __init__(self, *args, **kwargs):  # type: (Any, Any) -> None
+        # Pairs of relative paths of modified files and types of changes, if they are known
+        self.changes = kwargs.pop('changes', None) or []
+        super(ComponentModifiedError, self).__init__(*args, **kwargs)
 
 
 class InvalidComponentHashError(ProcessingError):
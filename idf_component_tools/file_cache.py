@@ -11,10 +11,57 @@
 import errno
 import os
 import shutil
+import stat
 import sys
+import time
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
+from idf_component_tools.environment import getenv_bool, getenv_int
 from idf_component_tools.errors import FatalError
-from idf_component_tools.file_tools import directory_size
+from idf_component_tools.file_lock import FileLock
+from idf_component_tools.file_tools import create_directory, directory_size, read_json, replace_file, write_json
+from idf_component_tools.hash_tools import hash_file
+
+try:
+    from typing import Any, Dict, Iterable, List, Set
+except ImportError:
+    pass
+
+# Index of cache entries with the time of the last access, used for eviction of least recently used entries
+CACHE_INDEX_FILENAME = '.cache_index.json'
+# Cumulative counters of cache hits and misses, and of downloaded and reused data
+CACHE_STATS_FILENAME = '.cache_stats.json'
+# Projects that use the cache, with entries referenced by their lock files
+CACHE_PROJECTS_FILENAME = '.cache_projects.json'
+# Content-addressed store of files of cache entries, unpacked entries are made of hard links to its blobs
+CACHE_BLOBS_DIRNAME = '.blobs'
+CACHE_METADATA_NAMES = (CACHE_INDEX_FILENAME, CACHE_STATS_FILENAME, CACHE_PROJECTS_FILENAME, CACHE_BLOBS_DIRNAME)
+CACHE_STATS_COUNTERS = (
+    'api_hits',
+    'api_misses',
+    'api_bytes_downloaded',
+    'api_bytes_served',
+    'archive_hits',
+    'archive_misses',
+    'archive_bytes_downloaded',
+    'archive_bytes_served',
+    'archive_bytes_deduplicated',
+    'git_fetches',
+    'git_fetches_skipped',
+    'git_bytes_fetched',
+)
+# Directories with several independent entries, i.e. versions of components from one registry
+CACHE_CONTAINER_PREFIXES = ('service_', 'w_')
+
+# Entries used recently may belong to builds in progress that haven't registered their projects yet
+GC_GRACE_PERIOD = 60 * 60
+
+# Number of threads measuring sizes of cache entries
+DEFAULT_SCAN_JOBS = 8
+
+CacheEntry = namedtuple('CacheEntry', ['key', 'path', 'size', 'accessed'])
+GarbageCollection = namedtuple('GarbageCollection', ['entries', 'projects', 'blobs_size'])
 
 
 def system_cache_path():  # type: () -> str
@@ -59,8 +106,386 @@ class FileCache(object):
         shutil.rmtree(self.path())
 
     def size(self):  # type: () -> int
-        """Disk usage of cache directory"""
-        return directory_size(self.path())
+        """Disk usage of cache directory, from the ledger of sizes of entries"""
+        return sum(entry.size for entry in self.entries())
+
+    def _index_path(self):  # type: () -> str
+        return os.path.join(self.path(), CACHE_INDEX_FILENAME)
+
+    def _read_index(self):  # type: () -> Dict[str, Any]
+        index = read_json(self._index_path(), default={})
+        return index if isinstance(index, dict) else {}
+
+    def _update_index(self, records):  # type: (Dict[str, Dict[str, Any] | None]) -> None
+        """Update records of the index, removing ones set to None"""
+        if not records:
+            return
+
+        with FileLock('{}.lock'.format(self._index_path())):
+            index = self._read_index()
+            for key, record in records.items():
+                if record is None:
+                    index.pop(key, None)
+                    continue
+
+                current = index.get(key)
+                if isinstance(current, dict):
+                    current.update(record)
+                else:
+                    index[key] = record
+            write_json(self._index_path(), index)
+
+    def entry_key(self, path):  # type: (str) -> str | None
+        """Key of the cache entry that contains the path, None if the path is not in the cache"""
+        relative_path = os.path.relpath(os.path.abspath(path), os.path.abspath(self.path()))
+        parts = relative_path.replace(os.sep, '/').split('/')
+        if parts[0] in ('.', '..'):
+            return None
+
+        if parts[0].startswith(CACHE_CONTAINER_PREFIXES):
+            if len(parts) < 2:
+                return None
+            return '/'.join(parts[:2])
+
+        return parts[0]
+
+    def _entry_path(self, key):  # type: (str) -> str
+        return os.path.join(self.path(), *key.split('/'))
+
+    def _entry_size(self, key):  # type: (str) -> int
+        entry_path = self._entry_path(key)
+        if os.path.isdir(entry_path):
+            return directory_size(entry_path)
+
+        try:
+            return os.path.getsize(entry_path)
+        except OSError:
+            return 0
+
+    def entry_size(self, path):  # type: (str) -> int
+        """Size of the cache entry that contains the path from the ledger, measured if it's not known"""
+        key = self.entry_key(path)
+        if key is None:
+            return 0
+
+        record = self._read_index().get(key)
+        if isinstance(record, dict) and record.get('size') is not None:
+            return int(record['size'])
+        return self._entry_size(key)
+
+    def record_access(self, *paths):  # type: (str) -> None
+        """Mark cache entries that contain paths as recently used"""
+        now = time.time()
+        self._update_index({key: {'accessed': now} for key in self._keys(paths)})
+
+    def record_update(self, *paths):  # type: (str) -> int
+        """
+        Mark cache entries that contain paths as recently used, and update their sizes in the ledger.
+        Returns the growth of entries, entries missing in the ledger are counted as new.
+        """
+        now = time.time()
+        index = self._read_index()
+        records = {
+            key: {
+                'accessed': now,
+                'size': self._entry_size(key)
+            }
+            for key in self._keys(paths)
+        }  # type: Dict[str, Any]
+        self._update_index(records)
+
+        growth = 0
+        for key, record in records.items():
+            previous = index.get(key)
+            previous_size = previous.get('size') if isinstance(previous, dict) else None
+            growth += int(record['size']) - int(previous_size or 0)
+        return growth
+
+    def record_growth(self, path, size):  # type: (str, int) -> None
+        """Add size of the data added to the cache entry (or removed, if negative) to the ledger"""
+        key = self.entry_key(path)
+        if key is None:
+            return
+
+        with FileLock('{}.lock'.format(self._index_path())):
+            index = self._read_index()
+            record = index.get(key)
+            # Entries without known size are measured on the next query
+            if isinstance(record, dict) and record.get('size') is not None:
+                record['size'] = max(int(record['size']) + size, 0)
+                record['accessed'] = time.time()
+                write_json(self._index_path(), index)
+
+    def _keys(self, paths):  # type: (Iterable[str]) -> Set[str]
+        return {key for key in (self.entry_key(path) for path in paths) if key is not None}
+
+    def _entry_keys(self):  # type: () -> List[str]
+        """Keys of all entries in the cache directory, without reading their content"""
+        cache_path = self.path()
+        keys = []  # type: List[str]
+        for name in sorted(os.listdir(cache_path)):
+            entry_path = os.path.join(cache_path, name)
+            if name.endswith('.lock') or name.startswith(CACHE_METADATA_NAMES):
+                continue
+
+            if name.startswith(CACHE_CONTAINER_PREFIXES) and os.path.isdir(entry_path):
+                keys.extend(
+                    '{}/{}'.format(name, child) for child in sorted(os.listdir(entry_path))
+                    # Metadata and temporary files of entries are removed with them
+                    if not child.startswith('.') and os.path.isdir(os.path.join(entry_path, child)))
+            else:
+                keys.append(name)
+
+        return keys
+
+    def entries(self, recompute=False, jobs=None):  # type: (bool, int | None) -> List[CacheEntry]
+        """
+        Entries of the cache with sizes from the ledger.
+        Entries missing in the ledger, or all entries if recompute is set, are measured in parallel.
+        Entries missing in the index are considered accessed at the time of modification.
+        """
+        index = self._read_index()
+        keys = self._entry_keys()
+
+        def known_size(key):  # type: (str) -> int | None
+            record = index.get(key)
+            return record.get('size') if isinstance(record, dict) else None
+
+        unknown = [key for key in keys if recompute or known_size(key) is None]
+        measured = {}  # type: Dict[str, int]
+        if unknown:
+            pool = ThreadPool(min(jobs or DEFAULT_SCAN_JOBS, len(unknown)))
+            try:
+                measured = dict(zip(unknown, pool.map(self._entry_size, unknown)))
+            finally:
+                pool.close()
+                pool.join()
+
+        # Entries removed from the disk are removed from the ledger too
+        updates = {key: {'size': size} for key, size in measured.items()}  # type: Dict[str, Dict[str, Any] | None]
+        updates.update({key: None for key in set(index) - set(keys)})
+        self._update_index(updates)
+
+        entries = []
+        for key in keys:
+            entry_path = self._entry_path(key)
+            record = index.get(key)
+            accessed = record.get('accessed') if isinstance(record, dict) else None
+            if accessed is None:
+                try:
+                    accessed = os.path.getmtime(entry_path)
+                except OSError:
+                    continue
+
+            size = measured[key] if key in measured else known_size(key)
+            entries.append(CacheEntry(key, entry_path, int(size or 0), float(accessed)))
+
+        return entries
+
+    def _projects_path(self):  # type: () -> str
+        return os.path.join(self.path(), CACHE_PROJECTS_FILENAME)
+
+    def _read_projects(self):  # type: () -> Dict[str, Any]
+        projects = read_json(self._projects_path(), default={})
+        return projects if isinstance(projects, dict) else {}
+
+    def register_project(self, lock_path, components):  # type: (str, Dict[str, Dict[str, Any]]) -> None
+        """
+        Register the lock file of the project with solved components: name -> version, component_hash
+        and paths of cache entries used by the component in `entries`.
+        Entries referenced by existing lock files are kept by the garbage collection.
+        """
+        record = {
+            'registered': time.time(),
+            'components': {
+                name: dict(component, entries=sorted(self._keys(component.get('entries', []))))
+                for name, component in components.items()
+            },
+        }
+        with FileLock('{}.lock'.format(self._projects_path())):
+            projects = self._read_projects()
+            projects[os.path.abspath(lock_path)] = record
+            write_json(self._projects_path(), projects)
+
+    def projects(self):  # type: () -> Dict[str, Any]
+        """Registered lock files of projects"""
+        return self._read_projects()
+
+    def gc(self, dry_run=False):  # type: (bool) -> GarbageCollection
+        """
+        Remove entries of components from the registry and worktrees of git dependencies
+        that are not referenced by lock files of registered projects, except for ones used recently.
+        Projects with removed lock files are unregistered. Returns removed entries and projects.
+        """
+        with FileLock('{}.lock'.format(self._projects_path())):
+            projects = self._read_projects()
+            removed_projects = sorted(path for path in projects if not os.path.isfile(path))
+            if removed_projects and not dry_run:
+                for path in removed_projects:
+                    del projects[path]
+                write_json(self._projects_path(), projects)
+
+        referenced = set()  # type: Set[str]
+        for lock_path, project in projects.items():
+            if lock_path in removed_projects or not isinstance(project, dict):
+                continue
+            for component in (project.get('components') or {}).values():
+                referenced.update(component.get('entries', []))
+
+        now = time.time()
+
+        def collectable(entry):  # type: (CacheEntry) -> bool
+            return (
+                entry.key.startswith(CACHE_CONTAINER_PREFIXES) and entry.key not in referenced
+                and now - entry.accessed > GC_GRACE_PERIOD)
+
+        removed = [entry for entry in self.entries() if collectable(entry)]
+
+        if not dry_run:
+            for entry in removed:
+                self._remove_entry(entry)
+            self._update_index({entry.key: None for entry in removed})
+
+        return GarbageCollection(removed, removed_projects, self._remove_orphan_blobs(dry_run=dry_run))
+
+    def _blobs_path(self):  # type: () -> str
+        return os.path.join(self.path(), CACHE_BLOBS_DIRNAME)
+
+    def deduplicate(self, path):  # type: (str) -> int
+        """
+        Replace files of the directory with hard links to blobs of the same content and permissions,
+        adding new files to the blob store. Files of cache entries must never be modified in place.
+        Returns the number of bytes shared with existing blobs.
+        """
+        if not cache_dedup_enabled() or not hasattr(os, 'link'):
+            return 0
+
+        shared_size = 0
+        for root, _, filenames in os.walk(path):
+            for filename in filenames:
+                file_path = os.path.join(root, filename)
+                file_stat = os.lstat(file_path)
+                if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_nlink > 1:
+                    continue
+
+                digest = hash_file(file_path)
+                blob_path = os.path.join(
+                    self._blobs_path(), digest[:2], '{}_{:o}'.format(digest, stat.S_IMODE(file_stat.st_mode)))
+                try:
+                    if os.path.isfile(blob_path):
+                        link_path = os.path.join(root, '.{}.blob'.format(filename))
+                        os.link(blob_path, link_path)
+                        replace_file(link_path, file_path)
+                        shared_size += file_stat.st_size
+                    else:
+                        create_directory(os.path.dirname(blob_path))
+                        os.link(file_path, blob_path)
+                except OSError:
+                    # File system doesn't support hard links, or the blob was added or removed concurrently
+                    continue
+
+        return shared_size
+
+    def _remove_orphan_blobs(self, dry_run=False):  # type: (bool) -> int
+        """Remove blobs not linked by any entry of the cache. Returns their size"""
+        removed_size = 0
+        for root, _, filenames in os.walk(self._blobs_path()):
+            for filename in filenames:
+                blob_path = os.path.join(root, filename)
+                try:
+                    blob_stat = os.lstat(blob_path)
+                    if blob_stat.st_nlink == 1:
+                        if not dry_run:
+                            os.remove(blob_path)
+                        removed_size += blob_stat.st_size
+                except OSError:
+                    continue
+
+        return removed_size
+
+    def _stats_path(self):  # type: () -> str
+        return os.path.join(self.path(), CACHE_STATS_FILENAME)
+
+    def record_stats(self, **counters):  # type: (int) -> None
+        """Add values to cumulative counters of the cache, see CACHE_STATS_COUNTERS"""
+        counters = {name: value for name, value in counters.items() if value}
+        if not counters:
+            return
+
+        with FileLock('{}.lock'.format(self._stats_path())):
+            stats = self.stats()
+            for name, value in counters.items():
+                stats[name] = stats.get(name, 0) + value
+            write_json(self._stats_path(), stats)
+
+    def stats(self):  # type: () -> Dict[str, int]
+        """Cumulative counters of the cache, with the time of the first record in `since`"""
+        stored = read_json(self._stats_path(), default={})
+        if not isinstance(stored, dict):
+            stored = {}
+
+        stats = {name: 0 for name in CACHE_STATS_COUNTERS}
+        stats['since'] = int(time.time())
+        for name, value in stored.items():
+            if isinstance(value, int):
+                stats[name] = value
+        return stats
+
+    def _remove_entry(self, entry):  # type: (CacheEntry) -> None
+        # Entries are locked by processes that use them with a lock file next to the entry
+        with FileLock('{}.lock'.format(entry.path)):
+            if os.path.isdir(entry.path):
+                shutil.rmtree(entry.path)
+            elif os.path.exists(entry.path):
+                os.remove(entry.path)
+
+            # Metadata stored next to the entry, like the list of checked out paths of the worktree
+            metadata_path = '{}.json'.format(entry.path)
+            if os.path.isfile(metadata_path):
+                os.remove(metadata_path)
+
+    def prune(self, max_size=None, max_age=None, dry_run=False):
+        # type: (int | None, int | None, bool) -> List[CacheEntry]
+        """
+        Remove least recently used entries until the size of the cache fits into max_size bytes,
+        and entries not used for more than max_age seconds. Returns removed entries.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry.accessed)
+        total_size = sum(entry.size for entry in entries)
+        now = time.time()
+
+        removed = []
+        for entry in entries:
+            expired = bool(max_age and now - entry.accessed > max_age)
+            oversized = bool(max_size and total_size > max_size)
+            if not expired and not oversized:
+                break
+
+            if not dry_run:
+                self._remove_entry(entry)
+            total_size -= entry.size
+            removed.append(entry)
+
+        if not dry_run:
+            self._update_index({entry.key: None for entry in removed})
+            self._remove_orphan_blobs()
+
+        return removed
+
+
+def cache_dedup_enabled():  # type: () -> bool
+    """Store identical files of cache entries once, unless IDF_COMPONENT_CACHE_DEDUP is disabled"""
+    return getenv_bool('IDF_COMPONENT_CACHE_DEDUP', True)
+
+
+def cache_max_size():  # type: () -> int
+    """Maximum size of the cache in bytes from IDF_COMPONENT_CACHE_MAX_SIZE_MB, 0 if not limited"""
+    return max(getenv_int('IDF_COMPONENT_CACHE_MAX_SIZE_MB', 0), 0) * 1024 * 1024
+
+
+def cache_max_age():  # type: () -> int
+    """Maximum time in seconds since the last use of the cache entry from IDF_COMPONENT_CACHE_MAX_AGE_DAYS"""
+    return max(getenv_int('IDF_COMPONENT_CACHE_MAX_AGE_DAYS', 0), 0) * 24 * 60 * 60
 
 
 class SystemCachePath(object):
@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: 2023 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+"""Inter-process locks for directories shared by several processes, like the component cache"""
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+    import msvcrt
+
+try:
+    from typing import Any
+except ImportError:
+    pass
+
+
+class FileLock(object):
+    """
+    Exclusive lock on the file, held while in the context.
+    Locks are released by the OS if the process dies, the lock file itself is never removed to avoid races.
+    The lock is not reentrant, and it is exclusive for threads of the same process too.
+    """
+    def __init__(self, path):  # type: (str) -> None
+        self.path = path
+        self._fd = None  # type: int | None
+
+    def acquire(self):  # type: () -> None
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another process
+                if not os.path.isdir(directory):
+                    raise
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        # Tries to lock for 10 seconds and raises an error after that
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)  # type: ignore
+                        break
+                    except (IOError, OSError):
+                        time.sleep(0.1)
+        except BaseException:
+            os.close(fd)
+            raise
+
+        self._fd = fd
+
+    def release(self):  # type: () -> None
+        if self._fd is None:
+            return
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)  # type: ignore
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):  # type: () -> FileLock
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):  # type: (Any) -> None
+        self.release()
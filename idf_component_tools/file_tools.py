@@ -1,18 +1,35 @@
 # SPDX-FileCopyrightText: 2022-2023 Espressif Systems (Shanghai) CO LTD
 # SPDX-License-Identifier: Apache-2.0
 """Set of tools and constants to work with files and directories """
+import fnmatch
+import json
 import os
+import re
 import shutil
+import stat
+import tempfile
+from io import open
 from pathlib import Path
-from shutil import copytree, rmtree
+from shutil import rmtree
 
+from idf_component_tools.copy_tools import COPY_BUFFER_SIZE, copy_files
 from idf_component_tools.errors import warn
 
 try:
-    from typing import Iterable
+    from typing import Any, Dict, Iterable, List, Set, Tuple
 except ImportError:
     pass
 
+# Files of the component manager checking integrity of a directory: hash file, cache of digests of files, etc.
+# They describe only the directory they are in and are never copied with its content
+INTEGRITY_FILES = [
+    '.component_hash',
+    '.component_hash_cache*',
+    '.component_hash_tree',
+    '.component_hash_stat',
+    '.component_hash_stamp',
+]
+
 DEFAULT_EXCLUDE = [
     # Python files
     '**/__pycache__',
@@ -41,15 +58,196 @@ DEFAULT_EXCLUDE = [
     '**/.settings/**/*',
     '**/sdkconfig',
     '**/sdkconfig.old',
-    # Hash file
-    '**/.component_hash'
-]
+] + ['**/{}'.format(name) for name in INTEGRITY_FILES]
 
 UNEXPECTED_FILES = {
     'CMakeCache.txt',
 }
 
 
+def _pattern_parts(pattern):  # type: (str) -> List[str]
+    return [part for part in pattern.replace('\\', '/').split('/') if part and part != '.']
+
+
+def _match_parts(path_parts, pattern_parts, is_dir):  # type: (List[str], List[str], bool) -> bool
+    """Match path against the pattern in the same way as `Path.glob` does"""
+    if not pattern_parts:
+        return not path_parts
+
+    part = pattern_parts[0]
+    if part == '**':
+        # Recursive wildcard as the last part matches only directories, including the current one
+        if len(pattern_parts) == 1:
+            return is_dir
+
+        # Matches zero or more directories
+        for skip in range(len(path_parts)):
+            if _match_parts(path_parts[skip:], pattern_parts[1:], is_dir):
+                return True
+
+        return False
+
+    if not path_parts or not fnmatch.fnmatch(path_parts[0], part):
+        return False
+
+    return _match_parts(path_parts[1:], pattern_parts[1:], is_dir)
+
+
+def _may_match_below(path_parts, pattern_parts):  # type: (List[str], List[str]) -> bool
+    """False if the pattern can't match anything inside of the directory"""
+    for index, part in enumerate(pattern_parts):
+        if part == '**':
+            return True
+
+        if index == len(path_parts):
+            return True
+
+        if not fnmatch.fnmatch(path_parts[index], part):
+            return False
+
+    return False
+
+
+def _segment_regex(part):  # type: (str) -> str
+    """Regular expression for the part of the glob pattern, wildcards don't match path separators"""
+    regex = []
+    index, length = 0, len(part)
+    while index < length:
+        char = part[index]
+        index += 1
+        if char == '*':
+            regex.append('[^/]*')
+        elif char == '?':
+            regex.append('[^/]')
+        elif char == '[':
+            end = index
+            if end < length and part[end] == '!':
+                end += 1
+            if end < length and part[end] == ']':
+                end += 1
+            while end < length and part[end] != ']':
+                end += 1
+
+            if end >= length:
+                regex.append('\\[')
+            else:
+                chars = part[index:end].replace('\\', '\\\\')
+                index = end + 1
+                if chars[0] == '!':
+                    chars = '^/' + chars[1:]
+                elif chars[0] == '^':
+                    chars = '\\' + chars
+                regex.append('[{}]'.format(chars))
+        else:
+            regex.append(re.escape(char))
+
+    return ''.join(regex)
+
+
+def _pattern_regex(pattern_parts):  # type: (List[str]) -> str
+    regex = ''
+    for index, part in enumerate(pattern_parts):
+        is_last = index == len(pattern_parts) - 1
+        if part != '**':
+            regex += _segment_regex(part) + ('' if is_last else '/')
+        elif not is_last:
+            # Zero or more directories, repeated recursive wildcards are the same as one
+            if pattern_parts[index + 1] != '**':
+                regex += '(?:[^/]+/)*'
+        elif regex:
+            # The directory matched by the previous parts and all directories inside of it
+            regex = regex[:-1] + '(?:/[^/]+)*'
+        else:
+            regex = '[^/]+(?:/[^/]+)*'
+
+    return regex
+
+
+def _compile_patterns(patterns):  # type: (List[List[str]]) -> Any
+    """One regular expression matching any of patterns, None if there are no patterns"""
+    if not patterns:
+        return None
+
+    # Paths are case insensitive on Windows, like in `Path.glob`
+    flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+    return re.compile('(?:{})\\Z'.format('|'.join('(?:{})'.format(_pattern_regex(parts)) for parts in patterns)), flags)
+
+
+class PathFilter(object):
+    """Applies rules of `filtered_paths` to paths relative to the base directory, without the file system"""
+    def __init__(
+            self,
+            include=None,  # type: Iterable[str] | None
+            exclude=None,  # type: Iterable[str] | None
+            exclude_default=True,  # type: bool
+    ):
+        # type: (...) -> None
+        exclude_patterns = []  # type: List[str]
+
+        if exclude_default:
+            for pattern in DEFAULT_EXCLUDE:
+                exclude_patterns.append(pattern)
+                if pattern.endswith('/**/*'):
+                    exclude_patterns.append(pattern[:pattern.rindex('/**/*')])
+
+        exclude_patterns.extend(exclude or [])
+
+        self.include = [parts for parts in (_pattern_parts(pattern) for pattern in include or []) if parts]
+        self.exclude = [parts for parts in (_pattern_parts(pattern) for pattern in exclude_patterns) if parts]
+
+        # All patterns are matched by one regular expression for files and one for directories,
+        # recursive wildcard as the last part of the pattern matches only directories
+        self._include_files = _compile_patterns([parts for parts in self.include if parts[-1] != '**'])
+        self._include_dirs = _compile_patterns(self.include)
+        self._exclude_files = _compile_patterns([parts for parts in self.exclude if parts[-1] != '**'])
+        self._exclude_dirs = _compile_patterns(self.exclude)
+
+        # Patterns excluding everything inside of matching directories, like `**/.git/**/*`
+        self._exclude_trees = [parts[:-2] for parts in self.exclude if parts[-2:] == ['**', '*']]
+
+    def match(self, path, is_dir=False):  # type: (str, bool) -> bool
+        """Returns True if relative path (with '/' separators) is in the filtered set of paths"""
+        path = '/'.join(_pattern_parts(path))
+
+        include = self._include_dirs if is_dir else self._include_files
+        if include is not None and include.match(path):
+            return True
+
+        exclude = self._exclude_dirs if is_dir else self._exclude_files
+        return exclude is None or not exclude.match(path)
+
+    def prunable(self, path):  # type: (str) -> bool
+        """
+        Returns True if nothing inside of the directory is in the filtered set of paths:
+        everything is excluded and no include pattern may match.
+        """
+        path_parts = _pattern_parts(path)
+        if not any(_match_parts(path_parts, parts, True) for parts in self._exclude_trees):
+            return False
+
+        return not any(_may_match_below(path_parts, parts) for parts in self.include)
+
+
+def _list_directory(path):  # type: (str) -> List[Tuple[str, bool, bool]]
+    """Names of entries of the directory, if they are directories (not following symlinks), and symlinks"""
+    try:
+        if hasattr(os, 'scandir'):
+            return [
+                (entry.name, entry.is_dir(follow_symlinks=False), entry.is_symlink())
+                for entry in os.scandir(path)  # type: ignore
+            ]
+
+        # Python 2
+        entries = []
+        for name in os.listdir(path):
+            mode = os.lstat(os.path.join(path, name)).st_mode
+            entries.append((name, stat.S_ISDIR(mode), stat.S_ISLNK(mode)))
+        return entries
+    except OSError:
+        # Unreadable directories are skipped, like by `Path.glob`
+        return []
+
+
 def filtered_paths(
         path,  # type: str | Path
         include=None,  # type: Iterable[str] | None
@@ -57,40 +255,42 @@ def filtered_paths(
         exclude_default=True,  # type: bool
 ):
     # type: (...) -> set[Path]
-    """Returns set of paths that should be included in component archive"""
+    """
+    Returns set of paths that should be included in component archive:
+    everything except for excluded paths, and paths matching include patterns.
 
+    The tree is walked once, excluded directories are not entered if nothing inside of them may be included.
+    Patterns are matched like by `Path.glob`, symlinks to directories are not followed by recursive wildcards.
+    """
     if include is None:
         include = set()
 
-    if exclude is None:
-        exclude = set()
-
+    path_filter = PathFilter(include=include, exclude=exclude, exclude_default=exclude_default)
     base_path = Path(path)
     paths = set()  # type: set[Path]
-
-    def include_paths(pattern):
-        paths.update(base_path.glob(pattern))
-
-    def exclude_paths(pattern):
-        paths.difference_update(base_path.glob(pattern))
-
-    # First include everything
-    include_paths('**/*')
-
-    # Exclude all defaults, including directories
-    if exclude_default:
-        for pattern in DEFAULT_EXCLUDE:
-            exclude_paths(pattern)
-            if pattern.endswith('/**/*'):
-                exclude_paths(pattern[:pattern.rindex('/**/*')])
-
-    # Exclude user patterns
-    for pattern in exclude:
-        exclude_paths(pattern)
-
-    # Include everything that was explicitly added
-    for pattern in include:
-        include_paths(pattern)
+    has_linked_directories = False
+
+    directories = ['']
+    while directories:
+        directory = directories.pop()
+        for name, is_dir, is_link in _list_directory(os.path.join(str(base_path), directory)):
+            relative_path = '{}/{}'.format(directory, name) if directory else name
+            if path_filter.match(relative_path, is_dir=is_dir):
+                paths.add(base_path / relative_path)
+
+            if is_dir and not path_filter.prunable(relative_path):
+                directories.append(relative_path)
+            elif is_link and os.path.isdir(os.path.join(str(base_path), relative_path)):
+                has_linked_directories = True
+
+    # Recursive wildcard alone matches the base directory itself, like `Path.glob('**')`
+    if any(set(_pattern_parts(pattern)) == {'**'} for pattern in include):
+        paths.add(base_path)
+
+    # Include patterns may match paths inside of symlinks to directories, which are not walked
+    if has_linked_directories:
+        for pattern in include:
+            paths.update(base_path.glob(pattern))
 
     return paths
 
@@ -115,26 +315,44 @@ def prepare_empty_directory(directory):  # type: (str) -> None
 
 
 def copy_directory(source_directory, destination_directory):  # type: (str, str) -> None
+    """Replace destination directory with a copy of the source directory, like `shutil.copytree`"""
     if os.path.exists(destination_directory):
         rmtree(destination_directory)
-    copytree(source_directory, destination_directory)
+
+    directories = [source_directory]
+    paths = []  # type: List[str]
+    # Symlinks are followed, as by `shutil.copytree`
+    for root, dirs, files in os.walk(source_directory, followlinks=True):
+        directories.extend(os.path.join(root, name) for name in dirs)
+        paths.extend(os.path.join(root, name) for name in dirs + files)
+
+    os.makedirs(destination_directory)
+    copy_directories(source_directory, destination_directory, paths)
+
+    # Timestamps of directories are changed by copying files into them, they are copied at the end
+    for directory in reversed(directories):
+        shutil.copystat(directory, os.path.join(destination_directory, os.path.relpath(directory, source_directory)))
 
 
-def copy_directories(source_directory, destination_directory, paths):  # type: (str, str, Iterable[Path]) -> None
-    for path in sorted(paths):
-        path = str(path)  # type: ignore # Path backward compatibility
+def copy_directories(source_directory, destination_directory, paths):
+    # type: (str, str, Iterable[Path | str]) -> None
+    """Copy files and directories from the source to the destination directory with the same relative paths"""
+    created = set()  # type: Set[str]
+    files = []  # type: List[Tuple[str, str]]
+    for path in sorted(str(path) for path in paths):
         rel_path = os.path.relpath(path, source_directory)
         dest_path = os.path.join(destination_directory, rel_path)
 
-        if os.path.isfile(path):
-            dest_dir = os.path.dirname(dest_path)
-
-            if not os.path.exists(dest_dir):
+        dest_dir = dest_path if not os.path.isfile(path) else os.path.dirname(dest_path)
+        if dest_dir not in created:
+            if not os.path.isdir(dest_dir):
                 os.makedirs(dest_dir)
+            created.add(dest_dir)
 
-            shutil.copy2(path, dest_path)
-        else:
-            os.makedirs(dest_path)
+        if dest_dir != dest_path:
+            files.append((path, dest_path))
+
+    copy_files(files)
 
 
 def copy_filtered_directory(source_directory, destination_directory, include=None, exclude=None):
@@ -144,6 +362,90 @@ def copy_filtered_directory(source_directory, destination_directory, include=Non
     copy_directories(source_directory, destination_directory, paths)
 
 
+def _same_content(first_path, second_path):  # type: (str, str) -> bool
+    """Compare files byte by byte, unlike `filecmp.cmp` results are not cached by sizes and mtimes"""
+    if os.path.getsize(first_path) != os.path.getsize(second_path):
+        return False
+
+    with open(first_path, 'rb') as first, open(second_path, 'rb') as second:
+        while True:
+            first_chunk = first.read(COPY_BUFFER_SIZE)
+            if first_chunk != second.read(COPY_BUFFER_SIZE):
+                return False
+            if not first_chunk:
+                return True
+
+
+def sync_directory(source_directory, destination_directory, paths=None):
+    # type: (str, str, Iterable[Path | str] | None) -> None
+    """
+    Make the destination directory the same as the source directory, or as `paths` from it, like `rsync --delete`.
+    Only files with different content are copied and files missing in the source are removed.
+    Unchanged files keep their inodes and timestamps, so build systems don't rebuild them.
+    Integrity files of the source directory (i.e. the local hash stamp of a cache entry) are not copied.
+    """
+    if paths is None:
+        # Symlinks are followed, as by `copy_directory`
+        paths = []
+        for root, dirs, files in os.walk(source_directory, followlinks=True):
+            paths.extend(os.path.join(root, name) for name in dirs)
+            paths.extend(
+                os.path.join(root, name) for name in files
+                if not any(fnmatch.fnmatch(name, pattern) for pattern in INTEGRITY_FILES))
+
+    source_entries = {}  # type: Dict[str, bool]
+    for path in paths:
+        source_entries[os.path.relpath(str(path), source_directory)] = os.path.isdir(str(path))
+
+    if os.path.lexists(destination_directory) and not os.path.isdir(destination_directory):
+        os.remove(destination_directory)
+    create_directory(destination_directory)
+
+    # Remove paths missing in the source, or with another type, deepest first
+    destination_entries = {}  # type: Dict[str, bool]
+    for root, dirs, files in os.walk(destination_directory):
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            destination_entries[os.path.relpath(
+                path, destination_directory)] = (os.path.isdir(path) and not os.path.islink(path))
+
+    for rel_path in sorted(destination_entries, reverse=True):
+        is_dir = destination_entries[rel_path]
+        path = os.path.join(destination_directory, rel_path)
+        if source_entries.get(rel_path) == is_dir and not os.path.islink(path):
+            continue
+
+        if is_dir:
+            rmtree(path)
+        else:
+            os.remove(path)
+        del destination_entries[rel_path]
+
+    copies = []  # type: List[Tuple[str, str]]
+    for rel_path, is_dir in sorted(source_entries.items()):
+        source_path = os.path.join(source_directory, rel_path)
+        path = os.path.join(destination_directory, rel_path)
+        if is_dir:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            continue
+
+        if rel_path in destination_entries:
+            # Files of registry archives have normalized mtimes, only the content tells if the file has changed
+            if _same_content(source_path, path):
+                if stat.S_IMODE(os.stat(source_path).st_mode) != stat.S_IMODE(os.stat(path).st_mode):
+                    shutil.copymode(source_path, path)
+                continue
+
+            os.remove(path)
+        elif not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        copies.append((source_path, path))
+
+    copy_files(copies)
+
+
 def check_unexpected_component_files(path):  # type: (str | Path) -> None
     '''Create a warning if a directory contains files not expected inside component'''
     for root, _dirs, files in os.walk(str(path)):
@@ -155,15 +457,96 @@ def check_unexpected_component_files(path):  # type: (str | Path) -> None
                     files=', '.join(unexpected_files), path=os.path.relpath(root, start=str(path))))
 
 
+def replace_file(source, destination):  # type: (str, str) -> None
+    """Atomically replace destination file with the source file"""
+    if hasattr(os, 'replace'):
+        os.replace(source, destination)
+    else:
+        # Python 2: rename can't overwrite existing files on Windows
+        if os.name == 'nt' and os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+def replace_directory(source, destination):  # type: (str, str) -> None
+    """
+    Replace destination directory with the complete source directory from the same file system.
+    Readers never see a partially written or partially removed directory, but the destination doesn't exist
+    for a moment between two renames. Concurrent writers must hold a lock of the destination.
+    """
+    if not os.path.isdir(destination):
+        os.rename(source, destination)
+        return
+
+    # The previous directory is moved aside to a unique path and removed after the new one is in place
+    parent, name = os.path.split(os.path.abspath(destination))
+    old_path = tempfile.mkdtemp(prefix='.{}_old_'.format(name), dir=parent)
+    try:
+        os.rename(destination, os.path.join(old_path, name))
+        try:
+            os.rename(source, destination)
+        except OSError:
+            os.rename(os.path.join(old_path, name), destination)
+            raise
+    finally:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+def read_json(path, default=None):  # type: (str, Any) -> Any
+    """Read JSON file, return default value if file doesn't exist or is corrupted"""
+    try:
+        with open(path, mode='r', encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def write_json(path, data):  # type: (str, Any) -> None
+    """Write JSON file atomically, so concurrent readers never see a partially written file"""
+    directory = os.path.dirname(path)
+    create_directory(directory)
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.{}.'.format(os.path.basename(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(data, sort_keys=True).encode('utf-8'))
+        replace_file(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
 def directory_size(dir_path):  # type: (str) -> int
-    '''Return the total size of all files in the directory tree'''
+    '''Return the total size of all files in the directory tree, symlinks are not followed'''
+    if not hasattr(os, 'scandir'):
+        # Python 2
+        total_size = 0
+        for root, _, files in os.walk(dir_path):
+            for name in files:
+                try:
+                    total_size += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+        return total_size
+
     total_size = 0
-    directory = Path(dir_path)
-    for file in directory.glob('**/*'):
+    directories = [dir_path]
+    while directories:
         try:
-            total_size += os.stat(str(file)).st_size
+            iterator = os.scandir(directories.pop())  # type: ignore
         except OSError:
-            pass
+            continue
+
+        for entry in iterator:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                else:
+                    total_size += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass
+
     return total_size
 
 
@@ -0,0 +1,277 @@
+# SPDX-FileCopyrightText: 2023 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+"""
+Backends for read-only operations on cached bare repositories: resolving refs, reading objects and checkouts.
+The git CLI backend works everywhere, the libgit2 backend (pygit2) runs in the process without spawning git.
+"""
+import atexit
+import os
+import subprocess  # nosec
+import threading
+from collections import namedtuple
+
+from .errors import warn
+
+try:
+    from typing import Any, Callable, Dict, List, Tuple
+except ImportError:
+    pass
+
+try:
+    import pygit2  # type: ignore
+except ImportError:
+    pygit2 = None  # type: ignore
+
+AUTO_BACKEND = 'auto'
+CLI_BACKEND = 'cli'
+PYGIT2_BACKEND = 'pygit2'
+GIT_BACKENDS = (AUTO_BACKEND, CLI_BACKEND, PYGIT2_BACKEND)
+
+# GIT_REPOSITORY_OPEN_NO_SEARCH flag of libgit2, exported under different names by versions of pygit2
+LIBGIT2_OPEN_NO_SEARCH = 1
+
+GitObject = namedtuple('GitObject', ['sha', 'type', 'data'])
+
+
+# Git error that is supposed to be handled in the code, non-fatal
+class GitCommandError(Exception):
+    pass
+
+
+def git_backend_name():  # type: () -> str
+    """Name of the backend from the IDF_COMPONENT_GIT_BACKEND environment variable: auto, cli or pygit2"""
+    name = os.getenv('IDF_COMPONENT_GIT_BACKEND', AUTO_BACKEND).strip().lower() or AUTO_BACKEND
+    if name not in GIT_BACKENDS:
+        warn(
+            'Unknown git backend "{}" in IDF_COMPONENT_GIT_BACKEND, expected one of: {}. '
+            'Using "{}".'.format(name, ', '.join(GIT_BACKENDS), AUTO_BACKEND))
+        return AUTO_BACKEND
+
+    return name
+
+
+class GitObjectReader(object):
+    """Long-lived `git cat-file --batch` process reading objects straight from the object database"""
+    def __init__(self, git_command, git_dir):  # type: (str, str) -> None
+        self.git_dir = git_dir
+        self._lock = threading.Lock()
+        self._devnull = open(os.devnull, 'wb')
+        self._process = subprocess.Popen(  # nosec
+            [git_command, '--git-dir', git_dir, 'cat-file', '--batch'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self._devnull,
+        )
+        self._stdin = self._process.stdin  # type: Any
+        self._stdout = self._process.stdout  # type: Any
+
+    def read(self, name):  # type: (str) -> GitObject | None
+        """Read object by the name (sha, `<ref>:<path>`, etc). Returns None if object doesn't exist"""
+        if '\n' in name:
+            raise GitCommandError('Invalid object name "{}"'.format(name))
+
+        with self._lock:
+            if self._process.poll() is not None:
+                raise GitCommandError('git cat-file process for "{}" has exited unexpectedly'.format(self.git_dir))
+
+            self._stdin.write(name.encode('utf-8') + b'\n')
+            self._stdin.flush()
+
+            header = self._stdout.readline().decode('utf-8')
+            if not header:
+                raise GitCommandError('git cat-file process for "{}" has exited unexpectedly'.format(self.git_dir))
+
+            # "<name> missing" or "<name> ambiguous"
+            if header.rstrip('\n') in ('{} missing'.format(name), '{} ambiguous'.format(name)):
+                return None
+
+            sha, object_type, size = header.split()
+            data = self._stdout.read(int(size))
+            # Every object is followed by a line feed
+            self._stdout.read(1)
+
+        return GitObject(sha, object_type, data)
+
+    @property
+    def alive(self):  # type: () -> bool
+        return self._process.poll() is None
+
+    def close(self):  # type: () -> None
+        if self._process.poll() is None:
+            self._stdin.close()
+            self._process.wait()
+            self._stdout.close()
+        self._devnull.close()
+
+
+class GitBackend(object):
+    """Read-only operations on the bare repository"""
+    name = ''
+
+    def supports(self, bare_path):  # type: (str) -> bool
+        """True if the backend can work with the repository"""
+        return True
+
+    def supports_checkout(self, bare_path):  # type: (str) -> bool
+        return True
+
+    def resolve_ref(self, bare_path, ref):  # type: (str, str) -> str | None
+        """Id of the object the ref points to, like `git rev-parse --verify`. None if the ref doesn't exist"""
+        raise NotImplementedError
+
+    def has_object(self, bare_path, object_id):  # type: (str, str) -> bool
+        raise NotImplementedError
+
+    def read_object(self, bare_path, name):  # type: (str, str) -> GitObject | None
+        """Read object by the name (sha, `<ref>:<path>`, etc). Returns None if object doesn't exist"""
+        raise NotImplementedError
+
+    def checkout(self, bare_path, commit_id, checkout_path, paths=None):
+        # type: (str, str, str, List[str] | None) -> None
+        """Check out files of the commit, or only selected paths, into the directory"""
+        raise NotImplementedError
+
+
+class CliGitBackend(GitBackend):
+    """Runs git commands, objects are read by long-lived `git cat-file` processes shared by all clients"""
+    name = CLI_BACKEND
+
+    _object_readers = {}  # type: Dict[Tuple[str, str], GitObjectReader]
+    _lock = threading.Lock()
+
+    def __init__(self, git_command, run):  # type: (str, Callable[..., str]) -> None
+        self.git_command = git_command
+        self.run = run
+
+    def object_reader(self, bare_path):  # type: (str) -> GitObjectReader
+        key = (self.git_command, os.path.abspath(bare_path))
+        with self._lock:
+            reader = self._object_readers.get(key)
+            if reader is None or not reader.alive:
+                reader = GitObjectReader(self.git_command, bare_path)
+                atexit.register(reader.close)
+                self._object_readers[key] = reader
+
+        return reader
+
+    def resolve_ref(self, bare_path, ref):  # type: (str, str) -> str | None
+        try:
+            return self.run(['rev-parse', '--verify', ref], cwd=bare_path).strip()
+        except GitCommandError:
+            return None
+
+    def has_object(self, bare_path, object_id):  # type: (str, str) -> bool
+        try:
+            self.run(['cat-file', '-e', object_id], cwd=bare_path)
+            return True
+        except GitCommandError:
+            return False
+
+    def read_object(self, bare_path, name):  # type: (str, str) -> GitObject | None
+        return self.object_reader(bare_path).read(name)
+
+    def checkout(self, bare_path, commit_id, checkout_path, paths=None):
+        # type: (str, str, str, List[str] | None) -> None
+        checkout_command = ['--work-tree', checkout_path, '--git-dir', bare_path, 'checkout', '--force', commit_id]
+        if paths:
+            checkout_command += ['--'] + paths
+        self.run(checkout_command)
+
+        # And remove all untracked files
+        self.run(['--work-tree', checkout_path, '--git-dir', bare_path, 'clean', '--force'])
+
+
+class Pygit2GitBackend(GitBackend):
+    """
+    Works with repositories in the process with libgit2.
+    Partial clones and custom filter drivers are not supported by libgit2, git CLI is used for them.
+    """
+    name = PYGIT2_BACKEND
+
+    # Repository objects of libgit2 must not be used by several threads at once
+    _repositories = {}  # type: Dict[str, Any]
+    _lock = threading.RLock()
+
+    @staticmethod
+    def available():  # type: () -> bool
+        return pygit2 is not None
+
+    def _repository(self, bare_path):  # type: (str) -> Any
+        path = os.path.abspath(bare_path)
+        repository = self._repositories.get(path)
+        if repository is None:
+            # Don't look for repositories in parent directories, the mirror may be not initialized yet
+            repository = pygit2.Repository(path, LIBGIT2_OPEN_NO_SEARCH)  # type: ignore
+            self._repositories[path] = repository
+
+        return repository
+
+    def _config_value(self, bare_path, name):  # type: (str, str) -> str | None
+        config = self._repository(bare_path).config
+        return config[name] if name in config else None
+
+    def supports(self, bare_path):  # type: (str) -> bool
+        with self._lock:
+            try:
+                return (self._config_value(bare_path, 'remote.origin.promisor') or '').lower() != 'true'
+            except pygit2.GitError:
+                return False
+
+    def supports_checkout(self, bare_path):  # type: (str) -> bool
+        """Filter drivers (e.g. git-lfs) are run only by git CLI"""
+        with self._lock:
+            config = self._repository(bare_path).config
+            return not any(entry.name.startswith('filter.') for entry in config)
+
+    def _lookup(self, bare_path, name):  # type: (str, str) -> Any
+        try:
+            return self._repository(bare_path).revparse_single(name)
+        except (KeyError, ValueError, pygit2.GitError):
+            return None
+
+    def resolve_ref(self, bare_path, ref):  # type: (str, str) -> str | None
+        with self._lock:
+            git_object = self._lookup(bare_path, ref)
+            return str(git_object.id) if git_object is not None else None
+
+    def has_object(self, bare_path, object_id):  # type: (str, str) -> bool
+        with self._lock:
+            try:
+                return object_id in self._repository(bare_path)
+            except (KeyError, ValueError, pygit2.GitError):
+                return False
+
+    def read_object(self, bare_path, name):  # type: (str, str) -> GitObject | None
+        with self._lock:
+            git_object = self._lookup(bare_path, name)
+            if git_object is None:
+                return None
+
+            return GitObject(str(git_object.id), git_object.type_str, git_object.read_raw())
+
+    def checkout(self, bare_path, commit_id, checkout_path, paths=None):
+        # type: (str, str, str, List[str] | None) -> None
+        with self._lock:
+            commit = self._lookup(bare_path, commit_id)
+            if commit is None:
+                raise GitCommandError('Commit "{}" doesn\'t exist in "{}"'.format(commit_id, bare_path))
+
+            tree = commit.peel(pygit2.Commit).tree
+            # Root of the repository in paths means the whole tree, like for git CLI
+            if paths and any(path.strip('/') in ('', '.') for path in paths):
+                paths = None
+
+            for path in paths or []:
+                # libgit2 ignores paths that don't match anything, unlike git CLI
+                if path.strip('/') not in tree:
+                    raise GitCommandError('error: pathspec \'{}\' did not match any file(s) known to git'.format(path))
+
+            try:
+                # The bare repository has no index, the directory is just a target for files
+                self._repository(bare_path).checkout_tree(
+                    tree,
+                    directory=os.path.abspath(checkout_path),
+                    paths=paths or None,
+                    strategy=pygit2.GIT_CHECKOUT_FORCE | pygit2.GIT_CHECKOUT_DONT_UPDATE_INDEX)
+            except (KeyError, ValueError, pygit2.GitError) as e:
+                raise GitCommandError('Checkout of "{}" from "{}" failed: {}'.format(commit_id, bare_path, e))
@@ -1,35 +1,167 @@
 # SPDX-FileCopyrightText: 2022-2023 Espressif Systems (Shanghai) CO LTD
 # SPDX-License-Identifier: Apache-2.0
 
+import binascii
+import inspect
 import os
+import posixpath
 import re
+import shutil
 import subprocess  # nosec
+import tarfile
+import tempfile
+import threading
 import time
-from datetime import datetime
+from collections import namedtuple
 from functools import wraps
 
+from .environment import getenv_int
 from .errors import GitError, warn
+from .file_lock import FileLock
+from .file_tools import read_json, write_json
+from .git_backends import (
+    AUTO_BACKEND, PYGIT2_BACKEND, CliGitBackend, GitBackend, GitCommandError, Pygit2GitBackend, git_backend_name)
 from .semver import Version
 
 try:
-    from typing import Any, Callable, List, Optional, Union
+    from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 except ImportError:
     pass
 
+# Modes of entries in git tree objects
+TREE_MODE = '40000'
+SYMLINK_MODE = '120000'
+GITLINK_MODE = '160000'
+
+# Partial clone with lazy fetching of missing objects and `fetch --no-write-fetch-head`
+PARTIAL_CLONE_MIN_GIT_VERSION = Version('2.29.0')
+AUTO_PARTIAL_CLONE = 'auto'
+DEFAULT_PARTIAL_CLONE_THRESHOLD_MB = 100
+# Maximum number of object ids passed to one `git fetch`, to fit into the command line length limit
+FETCH_OBJECTS_CHUNK_SIZE = 500
+
+# `ls-remote --symref` to find the default branch of the remote
+LS_REMOTE_SYMREF_MIN_GIT_VERSION = Version('2.8.0')
+DEFAULT_FETCH_INTERVAL = 60
+# Results of the last check of remote refs, stored in the bare repository
+REMOTE_REFS_FILENAME = 'idf_component_remote_refs.json'
+REMOTE_HEAD = 'HEAD'
+
+OBJECT_ID_RE = re.compile(r'^(?:[0-9a-f]{40}|[0-9a-f]{64})$')
+
+# Objects of submodules are borrowed from shared mirrors and copied to submodule repositories
+SUBMODULE_DISSOCIATE_MIN_GIT_VERSION = Version('2.18.0')
+
+# Maintenance of bare repositories
+COMMIT_GRAPH_MIN_GIT_VERSION = Version('2.18.0')
+COMMIT_GRAPH_SPLIT_MIN_GIT_VERSION = Version('2.22.0')
+AUTO_MAINTENANCE_INTERVAL = 7 * 24 * 60 * 60
+MAINTENANCE_FILENAME = 'idf_component_maintenance.json'
+
+TreeEntry = namedtuple('TreeEntry', ['mode', 'type', 'sha', 'path'])
+ObjectsCount = namedtuple('ObjectsCount', ['size', 'loose_objects', 'packs'])
+MaintenanceStats = namedtuple('MaintenanceStats', ['before', 'after', 'duration'])
+
+
+def normalize_tree_path(path):  # type: (str | None) -> str
+    """Convert path inside of the repository to the form used in git object names, '' for the root"""
+    if not path:
+        return ''
+
+    path = posixpath.normpath(path.replace('\\', '/')).strip('/')
+    return '' if path == '.' else path
+
+
+def partial_clone_filter():  # type: () -> str | None
+    """
+    Filter for partial clone of bare mirrors from the IDF_COMPONENT_GIT_PARTIAL_CLONE_FILTER environment variable:
+    git filter spec (e.g. `blob:none`, `tree:0`), `auto` to filter new mirrors and existing mirrors
+    larger than the threshold, or None
+    """
+    value = os.getenv('IDF_COMPONENT_GIT_PARTIAL_CLONE_FILTER', '').strip()
+    if value.lower() in ('', '0', 'f', 'false', 'n', 'no'):
+        return None
+
+    return value
+
+
+def mirror_lock_path(bare_path):  # type: (str) -> str
+    """Lock file of the bare repository, placed next to it to keep content of the repository untouched"""
+    return '{}.lock'.format(os.path.normpath(bare_path))
+
+
+def fetch_interval():  # type: () -> int
+    """
+    Minimal interval in seconds between checks of the remote for updates of the same ref
+    from the IDF_COMPONENT_GIT_FETCH_INTERVAL environment variable
+    """
+    return max(getenv_int('IDF_COMPONENT_GIT_FETCH_INTERVAL', DEFAULT_FETCH_INTERVAL), 0)
+
+
+def parse_tree(data, sha_length=20):  # type: (bytes, int) -> List[TreeEntry]
+    """Parse raw content of the git tree object"""
+    entries = []
+    position = 0
+    while position < len(data):
+        space = data.index(b' ', position)
+        nul = data.index(b'\0', space)
+        mode = data[position:space].decode('ascii')
+        name = data[space + 1:nul].decode('utf-8')
+        sha = binascii.hexlify(data[nul + 1:nul + 1 + sha_length]).decode('ascii')
+        position = nul + 1 + sha_length
+
+        if mode == TREE_MODE:
+            entry_type = 'tree'
+        elif mode == GITLINK_MODE:
+            entry_type = 'commit'
+        else:
+            entry_type = 'blob'
 
-# Git error that is supposed to be handled in the code, non-fatal
-class GitCommandError(Exception):
-    pass
+        entries.append(TreeEntry(mode, entry_type, sha, name))
+
+    return entries
 
 
 class GitClient(object):
     """ Set of tools for working with git repos """
-    def __init__(self, git_command='git', min_supported='2.0.0'):  # type: (str, Union[str, Version]) -> None
+
+    # Parsed trees and resolved refs are shared by all clients, as well as readers of backends,
+    # so components from the same repository are read by one process
+    _trees = {}  # type: Dict[Tuple[str, str], List[TreeEntry]]
+    # Commit ids of refs with the time the remote was checked, None for refs that never change
+    _resolved_refs = {}  # type: Dict[Tuple[str, str], Tuple[str, float | None]]
+    _shared_lock = threading.Lock()
+
+    def __init__(
+            self,
+            git_command='git',  # type: str
+            min_supported='2.0.0',  # type: Union[str, Version]
+            partial_clone_filter=None,  # type: str | None
+            fetch_interval=DEFAULT_FETCH_INTERVAL,  # type: int
+            backend=None,  # type: str | None
+    ):  # type: (...) -> None
         self.git_command = git_command or 'git'
         self.git_min_supported = min_supported if isinstance(min_supported, Version) else Version(min_supported)
+        self.partial_clone_filter = partial_clone_filter
+        self.fetch_interval = fetch_interval
 
         self._git_checked = False
-        self._repo_updated = False
+        self._git_version = None  # type: Version | None
+        self._updated_refs = set()  # type: Set[Tuple[str, str | None]]
+        # Mirrors changed by this client, to account their new sizes
+        self._updated_mirrors = set()  # type: Set[str]
+        # Numbers of fetches done and skipped by this client, for statistics of the cache
+        self._fetch_stats = {}  # type: Dict[str, int]
+
+        # Read-only operations run in the process with libgit2 if it's available, git CLI is used otherwise
+        self.backend = backend or git_backend_name()
+        self._cli_backend = CliGitBackend(self.git_command, self.run)
+        self._pygit2_backend = None  # type: Pygit2GitBackend | None
+        if self.backend in (AUTO_BACKEND, PYGIT2_BACKEND):
+            if Pygit2GitBackend.available():
+                self._pygit2_backend = Pygit2GitBackend()
+            elif self.backend == PYGIT2_BACKEND:
+                warn('Git backend "pygit2" is selected, but pygit2 is not installed. Using git CLI.')
 
     def _git_cmd(func):  # type: (Union[GitClient, Callable[..., Any]]) -> Callable
         @wraps(func)  # type: ignore
@@ -45,32 +177,271 @@ class GitClient(object):
 
         return wrapper
 
-    def _update_bare_repo(self, *args, **kwargs):
-        repo = kwargs.get('repo') or args[0]
-        bare_path = kwargs.get('bare_path') or args[1]
+    def _count_objects(self, bare_path):  # type: (str) -> ObjectsCount
+        """Size of objects in the bare repository in bytes, number of loose objects and packs"""
+        counts = {}
+        for line in self.run(['count-objects', '-v'], cwd=bare_path).splitlines():
+            key, _, value = line.partition(':')
+            try:
+                counts[key.strip()] = int(value.strip())
+            except ValueError:
+                pass
+
+        return ObjectsCount(
+            size=(counts.get('size', 0) + counts.get('size-pack', 0)) * 1024,
+            loose_objects=counts.get('count', 0),
+            packs=counts.get('packs', 0))
+
+    def _mirror_size(self, bare_path):  # type: (str) -> int
+        """Size of objects in the bare repository in bytes"""
+        return self._count_objects(bare_path).size
+
+    def _mirror_filter(self, bare_path, is_new):  # type: (str, bool) -> str | None
+        """Filter for the partial clone of the bare repository, None for the full mirror"""
+        if not self.partial_clone_filter:
+            return None
+
+        if self._git_version is not None and self._git_version < PARTIAL_CLONE_MIN_GIT_VERSION:
+            warn(
+                'Partial clone of git dependencies requires git {} or newer. '
+                'Using full mirror of the repository.'.format(PARTIAL_CLONE_MIN_GIT_VERSION))
+            self.partial_clone_filter = None
+            return None
+
+        if self.partial_clone_filter != AUTO_PARTIAL_CLONE:
+            return self.partial_clone_filter
+
+        # Size of the remote repository is not advertised, so the first download is always filtered.
+        # Full mirrors created before are converted only when they grow large.
+        if is_new:
+            return 'blob:none'
+
+        threshold = getenv_int('IDF_COMPONENT_GIT_PARTIAL_CLONE_THRESHOLD_MB', DEFAULT_PARTIAL_CLONE_THRESHOLD_MB)
+        if self._mirror_size(bare_path) > threshold * 1024 * 1024:
+            return 'blob:none'
+
+        return None
+
+    def _enable_partial_clone(self, bare_path, mirror_filter):  # type: (str, str) -> None
+        """Configure the bare repository to fetch missing objects from origin on demand"""
+        self.run(['config', 'core.repositoryformatversion', '1'], cwd=bare_path)
+        self.run(['config', 'extensions.partialClone', 'origin'], cwd=bare_path)
+        self.run(['config', 'remote.origin.promisor', 'true'], cwd=bare_path)
+        self.run(['config', 'remote.origin.partialclonefilter', mirror_filter], cwd=bare_path)
+
+    def pop_updated_mirrors(self):  # type: () -> List[str]
+        """Bare repositories changed by fetches since the last call"""
+        updated_mirrors = sorted(self._updated_mirrors)
+        self._updated_mirrors.clear()
+        return updated_mirrors
+
+    def pop_fetch_stats(self):  # type: () -> Dict[str, int]
+        """Numbers of fetches done and skipped since the last call"""
+        with self._shared_lock:
+            fetch_stats = dict(self._fetch_stats)
+            self._fetch_stats.clear()
+        return fetch_stats
+
+    def _count_fetch(self, name):  # type: (str) -> None
+        with self._shared_lock:
+            self._fetch_stats[name] = self._fetch_stats.get(name, 0) + 1
+
+    def is_partial_mirror(self, bare_path):  # type: (str) -> bool
+        try:
+            return self.run(['config', '--get', 'remote.origin.promisor'], cwd=bare_path).strip() == 'true'
+        except GitCommandError:
+            return False
+
+    def _backend(self, bare_path):  # type: (str) -> GitBackend
+        if self._pygit2_backend is not None and self._pygit2_backend.supports(bare_path):
+            return self._pygit2_backend
+
+        return self._cli_backend
+
+    def _has_object(self, bare_path, object_id):  # type: (str, str) -> bool
+        return self._backend(bare_path).has_object(bare_path, object_id)
+
+    def _remote_refs_file(self, bare_path):  # type: (str) -> str
+        return os.path.join(bare_path, REMOTE_REFS_FILENAME)
+
+    def _remote_refs(self, bare_path):  # type: (str) -> Dict[str, Any]
+        remote_refs = read_json(self._remote_refs_file(bare_path), default={})
+        return remote_refs if isinstance(remote_refs, dict) else {}
+
+    def _ls_remote(self, bare_path, ref):  # type: (str, str | None) -> Tuple[str | None, Dict[str, str]]
+        """
+        Returns commit id the ref points to in the remote and refs of the remote that should be fetched for it.
+        Commit id is None if the ref is not found by name.
+        """
+        if ref:
+            names = ['refs/heads/{}'.format(ref), 'refs/tags/{}'.format(ref)]
+            if ref.startswith('refs/'):
+                names.insert(0, ref)
+            command = ['ls-remote', 'origin', ref]
+        else:
+            names = []
+            command = ['ls-remote', 'origin', REMOTE_HEAD]
+            if self._git_version and self._git_version >= LS_REMOTE_SYMREF_MIN_GIT_VERSION:
+                command.insert(1, '--symref')
+
+        advertised = {}  # type: Dict[str, str]
+        for line in self.run(command, cwd=bare_path).splitlines():
+            value, _, name = line.partition('\t')
+            if value.startswith('ref: ') and name == REMOTE_HEAD:
+                names.append(value[len('ref: '):].strip())
+            else:
+                advertised[name.strip()] = value.strip()
+
+        refs = {name: advertised[name] for name in names if name in advertised}
+        if not ref:
+            return advertised.get(REMOTE_HEAD), refs
+
+        for name in names:
+            if name in advertised:
+                # Annotated tags are peeled to commits with `^{}` suffix
+                return advertised.get('{}^{{}}'.format(name), advertised[name]), refs
+
+        return None, refs
+
+    def _stale_refs(self, bare_path, refs):  # type: (str, Dict[str, str]) -> List[str]
+        local_refs = {}
+        for line in self.run(['for-each-ref', '--format=%(refname) %(objectname)'] + sorted(refs),
+                             cwd=bare_path).splitlines():
+            name, _, object_id = line.partition(' ')
+            local_refs[name] = object_id.strip()
+
+        return sorted(name for name, object_id in refs.items() if local_refs.get(name) != object_id)
+
+    def _update_bare_repo(self, repo, bare_path, ref=None):  # type: (str, str, str | None) -> None
         if not os.path.exists(bare_path):
             os.makedirs(bare_path)
 
-        if not os.listdir(bare_path):
+        is_new = not os.listdir(bare_path)
+        if is_new:
             self.run(['init', '--bare'], cwd=bare_path)
             self.run(['remote', 'add', 'origin', '--tags', '--mirror=fetch', repo], cwd=bare_path)
 
-        if self.run(['config', '--get', 'remote.origin.url'], cwd=bare_path) != repo:
+        if self.run(['config', '--get', 'remote.origin.url'], cwd=bare_path).strip() != repo:
             self.run(['remote', 'set-url', 'origin', repo], cwd=bare_path)
 
-        fetch_file = os.path.join(bare_path, 'FETCH_HEAD')
-        current_time = time.mktime(datetime.now().timetuple())
+        # Commits are immutable, the mirror is up to date for any commit it already has
+        if ref and OBJECT_ID_RE.match(ref) and self._has_object(bare_path, ref):
+            self._count_fetch('skipped')
+            return
+
+        # Don't check the same ref in the remote too often
+        remote_refs = self._remote_refs(bare_path)
+        key = ref or REMOTE_HEAD
+        last_check = remote_refs.get(key)
+        if isinstance(last_check, dict):
+            commit_id = last_check.get('commit')
+            try:
+                elapsed = time.time() - float(last_check.get('checked', 0))
+            except (TypeError, ValueError):
+                elapsed = self.fetch_interval
+            if 0 <= elapsed < self.fetch_interval and (not commit_id or self._has_object(bare_path, commit_id)):
+                self._count_fetch('skipped')
+                return
+
+        commit_id, refs = self._ls_remote(bare_path, ref)
+
+        fetch_command = ['fetch', 'origin']
+        mirror_filter = self._mirror_filter(bare_path, is_new)
+        if mirror_filter:
+            # Blobs (or trees) are downloaded later, only for paths that are actually used
+            self._enable_partial_clone(bare_path, mirror_filter)
+            fetch_command.append('--filter={}'.format(mirror_filter))
+
+        fetched = True
+        if refs and commit_id:
+            # Fetch only refs that are changed in the remote
+            stale_refs = self._stale_refs(bare_path, refs)
+            if stale_refs or not self._has_object(bare_path, commit_id):
+                self.run(
+                    fetch_command + ['--no-tags'] + ['+{0}:{0}'.format(name) for name in stale_refs or sorted(refs)],
+                    cwd=bare_path)
+            else:
+                fetched = False
+        else:
+            # Ref is not a name of a branch or tag in the remote, i.e. abbreviated commit id, fetch everything
+            self.run(fetch_command, cwd=bare_path)
+
+        remote_refs[key] = {'checked': time.time(), 'commit': commit_id}
+        write_json(self._remote_refs_file(bare_path), remote_refs)
+        with self._shared_lock:
+            self._resolved_refs.pop((os.path.abspath(bare_path), key), None)
+
+        self._count_fetch('fetched' if fetched else 'skipped')
+        if fetched:
+            self._updated_mirrors.add(bare_path)
+            if not is_new:
+                self._auto_maintenance(bare_path)
+
+    def _last_maintenance(self, bare_path):  # type: (str) -> float
+        maintenance = read_json(os.path.join(bare_path, MAINTENANCE_FILENAME), default={})
+        try:
+            return float(maintenance.get('time', 0))
+        except (AttributeError, TypeError, ValueError):
+            return 0
+
+    def _auto_maintenance(self, bare_path):  # type: (str) -> None
+        """Cheap maintenance of the mirror from time to time, after fetches added new packs"""
+        if time.time() - self._last_maintenance(bare_path) < AUTO_MAINTENANCE_INTERVAL:
+            return
+
+        try:
+            self.maintain(bare_path, auto=True)
+        except GitError as e:
+            warn('Maintenance of the git repository in the cache "{}" failed:\n{}'.format(bare_path, e))
+
+    @_git_cmd
+    def maintain(self, bare_path, auto=False, prune_refs=False):  # type: (str, bool, bool) -> MaintenanceStats
+        """
+        Repack objects of the bare repository and write the commit-graph
+
+        Parameters
+        ----------
+        bare_path: str
+            Path to the bare repository
+        auto: bool
+            If True, objects are repacked only if git considers it necessary (`gc --auto`)
+        prune_refs: bool
+            If True, remove refs that were deleted in the remote
+        Returns
+        -------
+            Sizes and number of objects before and after the maintenance, and its duration
+        """
+        started = time.time()
+        before = self._count_objects(bare_path)
+
+        if prune_refs:
+            self.run(['remote', 'prune', 'origin'], cwd=bare_path)
+
+        # Unreachable objects are pruned after the default expiration time, to not break concurrent fetches
+        self.run(['gc', '--auto', '--quiet'] if auto else ['gc', '--quiet'], cwd=bare_path)
 
-        # Don't fetch too often, at most once a minute
-        if not os.path.isfile(fetch_file) or current_time - os.stat(fetch_file).st_mtime > 60:
-            self.run(['fetch', 'origin'], cwd=bare_path)
+        # Commit-graph speeds up resolving of refs and walking history
+        git_version = self._git_version or self.version()
+        if git_version >= COMMIT_GRAPH_MIN_GIT_VERSION:
+            commit_graph_command = ['commit-graph', 'write', '--reachable']
+            if git_version >= COMMIT_GRAPH_SPLIT_MIN_GIT_VERSION:
+                commit_graph_command.append('--split')
+            self.run(commit_graph_command, cwd=bare_path)
+
+        write_json(os.path.join(bare_path, MAINTENANCE_FILENAME), {'time': time.time()})
+        return MaintenanceStats(before=before, after=self._count_objects(bare_path), duration=time.time() - started)
 
     def _bare_repo(func):  # type: (Union[GitClient, Callable[..., Any]]) -> Callable
         @wraps(func)  # type: ignore
         def wrapper(self, *args, **kwargs):
-            if not self._repo_updated:
-                self._update_bare_repo(*args, **kwargs)
-                self._repo_updated = True
+            call_args = inspect.getcallargs(func, self, *args, **kwargs)  # type: ignore
+            repo, bare_path, ref = call_args['repo'], call_args['bare_path'], call_args.get('ref')
+
+            if (bare_path, ref) not in self._updated_refs:
+                # Mirror can be shared by several processes, i.e. parallel CI jobs with the same cache
+                with FileLock(mirror_lock_path(bare_path)):
+                    self._update_bare_repo(repo, bare_path, ref)
+                self._updated_refs.add((bare_path, ref))
 
             return func(self, *args, **kwargs)
 
@@ -104,7 +475,8 @@ class GitClient(object):
             checkout_path,  # type: str
             ref=None,  # type: str | None
             with_submodules=True,  # type: bool
-            selected_paths=None  # type: list[str] | None
+            selected_paths=None,  # type: list[str] | None
+            submodule_mirror_path=None,  # type: Callable[[str], str] | None
     ):  # type: (...) -> str
         """
         Checkout required branch to desired path. Create a bare repo, if necessary
@@ -123,6 +495,9 @@ class GitClient(object):
              If True, submodules will be downloaded
         selected_paths: List[str]
             List of folders and files that need to download
+        submodule_mirror_path: Callable[[str], str]
+            Returns path to the shared bare repository for the URL of a submodule.
+            If set, submodules are cloned with objects from these repositories
         Returns
         -------
             Commit id of the current checkout
@@ -130,52 +505,426 @@ class GitClient(object):
         commit_id = self.get_commit_id_by_ref(repo, bare_path, ref)
 
         # Checkout required branch
-        checkout_command = ['--work-tree', checkout_path, '--git-dir', bare_path, 'checkout', '--force', commit_id]
-        if selected_paths:
-            if '.gitmodules' not in selected_paths and self.has_gitmodules_by_ref(repo, bare_path, commit_id):
-                # avoid submodule update failed
-                selected_paths += ['.gitmodules']
-            checkout_command += ['--'] + selected_paths
-        self.run(checkout_command)
-
-        # And remove all untracked files
-        self.run(['--work-tree', checkout_path, '--git-dir', bare_path, 'clean', '--force'])
+        has_gitmodules = self.has_gitmodules_by_ref(repo, bare_path, commit_id)
+        if selected_paths and '.gitmodules' not in selected_paths and has_gitmodules:
+            # avoid submodule update failed
+            selected_paths += ['.gitmodules']
+
+        # Submodules are updated by git CLI, it requires the index of the checkout
+        backend = self._backend(bare_path)
+        if (with_submodules and has_gitmodules) or not backend.supports_checkout(bare_path) or \
+                (os.path.isdir(checkout_path) and os.listdir(checkout_path)):
+            backend = self._cli_backend
+        backend.checkout(bare_path, commit_id, checkout_path, selected_paths)
+
         # Submodules
-        if with_submodules:
-            self.run(
-                [
-                    '--work-tree=.', '-C', checkout_path, '--git-dir', bare_path, 'submodule', 'update', '--init',
-                    '--recursive'
-                ])
+        if with_submodules and has_gitmodules:
+            submodule_command = [
+                '--work-tree=.', '-C', checkout_path, '--git-dir', bare_path, 'submodule', 'update', '--init',
+                '--recursive'
+            ]
+            # Only submodules inside of selected paths are needed
+            submodule_paths = [path for path in selected_paths or [] if path != '.gitmodules']
+
+            if submodule_mirror_path is not None:
+                for path, url in sorted(self._submodules(bare_path, commit_id).items()):
+                    if not self._is_path_selected(path, submodule_paths):
+                        continue
+
+                    reference = self._submodule_reference(bare_path, commit_id, path, url, submodule_mirror_path)
+                    if reference:
+                        reference_args = ['--reference', reference]
+                        if self._git_version and self._git_version >= SUBMODULE_DISSOCIATE_MIN_GIT_VERSION:
+                            # Don't depend on the mirror after clone, it may be repacked or removed
+                            reference_args.append('--dissociate')
+                        self.run(submodule_command + reference_args + ['--', path])
+
+            if submodule_paths:
+                submodule_command += ['--'] + submodule_paths
+            self.run(submodule_command)
 
         return commit_id
 
+    @staticmethod
+    def _is_path_selected(path, selected_paths):  # type: (str, List[str]) -> bool
+        if not selected_paths:
+            return True
+
+        for selected_path in selected_paths:
+            selected_path = normalize_tree_path(selected_path)
+            if not selected_path or path == selected_path or path.startswith(selected_path + '/') \
+                    or selected_path.startswith(path + '/'):
+                return True
+
+        return False
+
+    def _submodules(self, bare_path, commit_id):  # type: (str, str) -> Dict[str, str]
+        """Returns URLs of submodules by their paths, from .gitmodules of the commit"""
+        try:
+            output = self.run(
+                [
+                    'config', '--blob', '{}:.gitmodules'.format(commit_id), '--get-regexp',
+                    r'^submodule\..*\.(path|url)$'
+                ],
+                cwd=bare_path)
+        except GitCommandError:
+            return {}
+
+        paths, urls = {}, {}
+        for line in output.splitlines():
+            key, _, value = line.partition(' ')
+            name, _, attribute = key[len('submodule.'):].rpartition('.')
+            if attribute == 'path':
+                paths[name] = normalize_tree_path(value.strip())
+            else:
+                urls[name] = value.strip()
+
+        return {path: urls[name] for name, path in paths.items() if name in urls}
+
+    def _submodule_reference(
+            self,
+            bare_path,  # type: str
+            commit_id,  # type: str
+            path,  # type: str
+            url,  # type: str
+            submodule_mirror_path,  # type: Callable[[str], str]
+    ):  # type: (...) -> str | None
+        """Returns path to the shared mirror of the submodule with its commit, or None if it can't be used"""
+        # URLs relative to the superproject depend on the URL of the superproject
+        if url.startswith('./') or url.startswith('../'):
+            return None
+
+        mirror_path = submodule_mirror_path(url)
+        try:
+            submodule_commit_id = self.run(['rev-parse', '{}:{}'.format(commit_id, path)], cwd=bare_path).strip()
+            self.update_mirror(repo=url, bare_path=mirror_path, ref=submodule_commit_id)
+        except (GitCommandError, GitError) as e:
+            warn('Cannot use the shared repository for the submodule "{}":\n{}'.format(path, e))
+            return None
+
+        # Partial clones don't have all objects to borrow
+        if self.is_partial_mirror(mirror_path):
+            return None
+
+        return mirror_path
+
     @_git_cmd
     @_bare_repo
-    def get_commit_id_by_ref(self, repo, bare_path, ref):  # type: (str, str, str) -> str
-        if ref:
-            # If branch is provided check that exists
+    def update_mirror(self, repo, bare_path, ref=None):  # type: (str, str, str | None) -> None
+        """Create the bare repository if necessary and make sure it's up to date for the ref"""
+
+    def _resolved_ref(self, bare_path, ref):  # type: (str, str | None) -> str | None
+        """Commit id the ref was resolved to, if it's still valid"""
+        key = (os.path.abspath(bare_path), ref or REMOTE_HEAD)
+        resolved = self._resolved_refs.get(key)
+        if resolved is None:
+            entry = self._remote_refs(bare_path).get(key[1])
+            if not isinstance(entry, dict) or not entry.get('resolved'):
+                return None
+
             try:
-                self.run(['branch', '--contains', ref], cwd=bare_path)
-            except GitCommandError:
-                raise GitError('Branch "%s" doesn\'t exist in repo "%s"' % (ref, repo))
+                # Resolved commit ids are stored without the time of the check and never expire
+                checked = float(entry['checked']) if 'checked' in entry else None
+            except (TypeError, ValueError):
+                return None
+
+            resolved = (entry['resolved'], checked)
+            with self._shared_lock:
+                self._resolved_refs[key] = resolved
 
+        commit_id, checked = resolved
+        if checked is not None and not 0 <= time.time() - checked < self.fetch_interval:
+            return None
+
+        return commit_id
+
+    def _store_resolved_ref(self, bare_path, ref, commit_id):  # type: (str, str | None, str) -> None
+        key = ref or REMOTE_HEAD
+        remote_refs = self._remote_refs(bare_path)
+        if ref and OBJECT_ID_RE.match(ref):
+            entry = {'resolved': commit_id}  # type: Dict[str, Any]
         else:
-            # Set to latest commit from remote's HEAD
-            ref = self.run(['ls-remote', '--exit-code', 'origin', 'HEAD'], cwd=bare_path)[:40]
+            # Branches and tags are valid only until the next check of the remote
+            entry = remote_refs.get(key, {})
+            if not isinstance(entry, dict) or 'checked' not in entry:
+                return
+            entry['resolved'] = commit_id
+
+        remote_refs[key] = entry
+        write_json(self._remote_refs_file(bare_path), remote_refs)
 
-        return self.run(['rev-parse', '--verify', ref], cwd=bare_path).strip()
+        with self._shared_lock:
+            self._resolved_refs[(os.path.abspath(bare_path), key)] = (commit_id, entry.get('checked'))
+
+    def get_commit_id_by_ref(self, repo, bare_path, ref):  # type: (str, str, str | None) -> str
+        """
+        Resolve the ref to the commit id.
+        Results are memoized in the process and stored in the bare repository:
+        for branches and tags until the next check of the remote, for commit ids forever.
+        """
+        commit_id = self._resolved_ref(bare_path, ref)
+        if commit_id is None:
+            commit_id = self._resolve_ref(repo, bare_path, ref)
+            self._store_resolved_ref(bare_path, ref, commit_id)
+
+        return commit_id
+
+    @_git_cmd
+    @_bare_repo
+    def _resolve_ref(self, repo, bare_path, ref):  # type: (str, str, str | None) -> str
+        if not ref:
+            # Latest commit from remote's HEAD, as it was checked on the update of the mirror
+            remote_head = self._remote_refs(bare_path).get(REMOTE_HEAD)
+            ref = remote_head.get('commit') if isinstance(remote_head, dict) else None
+            if not ref:
+                ref = self.run(['ls-remote', '--exit-code', 'origin', REMOTE_HEAD], cwd=bare_path)[:40]
+
+        commit_id = self._backend(bare_path).resolve_ref(bare_path, ref)
+        if commit_id is None:
+            raise GitError('Branch "%s" doesn\'t exist in repo "%s"' % (ref, repo))
+
+        return commit_id
 
     @_git_cmd
     @_bare_repo
     def has_gitmodules_by_ref(self, repo, bare_path, ref):  # type: (str, str, str) -> bool
-        return '.gitmodules' in self.run(['ls-tree', '--name-only', ref], cwd=bare_path).splitlines()
+        entries = self._read_tree(bare_path, '{}^{{tree}}'.format(ref)) or []
+        return any(entry.path == '.gitmodules' for entry in entries)
+
+    def _read_tree(self, bare_path, name):  # type: (str, str) -> List[TreeEntry] | None
+        # Trees named by object ids never change, missing ones may be fetched later
+        immutable = bool(OBJECT_ID_RE.match(re.split(r'[:^]', name, 1)[0]))
+        key = (os.path.abspath(bare_path), name)
+        entries = self._trees.get(key) if immutable else None
+
+        if entries is None:
+            git_object = self._backend(bare_path).read_object(bare_path, name)
+            if git_object is None or git_object.type != 'tree':
+                return None
+
+            entries = parse_tree(git_object.data, sha_length=len(git_object.sha) // 2)
+            if immutable:
+                self._trees[key] = entries
+
+        return list(entries)
+
+    @_git_cmd
+    @_bare_repo
+    def list_tree(
+            self,
+            repo,  # type: str
+            bare_path,  # type: str
+            ref,  # type: str
+            path=None,  # type: str | None
+            recursive=False,  # type: bool
+    ):  # type: (...) -> List[TreeEntry] | None
+        """
+        List entries of the directory from the object database of the bare repository, without checkout
+
+        Parameters
+        ----------
+        repo: str
+            URL of the repository
+        bare_path: str
+            Path to the bare repository
+        ref: str
+            Commit id or any other name of the commit
+        path: str
+            Path to the directory inside of the repository, root of the repository by default
+        recursive: bool
+            If True, list content of subdirectories too. Paths are relative to the `path`
+        Returns
+        -------
+            List of entries or None if the path is not a directory in the commit
+        """
+        path = normalize_tree_path(path)
+        tree_name = '{}:{}'.format(ref, path) if path else '{}^{{tree}}'.format(ref)
+        entries = self._read_tree(bare_path, tree_name)
+
+        if entries is None or not recursive:
+            return entries
+
+        result = []  # type: List[TreeEntry]
+        directories = [('', entries)]
+        while directories:
+            prefix, directory_entries = directories.pop()
+            for entry in directory_entries:
+                entry = entry._replace(path=posixpath.join(prefix, entry.path))
+                result.append(entry)
+
+                if entry.type == 'tree':
+                    directories.append((entry.path, self._read_tree(bare_path, entry.sha) or []))
+
+        return result
+
+    def _read_blob(self, bare_path, name):  # type: (str, str) -> bytes | None
+        git_object = self._backend(bare_path).read_object(bare_path, name)
+        if git_object is None or git_object.type != 'blob':
+            return None
+
+        return git_object.data
+
+    @_bare_repo
+    def _read_file(self, repo, bare_path, ref, path):  # type: (str, str, str, str) -> bytes | None
+        return self._read_blob(bare_path, '{}:{}'.format(ref, normalize_tree_path(path)))
+
+    @_git_cmd
+    def read_blob(self, repo, bare_path, ref, path=None):  # type: (str, str, str, str | None) -> bytes | None
+        """
+        Read content of the file from the object database of the bare repository.
+        If path is not set, ref is considered as an id of the blob. Blobs are read by id without updating the mirror,
+        it must already contain the commit (i.e. after `list_tree`), missing blobs of partial mirrors
+        are downloaded at once by `prefetch_blobs`.
+        Returns None if file doesn't exist.
+        """
+        if path is not None:
+            return self._read_file(repo=repo, bare_path=bare_path, ref=ref, path=path)
+
+        return self._read_blob(bare_path, ref)
+
+    @_git_cmd
+    @_bare_repo
+    def prefetch_blobs(self, repo, bare_path, ref, blobs):  # type: (str, str, str, List[str]) -> None
+        """
+        Download missing blobs of the partial mirror in one request,
+        instead of fetching them one by one on the first read
+        """
+        if not self.is_partial_mirror(bare_path):
+            return
+
+        missing = set()
+        for line in self.run(['rev-list', '--objects', '--no-walk', '--missing=print', ref],
+                             cwd=bare_path).splitlines():
+            if line.startswith('?'):
+                missing.add(line[1:].strip())
+
+        missing_blobs = [blob for blob in blobs if blob in missing]
+        for start in range(0, len(missing_blobs), FETCH_OBJECTS_CHUNK_SIZE):
+            self.run(
+                [
+                    '-c', 'fetch.negotiationAlgorithm=noop', 'fetch', 'origin', '--no-tags', '--no-write-fetch-head',
+                    '--recurse-submodules=no', '--filter=blob:none'
+                ] + missing_blobs[start:start + FETCH_OBJECTS_CHUNK_SIZE],
+                cwd=bare_path)
+
+        if missing_blobs:
+            self._updated_mirrors.add(bare_path)
+
+    @_git_cmd
+    @_bare_repo
+    def archive(
+            self,
+            repo,  # type: str
+            bare_path,  # type: str
+            ref,  # type: str
+            destination,  # type: str
+            path=None,  # type: str | None
+            member_filter=None,  # type: Callable[[str, bool], bool] | None
+    ):  # type: (...) -> None
+        """
+        Extract the directory of the commit to the destination, streaming output of `git archive` without checkout
+
+        Parameters
+        ----------
+        repo: str
+            URL of the repository
+        bare_path: str
+            Path to the bare repository
+        ref: str
+            Commit id or any other name of the commit
+        destination: str
+            Path to the directory to extract files to
+        path: str
+            Path to the directory inside of the repository, root of the repository by default
+        member_filter: Callable[[str, bool], bool]
+            Called with the path relative to the `path` and the flag if it's a directory,
+            only entries it returns True for are extracted
+        """
+        path = normalize_tree_path(path)
+        tree_name = '{}:{}'.format(ref, path) if path else '{}^{{tree}}'.format(ref)
+
+        with tempfile.TemporaryFile() as stderr:
+            p = subprocess.Popen(  # nosec
+                [self.git_command, 'archive', '--format=tar', tree_name],
+                cwd=bare_path,
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+            )
+            try:
+                with tarfile.open(fileobj=p.stdout, mode='r|') as archive:
+                    for member in archive:
+                        self._extract_member(archive, member, destination, member_filter)
+            except tarfile.TarError:
+                # Error of the git command is reported below
+                pass
+            finally:
+                p.stdout.read()  # type: ignore
+                p.stdout.close()  # type: ignore
+                p.wait()
+
+            if p.returncode != 0:
+                stderr.seek(0)
+                raise GitCommandError(
+                    "'git archive %s' failed with exit code %d \n%s" %
+                    (tree_name, p.returncode, stderr.read().decode('utf-8')))
+
+    @staticmethod
+    def _extract_member(archive, member, destination, member_filter):
+        # type: (tarfile.TarFile, tarfile.TarInfo, str, Callable[[str, bool], bool] | None) -> None
+        rel_path = member.name.strip('/')
+        parts = rel_path.split('/')
+        if not rel_path or '..' in parts or not (member.isdir() or member.isfile()):
+            return
+
+        if member_filter is not None and not member_filter(rel_path, member.isdir()):
+            return
+
+        dest_path = os.path.join(destination, *parts)
+        if member.isdir():
+            if not os.path.isdir(dest_path):
+                os.makedirs(dest_path)
+            return
+
+        dest_dir = os.path.dirname(dest_path)
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+
+        with open(dest_path, 'wb') as f:
+            shutil.copyfileobj(archive.extractfile(member), f)  # type: ignore
+        os.chmod(dest_path, 0o755 if member.mode & 0o100 else 0o644)
+
+    @_git_cmd
+    def checkout_filters_enabled(self, bare_path):  # type: (str) -> bool
+        """
+        Returns True if checkout may change content of files comparing to blobs in the object database,
+        i.e. line endings conversion or attributes configured outside of the repository are enabled
+        """
+        try:
+            if self.run(['config', '--get', 'core.autocrlf'], cwd=bare_path).strip().lower() in ('true', 'input'):
+                return True
+        except GitCommandError:
+            pass
+
+        try:
+            if self.run(['config', '--get', 'core.attributesFile'], cwd=bare_path).strip():
+                return True
+        except GitCommandError:
+            pass
+
+        xdg_config_home = os.getenv('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+        attribute_files = [
+            os.path.join(xdg_config_home, 'git', 'attributes'),
+            os.path.join(bare_path, 'info', 'attributes'),
+        ]
+        return any(os.path.isfile(attribute_file) for attribute_file in attribute_files)
 
     def run(self, args, cwd=None, env=None):  # type: (List[str], str | None, dict | None) -> str
         if cwd is None:
             cwd = os.getcwd()
-        env_copy = dict(os.environ)
+        # Environment of the process is inherited as is, without copying it for every command
+        env_copy = None
         if env:
+            env_copy = dict(os.environ)
             env_copy.update(env)
 
         p = subprocess.Popen(  # nosec
@@ -199,6 +948,7 @@ class GitClient(object):
 
     def check_version(self):  # type: () -> None
         version = self.version()
+        self._git_version = version
 
         if version < self.git_min_supported:
             raise GitError(
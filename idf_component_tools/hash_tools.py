@@ -1,32 +1,85 @@
 # SPDX-FileCopyrightText: 2022-2023 Espressif Systems (Shanghai) CO LTD
 # SPDX-License-Identifier: Apache-2.0
 """Tools for hashing and hash validation for whole packages"""
+import hashlib
 import json
+import mmap
 import os
 import re
+import stat
+import time
 from hashlib import sha256
 from io import open
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
 
-from idf_component_tools.environment import getenv_bool
-from idf_component_tools.file_tools import filtered_paths
+from idf_component_tools.environment import getenv_bool, getenv_int
+from idf_component_tools.file_tools import filtered_paths, read_json, write_json
 
 try:
-    from typing import Any, Iterable, Text
+    from typing import Any, Callable, Dict, Iterable, List, Text, Tuple
 except ImportError:
     pass
 
+try:
+    from blake3 import blake3  # type: ignore
+except ImportError:
+    blake3 = None
+
 BLOCK_SIZE = 65536
+# Larger files are hashed from memory maps instead of reading them by blocks
+MMAP_MIN_SIZE = 1048576
+
+# Algorithm of hashes of components in the registry
+DEFAULT_HASH_ALGORITHM = 'sha256'
+# Algorithms available for local checks that are never compared with the registry
+HASH_ALGORITHMS = {'sha256': sha256}  # type: Dict[str, Callable[[], Any]]
+if hasattr(hashlib, 'blake2b'):
+    HASH_ALGORITHMS['blake2b'] = lambda: hashlib.blake2b(digest_size=32)  # type: ignore
+if blake3 is not None:
+    HASH_ALGORITHMS['blake3'] = blake3
+
 HASH_FILENAME = '.component_hash'
+# Digests of files of the managed component by their size, mtime and inode, to validate only changed files
+DIGEST_CACHE_FILENAME = '.component_hash_cache'
+# Files modified less than this number of seconds before the digest cache was written are hashed again
+RACY_INTERVAL = 2
+# Digests of directories of the managed component, to find modified files (hash format 2)
+HASH_TREE_FILENAME = '.component_hash_tree'
+HASH_TREE_VERSION = 2
+# Hash of files of the component with the local hash algorithm, checked instead of the registry hash
+LOCAL_STAMP_FILENAME = '.component_hash_stamp'
+# Sizes and mtimes of files of the managed component, to validate it without hashing (stat integrity mode)
+STAT_SNAPSHOT_FILENAME = '.component_hash_stat'
+# Default number of seconds between full checks of managed components in the stat integrity mode
+DEFAULT_FULL_CHECK_INTERVAL = 7 * 24 * 60 * 60
 SHA256_RE = r'^[A-Fa-f0-9]{64}$'
 
+# Files of managed components created by the component manager, not included in the hash
+MANAGED_COMPONENT_EXCLUDE = [
+    '**/{}'.format(HASH_FILENAME),
+    '**/{}*'.format(DIGEST_CACHE_FILENAME),
+    '**/{}'.format(HASH_TREE_FILENAME),
+    '**/{}'.format(STAT_SNAPSHOT_FILENAME),
+    '**/{}'.format(LOCAL_STAMP_FILENAME),
+]
+
+# Maximum default number of threads hashing files
+DEFAULT_HASH_JOBS = 8
+# Directories with fewer files are hashed in the calling thread
+PARALLEL_HASH_MIN_FILES = 16
+
 
 class ValidatingHashError(Exception):
     pass
 
 
 class HashNotEqualError(ValidatingHashError):
-    pass
+    def __init__(self, changes=None):  # type: (List[Tuple[str, str]] | None) -> None
+        super(HashNotEqualError, self).__init__()
+        # Pairs of relative paths and types of changes, if they are known
+        self.changes = changes or []
 
 
 class HashNotSHA256Error(ValidatingHashError):
@@ -45,11 +98,24 @@ def hash_object(obj):  # type: (Any) -> str
     return sha.hexdigest()
 
 
-def hash_file(file_path):  # type: (Text | Path) -> str
-    """Calculate sha256 of file"""
-    sha = sha256()
+def hash_file(file_path, algorithm=DEFAULT_HASH_ALGORITHM):  # type: (Text | Path, str) -> str
+    """Calculate sha256 of file, or a hash with another algorithm from HASH_ALGORITHMS"""
+    sha = HASH_ALGORITHMS[algorithm]()
 
     with open(Path(file_path).as_posix(), 'rb') as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_MIN_SIZE:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError):
+                # File system doesn't support memory maps, or the file was truncated
+                pass
+            else:
+                try:
+                    sha.update(mapped)
+                finally:
+                    mapped.close()
+                return sha.hexdigest()
+
         while True:
             block = f.read(BLOCK_SIZE)
             if not block:
@@ -59,45 +125,386 @@ def hash_file(file_path):  # type: (Text | Path) -> str
     return sha.hexdigest()
 
 
+def local_hash_algorithm():  # type: () -> str
+    """
+    Algorithm of hashes used only for local checks from IDF_COMPONENT_LOCAL_HASH_ALGORITHM,
+    sha256 if not set or not available
+    """
+    algorithm = os.getenv('IDF_COMPONENT_LOCAL_HASH_ALGORITHM', '').strip().lower()
+    return algorithm if algorithm in HASH_ALGORITHMS else DEFAULT_HASH_ALGORITHM
+
+
+def hash_jobs():  # type: () -> int
+    """Number of threads hashing files of directories from IDF_COMPONENT_HASH_JOBS, by default number of CPUs"""
+    return max(getenv_int('IDF_COMPONENT_HASH_JOBS', min(cpu_count(), DEFAULT_HASH_JOBS)), 1)
+
+
+def _hash_file_list(file_paths, algorithm=DEFAULT_HASH_ALGORITHM):  # type: (List[Path], str) -> List[str]
+    # sha256 releases GIL while hashing, so files are hashed in parallel.
+    # Digests are returned in the order of paths, the result doesn't depend on the number of threads.
+    jobs = min(hash_jobs(), len(file_paths))
+    if jobs > 1 and len(file_paths) >= PARALLEL_HASH_MIN_FILES:
+        pool = ThreadPool(jobs)
+        try:
+            return pool.map(lambda file_path: hash_file(file_path, algorithm), file_paths)
+        finally:
+            pool.close()
+            pool.join()
+
+    return [hash_file(file_path, algorithm) for file_path in file_paths]
+
+
+def _stat_key(file_stat):  # type: (os.stat_result) -> List[int]
+    mtime_ns = getattr(file_stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(file_stat.st_mtime * 1e9)
+    return [file_stat.st_size, mtime_ns, file_stat.st_ino]
+
+
 def hash_dir(
         root,  # type: Text | Path
         exclude=None,  # type: Iterable[Text] | None
-        exclude_default=True  # type: bool
+        exclude_default=True,  # type: bool
+        digest_cache=None,  # type: Text | None
 ):  # type: (...) -> str
-    """Calculate sha256 of sha256 of all files and file names."""
-    sha = sha256()
+    """
+    Calculate sha256 of sha256 of all files and file names.
+    With `digest_cache` file digests are stored in this file by path, size, mtime and inode of the file,
+    and only files changed since the previous call are read.
+    """
+    return hash_files(file_digests(root, exclude, exclude_default, digest_cache).items())
+
+
+def file_digests(
+        root,  # type: Text | Path
+        exclude=None,  # type: Iterable[Text] | None
+        exclude_default=True,  # type: bool
+        digest_cache=None,  # type: Text | None
+        algorithm=DEFAULT_HASH_ALGORITHM,  # type: str
+):  # type: (...) -> Dict[str, str]
+    """
+    sha256 of files of the directory by relative paths, with the same rules as `hash_dir`.
+    The digest cache stores only sha256, it's not used with other algorithms.
+    """
+    if algorithm != DEFAULT_HASH_ALGORITHM:
+        digest_cache = None
+
+    file_paths = [
+        file_path for file_path in filtered_paths(root, exclude=exclude, exclude_default=exclude_default)
+        if not file_path.is_dir()
+    ]
+    relative_paths = [file_path.relative_to(root).as_posix() for file_path in file_paths]
+
+    digests = {}  # type: Dict[str, str]
+    stat_keys = {}  # type: Dict[str, List[int]]
+    cached_digests = {}  # type: Dict[str, Any]
+    if digest_cache:
+        stored = read_json(digest_cache, default={})
+        if not isinstance(stored, dict) or stored.get('algorithm', DEFAULT_HASH_ALGORITHM) != DEFAULT_HASH_ALGORITHM:
+            stored = {}
+        cached_digests = stored.get('files', {})
+        for file_path, relative_path in zip(file_paths, relative_paths):
+            stat_keys[relative_path] = _stat_key(os.stat(str(file_path)))
+            cached = cached_digests.get(relative_path)
+            if isinstance(cached, list) and len(cached) == 4 and cached[:3] == stat_keys[relative_path]:
+                digests[relative_path] = cached[3]
+
+    changed = [
+        (file_path, relative_path) for file_path, relative_path in zip(file_paths, relative_paths)
+        if relative_path not in digests
+    ]
+    digests.update(
+        zip(
+            [relative_path for _, relative_path in changed],
+            _hash_file_list([file_path for file_path, _ in changed], algorithm),
+        ))
+
+    if digest_cache:
+        _store_digest_cache(digest_cache, cached_digests, stat_keys, digests)
+
+    return digests
+
+
+def _store_digest_cache(digest_cache, cached_digests, stat_keys, digests):
+    # type: (Text, Dict[str, Any], Dict[str, List[int]], Dict[str, str]) -> None
+    # A file modified within the resolution of timestamps after hashing may keep the same mtime,
+    # digests of recently modified files are not stored and are calculated again next time
+    racy_since = int((time.time() - RACY_INTERVAL) * 1e9)
+    files = {
+        relative_path: stat_key + [digests[relative_path]]
+        for relative_path, stat_key in stat_keys.items() if stat_key[1] < racy_since
+    }
+    if files == cached_digests:
+        return
+
+    try:
+        write_json(digest_cache, {'algorithm': DEFAULT_HASH_ALGORITHM, 'files': files})
+    except (IOError, OSError):
+        # The digest cache is only an optimization, directory may be read-only
+        pass
+
 
-    paths = sorted(
-        filtered_paths(root, exclude=exclude, exclude_default=exclude_default),
-        key=lambda path: path.relative_to(root).as_posix())
-    for file_path in paths:
-        if file_path.is_dir():
-            continue
+def hash_files(file_hashes, algorithm=DEFAULT_HASH_ALGORITHM):  # type: (Iterable[Tuple[Text, Text]], str) -> str
+    """
+    Calculate sha256 of pairs of relative file paths and sha256 of files.
+    Gives the same result as `hash_dir` for the files of the directory.
+    """
+    sha = HASH_ALGORITHMS[algorithm]()
 
+    for relative_path, file_hash in sorted(file_hashes):
         # Add file path
-        sha.update(file_path.relative_to(root).as_posix().encode('utf-8'))
+        sha.update(relative_path.encode('utf-8'))
 
         # Add content hash
-        sha.update(hash_file(file_path).encode('utf-8'))
+        sha.update(file_hash.encode('utf-8'))
 
     return sha.hexdigest()
 
 
+def hash_tree(file_hashes):  # type: (Iterable[Tuple[Text, Text]]) -> Dict[str, Any]
+    """
+    Build Merkle tree of pairs of relative file paths and sha256 of files.
+    Every directory has sha256 of names and digests of its files and subdirectories,
+    so equal digests of directories mean that nothing has changed inside of them.
+    """
+    tree = {'files': {}, 'dirs': {}}  # type: Dict[str, Any]
+    for relative_path, file_hash in file_hashes:
+        parts = relative_path.split('/')
+        node = tree
+        for part in parts[:-1]:
+            node = node['dirs'].setdefault(part, {'files': {}, 'dirs': {}})
+        node['files'][parts[-1]] = file_hash
+
+    _hash_tree_node(tree)
+    return tree
+
+
+def _hash_tree_node(node):  # type: (Dict[str, Any]) -> str
+    sha = sha256()
+    entries = [(name, digest) for name, digest in node['files'].items()]
+    entries.extend((name + '/', _hash_tree_node(child)) for name, child in node['dirs'].items())
+    for name, digest in sorted(entries):
+        sha.update(name.encode('utf-8'))
+        sha.update(digest.encode('utf-8'))
+
+    node['digest'] = sha.hexdigest()
+    return node['digest']
+
+
+def diff_hash_trees(old, new, prefix=''):  # type: (Dict[str, Any], Dict[str, Any], str) -> List[Tuple[str, str]]
+    """
+    List of relative paths of files that were 'added', 'removed' or 'modified' between two Merkle trees.
+    Directories with equal digests are skipped.
+    """
+    changes = []  # type: List[Tuple[str, str]]
+    if old.get('digest') == new.get('digest'):
+        return changes
+
+    old_files, new_files = old.get('files', {}), new.get('files', {})
+    for name in sorted(set(old_files) | set(new_files)):
+        if name not in new_files:
+            changes.append((prefix + name, 'removed'))
+        elif name not in old_files:
+            changes.append((prefix + name, 'added'))
+        elif old_files[name] != new_files[name]:
+            changes.append((prefix + name, 'modified'))
+
+    old_dirs, new_dirs = old.get('dirs', {}), new.get('dirs', {})
+    for name in sorted(set(old_dirs) | set(new_dirs)):
+        changes.extend(diff_hash_trees(old_dirs.get(name, {}), new_dirs.get(name, {}), prefix + name + '/'))
+
+    return changes
+
+
+def hash_format():  # type: () -> int
+    """Version of the format of hash files of managed components from IDF_COMPONENT_HASH_FORMAT"""
+    return getenv_int('IDF_COMPONENT_HASH_FORMAT', 1)
+
+
+def write_hash_tree(root):  # type: (str) -> None
+    """
+    Store Merkle tree of files of the managed component next to its hash file (hash format 2).
+    The root digest in the hash file is not changed and stays compatible with the registry.
+    """
+    digests = file_digests(
+        root, exclude=MANAGED_COMPONENT_EXCLUDE, exclude_default=False, digest_cache=_digest_cache_path(root))
+    try:
+        write_json(
+            os.path.join(root, HASH_TREE_FILENAME), {
+                'version': HASH_TREE_VERSION,
+                'algorithm': DEFAULT_HASH_ALGORITHM,
+                'root': hash_files(digests.items()),
+                'tree': hash_tree(digests.items()),
+            })
+    except (IOError, OSError):
+        # The tree is used only to report modified files
+        pass
+
+
+def _managed_component_changes(root, component_hash):  # type: (str, str) -> List[Tuple[str, str]]
+    """Changed files of the managed component from its stored Merkle tree, if the tree is up to date"""
+    stored = read_json(os.path.join(root, HASH_TREE_FILENAME), default={})
+    if not isinstance(stored, dict) or stored.get('algorithm', DEFAULT_HASH_ALGORITHM) != DEFAULT_HASH_ALGORITHM:
+        return []
+
+    if stored.get('root') != component_hash or not isinstance(stored.get('tree'), dict):
+        return []
+
+    digests = file_digests(
+        root, exclude=MANAGED_COMPONENT_EXCLUDE, exclude_default=False, digest_cache=_digest_cache_path(root))
+    return diff_hash_trees(stored['tree'], hash_tree(digests.items()))
+
+
 def validate_dir(
         root,  # type: Text | Path
         dir_hash,  # type: Text
         exclude=None,  # type: Iterable[Text] | None
-        exclude_default=True  # type: bool
+        exclude_default=True,  # type: bool
+        digest_cache=None,  # type: Text | None
+        algorithm=DEFAULT_HASH_ALGORITHM,  # type: str
 ):
     # type: (...) -> bool
     """Check if directory hash is the same as provided"""
-    current_hash = Path(root).is_dir() and hash_dir(root, exclude=exclude, exclude_default=exclude_default)
+    current_hash = Path(root).is_dir() and hash_files(
+        file_digests(
+            root, exclude=exclude, exclude_default=exclude_default, digest_cache=digest_cache,
+            algorithm=algorithm).items(), algorithm)
     return current_hash == dir_hash
 
 
-def validate_filtered_dir(root, component_hash):  # type: (Text | Path, str) -> bool
-    """Validate component in managed directory"""
-    return validate_dir(root, component_hash, exclude=['**/.component_hash'], exclude_default=False)
+def validate_filtered_dir(root, component_hash, use_digest_cache=False):  # type: (Text | Path, str, bool) -> bool
+    """
+    Validate component in managed directory.
+    With `use_digest_cache` only files changed since the previous validation are hashed,
+    unless IDF_COMPONENT_STRICT_HASH_CHECK is set.
+    Otherwise with IDF_COMPONENT_LOCAL_HASH_ALGORITHM all files are hashed with this algorithm
+    and compared with the local stamp, recorded after the first successful check with sha256.
+    IDF_COMPONENT_STRICT_HASH_CHECK disables both shortcuts.
+    """
+    digest_cache = _digest_cache_path(root) if use_digest_cache else None
+    algorithm = local_hash_algorithm()
+    # Strict check always compares sha256 of all files with the hash from the registry
+    use_stamp = (
+        digest_cache is None and algorithm != DEFAULT_HASH_ALGORITHM
+        and not getenv_bool('IDF_COMPONENT_STRICT_HASH_CHECK'))
+    if use_stamp:
+        stamp = read_json(os.path.join(str(root), LOCAL_STAMP_FILENAME), default={})
+        if isinstance(stamp, dict) and stamp.get('algorithm') == algorithm and stamp.get('root') == component_hash:
+            return validate_dir(
+                root,
+                stamp.get('hash', ''),
+                exclude=MANAGED_COMPONENT_EXCLUDE,
+                exclude_default=False,
+                algorithm=algorithm)
+
+    if not validate_dir(root, component_hash, exclude=MANAGED_COMPONENT_EXCLUDE, exclude_default=False,
+                        digest_cache=digest_cache):
+        return False
+
+    if use_stamp:
+        write_local_stamp(root, component_hash, algorithm)
+
+    return True
+
+
+def write_local_stamp(root, component_hash, algorithm):  # type: (Text | Path, str, str) -> None
+    """Record hash of the directory with the registry hash `component_hash` calculated with the local algorithm"""
+    digests = file_digests(root, exclude=MANAGED_COMPONENT_EXCLUDE, exclude_default=False, algorithm=algorithm)
+    try:
+        write_json(
+            os.path.join(str(root), LOCAL_STAMP_FILENAME), {
+                'algorithm': algorithm,
+                'root': component_hash,
+                'hash': hash_files(digests.items(), algorithm),
+            })
+    except (IOError, OSError):
+        pass
+
+
+def integrity_mode():  # type: () -> str
+    """
+    Level of validation of managed components from IDF_COMPONENT_INTEGRITY:
+    'hash' - compare hashes of all files (default), 'stat' - compare sizes and mtimes of files recorded at install.
+    IDF_COMPONENT_STRICT_HASH_CHECK always selects 'hash'.
+    """
+    if getenv_bool('IDF_COMPONENT_STRICT_HASH_CHECK'):
+        return 'hash'
+
+    return 'stat' if os.getenv('IDF_COMPONENT_INTEGRITY', '').strip().lower() == 'stat' else 'hash'
+
+
+def _file_stats(root):  # type: (str) -> Dict[str, List[int]]
+    stats = {}  # type: Dict[str, List[int]]
+    for file_path in filtered_paths(root, exclude=MANAGED_COMPONENT_EXCLUDE, exclude_default=False):
+        file_stat = os.stat(str(file_path))
+        if not stat.S_ISDIR(file_stat.st_mode):
+            stats[file_path.relative_to(root).as_posix()] = _stat_key(file_stat)[:2]
+
+    return stats
+
+
+def write_stat_snapshot(root, component_hash):  # type: (str, str) -> None
+    """Record sizes and mtimes of files of the managed component with a valid hash"""
+    stats = _file_stats(root)
+    # Changes of recently modified files may keep the same mtime,
+    # the snapshot is recorded by a later validation when all files are old enough
+    racy_since = int((time.time() - RACY_INTERVAL) * 1e9)
+    if any(mtime_ns >= racy_since for _, mtime_ns in stats.values()):
+        return
+
+    try:
+        write_json(
+            os.path.join(root, STAT_SNAPSHOT_FILENAME), {
+                'root': component_hash,
+                'verified': int(time.time()),
+                'files': stats,
+            })
+    except (IOError, OSError):
+        pass
+
+
+def _validate_stat_snapshot(root, component_hash):  # type: (str, str) -> bool
+    """
+    True if sizes and mtimes of files are the same as in the snapshot.
+    Snapshots older than IDF_COMPONENT_INTEGRITY_CHECK_INTERVAL seconds are not trusted,
+    so components are hashed again from time to time.
+    """
+    stored = read_json(os.path.join(root, STAT_SNAPSHOT_FILENAME), default={})
+    if not isinstance(stored, dict) or stored.get('root') != component_hash:
+        return False
+
+    verified = stored.get('verified')
+    interval = getenv_int('IDF_COMPONENT_INTEGRITY_CHECK_INTERVAL', DEFAULT_FULL_CHECK_INTERVAL)
+    if not isinstance(verified, int) or time.time() - verified > interval:
+        return False
+
+    return stored.get('files') == _file_stats(root)
+
+
+def _digest_cache_path(root):  # type: (Text | Path) -> str | None
+    if getenv_bool('IDF_COMPONENT_STRICT_HASH_CHECK'):
+        return None
+
+    return os.path.join(str(root), DIGEST_CACHE_FILENAME)
+
+
+def validate_managed_component_files(root, component_hash):  # type: (Text | Path, str) -> bool
+    """
+    Check files of the component in the managed components directory.
+    Only files changed since the previous check are hashed again, unless IDF_COMPONENT_STRICT_HASH_CHECK is set.
+    With IDF_COMPONENT_INTEGRITY=stat files are not hashed at all while their sizes and mtimes are unchanged.
+    """
+    stat_mode = integrity_mode() == 'stat'
+    if stat_mode and _validate_stat_snapshot(str(root), component_hash):
+        return True
+
+    if not validate_filtered_dir(root, component_hash, use_digest_cache=True):
+        return False
+
+    if stat_mode:
+        write_stat_snapshot(str(root), component_hash)
+
+    return True
 
 
 def validate_managed_component_hash(root):  # type: (str) -> None
@@ -116,5 +523,5 @@ def validate_managed_component_hash(root):  # type: (str) -> None
     if not re.match(SHA256_RE, hash_from_file):
         raise HashNotSHA256Error()
 
-    if not validate_filtered_dir(root, hash_from_file):
-        raise HashNotEqualError()
+    if not validate_managed_component_files(root, hash_from_file):
+        raise HashNotEqualError(_managed_component_changes(root, hash_from_file))
@@ -104,27 +104,37 @@ class ManifestManager(object):
     def exists(self):
         return os.path.isfile(self.path)
 
+    @classmethod
+    def from_string(cls, content, name, path=MANIFEST_FILENAME):  # type: (str, str, str) -> ManifestManager
+        """Manager of the manifest that is not stored in a file, e.g. read from the git object database"""
+        manager = cls(path, name)
+        manager._manifest_tree = manager.parse_manifest(content)
+        return manager
+
     def parse_manifest_file(self):  # type: () -> Dict
         if not self.exists():
             return EMPTY_MANIFEST
 
         with open(self.path, mode='r', encoding='utf-8') as f:
-            try:
-                manifest_data = yaml.safe_load(f.read())
+            return self.parse_manifest(f.read())
+
+    def parse_manifest(self, content):  # type: (str) -> Dict
+        try:
+            manifest_data = yaml.safe_load(content)
 
-                if manifest_data is None:
-                    manifest_data = EMPTY_MANIFEST
+            if manifest_data is None:
+                manifest_data = EMPTY_MANIFEST
 
-                expanded_manifest_data = expand_env_vars(manifest_data)
+            expanded_manifest_data = expand_env_vars(manifest_data)
 
-                if not isinstance(expanded_manifest_data, dict):
-                    raise ManifestError('Unknown format of the manifest file: {}'.format(self.path))
+            if not isinstance(expanded_manifest_data, dict):
+                raise ManifestError('Unknown format of the manifest file: {}'.format(self.path))
 
-                return expanded_manifest_data
+            return expanded_manifest_data
 
-            except yaml.YAMLError:
-                raise ManifestError(
-                    'Cannot parse the manifest file. Please check that\n\t{}\nis valid YAML file\n'.format(self.path))
+        except yaml.YAMLError:
+            raise ManifestError(
+                'Cannot parse the manifest file. Please check that\n\t{}\nis valid YAML file\n'.format(self.path))
 
     def load(self):  # type: () -> Manifest
         self.validate()
@@ -186,6 +186,7 @@ class ComponentRequirement(object):
     ):
         # type: (...) -> None
         self._version_spec = version_spec
+        self._normalized_version_spec = None  # type: str | None
         self.source = source
         self._name = name
         self.public = None  # type: bool | None
@@ -206,7 +207,11 @@ class ComponentRequirement(object):
 
     @property
     def version_spec(self):
-        return self.source.normalize_spec(self._version_spec)
+        # Normalization may require resolving refs of the source, do it once
+        if self._normalized_version_spec is None:
+            self._normalized_version_spec = self.source.normalize_spec(self._version_spec)
+
+        return self._normalized_version_spec
 
     @property
     def meet_optional_dependencies(self):
@@ -11,11 +11,11 @@ import idf_component_tools as tools
 
 from ..errors import FetchingError, SourceError
 from ..file_cache import FileCache
-from ..hash_tools import validate_filtered_dir
+from ..hash_tools import validate_managed_component_files
 from ..semver import SimpleSpec
 
 try:
-    from typing import TYPE_CHECKING, Callable
+    from typing import TYPE_CHECKING, Callable, List
 
     if TYPE_CHECKING:
         from ..manifest import ComponentWithVersions, ManifestManager, SolvedComponent
@@ -60,6 +60,25 @@ class BaseSource(object):
         path = os.path.join(self.system_cache_path, '{}_{}'.format(self.NAME, self.hash_key[:8]))
         return path
 
+    def record_cache_access(self, *paths):  # type: (str) -> None
+        """Mark entries of the component cache as recently used, to keep them on pruning of the cache"""
+        FileCache(self.system_cache_path).record_access(*paths)
+
+    def record_cache_update(self, *paths):  # type: (str) -> int
+        """
+        Mark entries of the component cache as recently used and update their sizes after changes.
+        Returns the growth of entries.
+        """
+        return FileCache(self.system_cache_path).record_update(*paths)
+
+    def record_cache_stats(self, **counters):  # type: (int) -> None
+        """Add values to cumulative counters of hits and misses of the component cache"""
+        FileCache(self.system_cache_path).record_stats(**counters)
+
+    def cache_entries(self, component):  # type: (SolvedComponent) -> List[str]
+        """Paths in the component cache used by the solved component, kept by the garbage collection of the cache"""
+        return []
+
     def __eq__(self, other):  # type: (object) -> bool
         if not isinstance(other, BaseSource):
             return NotImplemented
@@ -174,7 +193,7 @@ class BaseSource(object):
                 return False
 
             if component.component_hash:
-                return validate_filtered_dir(path, component.component_hash)
+                return validate_managed_component_files(path, component.component_hash)
 
         return True
 
@@ -8,7 +8,8 @@ from io import open
 from ..build_system_tools import build_name
 from ..errors import ComponentModifiedError, InvalidComponentHashError
 from ..hash_tools import (
-    HASH_FILENAME, HashDoesNotExistError, HashNotEqualError, HashNotSHA256Error, validate_managed_component_hash)
+    HASH_FILENAME, HASH_TREE_FILENAME, HashDoesNotExistError, HashNotEqualError, HashNotSHA256Error, hash_format,
+    integrity_mode, validate_managed_component_hash, write_hash_tree, write_stat_snapshot)
 from ..manifest import SolvedComponent
 
 try:
@@ -36,10 +37,10 @@ class ComponentFetcher(object):
         """If necessary, it downloads component and returns local path to component directory"""
         try:
             validate_managed_component_hash(self.managed_path)
-        except HashNotEqualError:
+        except HashNotEqualError as e:
             raise ComponentModifiedError(
                 'Component directory was modified on the disk since the last run of '
-                'the CMake')
+                'the CMake', changes=e.changes)
         except HashNotSHA256Error:
             raise InvalidComponentHashError(
                 'File .component_hash for component "{}" in the managed '
@@ -59,3 +60,10 @@ class ComponentFetcher(object):
             if not os.path.isfile(hash_file):
                 with open(hash_file, mode='w+', encoding='utf-8') as f:
                     f.write(u'{}'.format(component_hash))
+
+                # Files were just copied from the source, their sizes and mtimes are trusted until changed
+                if component_hash and integrity_mode() == 'stat':
+                    write_stat_snapshot(path, component_hash)
+
+            if hash_format() >= 2 and not os.path.isfile(os.path.join(path, HASH_TREE_FILENAME)):
+                write_hash_tree(path)
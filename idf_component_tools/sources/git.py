@@ -2,15 +2,24 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import os
+import posixpath
 import re
 import shutil
 import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
 from hashlib import sha256
+from io import open
+from multiprocessing.pool import ThreadPool
 
+from ..environment import getenv_int
 from ..errors import FetchingError
-from ..file_tools import copy_filtered_directory
-from ..git_client import GitClient
-from ..hash_tools import hash_dir
+from ..file_lock import FileLock
+from ..file_tools import (
+    DEFAULT_EXCLUDE, PathFilter, create_directory, filtered_paths, read_json, replace_directory, sync_directory,
+    write_json)
+from ..git_client import SYMLINK_MODE, GitClient, fetch_interval, normalize_tree_path, partial_clone_filter
+from ..hash_tools import hash_dir, hash_files, hash_object
 from ..manifest import (
     MANIFEST_FILENAME, ComponentVersion, ComponentWithVersions, HashedComponentVersion, ManifestManager)
 from .base import BaseSource
@@ -21,25 +30,41 @@ except ImportError:
     from urlparse import urlparse  # type: ignore
 
 try:
-    from typing import TYPE_CHECKING, Dict
+    from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Set, Tuple
 
     if TYPE_CHECKING:
-        from ..manifest import SolvedComponent
+        from ..git_client import TreeEntry
+        from ..manifest import ComponentRequirement, Manifest, SolvedComponent
 except ImportError:
     pass
 
 BRANCH_TAG_RE = re.compile(r'^(?!.*/\.)(?!.*\.\.)(?!/)(?!.*//)(?!.*@\{)(?!.*\\)[^\177\s~^:?*\[]+[^.]$')
+GITATTRIBUTES_FILENAME = '.gitattributes'
+DEFAULT_FETCH_JOBS = 4
+
+
+def repository_hash(url):  # type: (str) -> str
+    """Hash of the repository URL, ignoring the scheme and redundant slashes"""
+    parsed_url = urlparse(url)
+    path = '/'.join(filter(None, parsed_url.path.split('/')))
+    normalized_path = '/'.join([parsed_url.netloc, path])
+    return sha256(normalized_path.encode('utf-8')).hexdigest()
 
 
 class GitSource(BaseSource):
     NAME = 'git'
 
+    # Paths of components used from each cached repository,
+    # to check out all of them at once when several components share the commit
+    _component_paths = {}  # type: Dict[str, Set[str]]
+
     def __init__(self, source_details=None, **kwargs):
         super(GitSource, self).__init__(source_details=source_details, **kwargs)
         self.git_repo = source_details['git']
         self.component_path = source_details.get('path') or '.'
 
-        self._client = GitClient()
+        self._client = GitClient(partial_clone_filter=partial_clone_filter(), fetch_interval=fetch_interval())
+        self._component_paths.setdefault(self.cache_path(), set()).add(normalize_tree_path(self.component_path))
 
     def _checkout_git_source(
             self,
@@ -55,7 +80,172 @@ class GitSource(BaseSource):
             checkout_path=path,
             ref=version,
             with_submodules=True,
-            selected_paths=selected_paths)
+            selected_paths=selected_paths,
+            submodule_mirror_path=self._submodule_mirror_path)
+
+    def _component_tree(self, commit_id, version):  # type: (str, str | None) -> List[TreeEntry]
+        entries = self._client.list_tree(
+            repo=self.git_repo, bare_path=self.cache_path(), ref=commit_id, path=self.component_path, recursive=True)
+
+        if entries is None:
+            dependency_description = 'commit id "{}"'.format(commit_id)
+            if version:
+                dependency_description = 'version "{}" ({})'.format(version, dependency_description)
+            raise FetchingError(
+                'Directory {} wasn\'t found for the {} of the git repository "{}"'.format(
+                    self.component_path, dependency_description, self.git_repo))
+
+        return entries
+
+    def _requires_checkout(self, entries):  # type: (List[TreeEntry]) -> bool
+        """Submodules and symlinks in the component directory can be resolved only by a real checkout"""
+        return any(entry.type == 'commit' or entry.mode == SYMLINK_MODE for entry in entries)
+
+    def _checkout_filters_apply(self, commit_id, entries):  # type: (str, List[TreeEntry]) -> bool
+        """Check if git attributes (line endings, LFS, etc.) could change files of the component on checkout"""
+        if any(posixpath.basename(entry.path) == GITATTRIBUTES_FILENAME for entry in entries):
+            return True
+
+        # Attributes from parent directories are applied to the component directory too
+        parent_path = ''
+        for part in [''] + normalize_tree_path(self.component_path).split('/')[:-1]:
+            parent_path = posixpath.join(parent_path, part)
+            parent_entries = self._client.list_tree(
+                repo=self.git_repo, bare_path=self.cache_path(), ref=commit_id, path=parent_path) or []
+            if any(entry.path == GITATTRIBUTES_FILENAME for entry in parent_entries):
+                return True
+
+        return self._client.checkout_filters_enabled(self.cache_path())
+
+    def _hash_tree(self, entries):  # type: (List[TreeEntry]) -> str
+        """Calculate the same hash as `hash_dir` of the checkout, from blobs in the object database"""
+        path_filter = PathFilter()
+        file_hashes = []
+        for entry in entries:
+            if entry.type != 'blob' or not path_filter.match(entry.path):
+                continue
+
+            content = self._client.read_blob(repo=self.git_repo, bare_path=self.cache_path(), ref=entry.sha)
+            file_hashes.append((entry.path, sha256(content).hexdigest()))
+
+        return hash_files(file_hashes)
+
+    def _manifest_from_tree(self, entries):  # type: (List[TreeEntry]) -> str | None
+        for entry in entries:
+            if entry.path == MANIFEST_FILENAME and entry.type == 'blob':
+                content = self._client.read_blob(repo=self.git_repo, bare_path=self.cache_path(), ref=entry.sha)
+                return content.decode('utf-8')  # type: ignore
+
+        return None
+
+    def _prefetch_tree(self, commit_id, entries):  # type: (str, List[TreeEntry]) -> None
+        self._client.prefetch_blobs(
+            repo=self.git_repo,
+            bare_path=self.cache_path(),
+            ref=commit_id,
+            blobs=[entry.sha for entry in entries if entry.type == 'blob'])
+
+    def _resolve_version(self, commit_id, version):  # type: (str, str | None) -> Tuple[Dict[str, Any], bool]
+        """Returns component hash and manifest for the commit and flag if the result can be cached"""
+        entries = self._component_tree(commit_id, version)
+
+        checkout_filters_apply = self._checkout_filters_apply(commit_id, entries)
+        if not checkout_filters_apply and not self._requires_checkout(entries):
+            self._prefetch_tree(commit_id, entries)
+            return {'component_hash': self._hash_tree(entries), 'manifest': self._manifest_from_tree(entries)}, True
+
+        with self._worktree(commit_id, [self.component_path]) as worktree_path:
+            source_path = os.path.join(worktree_path, self.component_path)
+
+            manifest = None
+            manifest_path = os.path.join(source_path, MANIFEST_FILENAME)
+            if os.path.isfile(manifest_path):
+                with open(manifest_path, mode='r', encoding='utf-8') as f:
+                    manifest = f.read()
+
+            component_hash = hash_dir(source_path)
+
+        # Result of checkout with filters depends on the local git configuration, don't cache it
+        return {'component_hash': component_hash, 'manifest': manifest}, not checkout_filters_apply
+
+    def worktrees_path(self):  # type: () -> str
+        # Using `w_` prefix for checkouts of commits of git repos in cache
+        return os.path.join(self.system_cache_path, 'w_{}_{}'.format(self.NAME, self.hash_key[:8]))
+
+    def cache_entries(self, component):  # type: (SolvedComponent) -> List[str]
+        # Version of the solved git dependency is the commit id
+        return [
+            self.cache_path(),
+            self.versions_cache_path(),
+            os.path.join(self.worktrees_path(), str(component.version))
+        ]
+
+    @contextmanager
+    def _worktree(self, commit_id, paths):  # type: (str, List[str]) -> Iterator[str]
+        """
+        Path to the checkout of the commit from the pool of worktrees, locked while in the context.
+        The commit is checked out only if the existing checkout doesn't contain all required paths.
+        Other processes may replace the worktree with a checkout of more paths, so it must be read only in the context.
+        """
+        worktree_path = os.path.join(self.worktrees_path(), commit_id)
+        # List of checked out paths is stored next to the worktree to keep its content untouched
+        paths_file = '{}.json'.format(worktree_path)
+
+        def is_checked_out(path, checked_out_paths):  # type: (str, List[str]) -> bool
+            return any(
+                checked_out == '.' or path == checked_out or path.startswith(checked_out + '/')
+                for checked_out in checked_out_paths)
+
+        # Worktrees are shared by all processes that use the same cache
+        create_directory(self.worktrees_path())
+        self.record_cache_access(worktree_path)
+        with FileLock('{}.lock'.format(worktree_path)):
+            required_paths = {normalize_tree_path(path) or '.' for path in paths}
+            checked_out_paths = read_json(paths_file, default=[]) if os.path.isdir(worktree_path) else []
+            if not isinstance(checked_out_paths, list):
+                checked_out_paths = []
+
+            if not checked_out_paths or not all(is_checked_out(path, checked_out_paths) for path in required_paths):
+                selected_paths = self._update_worktree(
+                    commit_id, worktree_path, required_paths | set(checked_out_paths))
+                write_json(paths_file, selected_paths)
+                self.record_cache_update(worktree_path)
+
+            yield worktree_path
+
+    def _update_worktree(self, commit_id, worktree_path, paths):  # type: (str, str, Set[str]) -> List[str]
+        """Check out paths of the commit to the worktree, returns all checked out paths"""
+        # Other components from the same repository are checked out too, if they exist in the commit
+        shared_paths = set()
+        for path in self._component_paths.get(self.cache_path(), set()):
+            tree = self._client.list_tree(repo=self.git_repo, bare_path=self.cache_path(), ref=commit_id, path=path)
+            if path and tree is not None:
+                shared_paths.add(path)
+
+        selected_paths = sorted(paths | shared_paths)
+        temp_path = tempfile.mkdtemp(prefix='.{}_'.format(commit_id[:8]), dir=self.worktrees_path())
+        try:
+            self._checkout_git_source(commit_id, temp_path, selected_paths=selected_paths)
+
+            # Publish only the complete checkout, replacing the previous one
+            replace_directory(temp_path, worktree_path)
+        finally:
+            if os.path.isdir(temp_path):
+                shutil.rmtree(temp_path)
+
+        return selected_paths
+
+    def versions_cache_path(self):  # type: () -> str
+        # Using `v_` prefix for resolved versions of components from git repos in cache
+        return os.path.join(self.system_cache_path, 'v_{}_{}'.format(self.NAME, self.hash_key[:8]))
+
+    def _version_cache_file(self, commit_id):  # type: (str) -> str
+        # Commit and path are immutable, but rules of hash calculation may change with the new version of the tool
+        rules_key = hash_object({'path': normalize_tree_path(self.component_path), 'exclude': DEFAULT_EXCLUDE})
+        return os.path.join(self.versions_cache_path(), '{}_{}.json'.format(commit_id, rules_key[:16]))
+
+    def _load_manifest(self, content, name):  # type: (str, str) -> Manifest
+        return ManifestManager.from_string(content, name=name).load()
 
     @staticmethod
     def is_me(name, details):  # type: (str, dict) -> bool
@@ -80,18 +270,36 @@ class GitSource(BaseSource):
     @property
     def hash_key(self):
         if self._hash_key is None:
-            url = urlparse(self.git_repo)
-            netloc = url.netloc
-            path = '/'.join(filter(None, url.path.split('/')))
-            normalized_path = '/'.join([netloc, path])
-            self._hash_key = sha256(normalized_path.encode('utf-8')).hexdigest()
+            self._hash_key = repository_hash(self.git_repo)
         return self._hash_key
 
+    @classmethod
+    def cached_repositories(cls, system_cache_path):  # type: (str) -> List[str]
+        """Paths of bare repositories of all git sources in the cache"""
+        prefix = 'b_{}_'.format(cls.NAME)
+        return sorted(
+            os.path.join(system_cache_path, name) for name in os.listdir(system_cache_path)
+            if name.startswith(prefix) and os.path.isdir(os.path.join(system_cache_path, name)))
+
     def cache_path(self):
         # Using `b_` prefix for bare git repos in cache
         path = os.path.join(self.system_cache_path, 'b_{}_{}'.format(self.NAME, self.hash_key[:8]))
         return path
 
+    def _record_updated_mirrors(self):  # type: () -> None
+        """Update sizes of mirrors changed by fetches in the ledger of the cache, and count fetches"""
+        updated_mirrors = self._client.pop_updated_mirrors()
+        fetched_size = self.record_cache_update(*updated_mirrors) if updated_mirrors else 0
+        fetch_stats = self._client.pop_fetch_stats()
+        self.record_cache_stats(
+            git_fetches=fetch_stats.get('fetched', 0),
+            git_fetches_skipped=fetch_stats.get('skipped', 0),
+            git_bytes_fetched=max(fetched_size, 0))
+
+    def _submodule_mirror_path(self, url):  # type: (str) -> str
+        # Submodules share bare repos with git dependencies from the same URL
+        return os.path.join(self.system_cache_path, 'b_{}_{}'.format(self.NAME, repository_hash(url)[:8]))
+
     def download(self, component, download_path):  # type: (SolvedComponent, str) -> str | None
         # Check for required components
         if not component.component_hash:
@@ -103,17 +311,43 @@ class GitSource(BaseSource):
         if self.up_to_date(component, download_path):
             return download_path
 
-        temp_dir = tempfile.mkdtemp()
-        try:
-            self._checkout_git_source(component.version, temp_dir, selected_paths=[self.component_path])
-            source_path = os.path.join(str(temp_dir), self.component_path)
-            if not os.path.isdir(source_path):
-                raise FetchingError(
-                    'Directory {} wasn\'t found for the commit id "{}" of the git repository "{}"'.format(
-                        self.component_path, component.version, self.git_repo))
+        version = None if str(component.version) == '*' else str(component.version)
+        commit_id = self._client.get_commit_id_by_ref(self.git_repo, self.cache_path(), version)
+        self.record_cache_access(self.cache_path())
+        entries = self._component_tree(commit_id, None)
+        self._record_updated_mirrors()
+
+        if not self._requires_checkout(entries) and not self._checkout_filters_apply(commit_id, entries):
+            self._prefetch_tree(commit_id, entries)
+
+            include, exclude = set(), set()
+            manifest_content = self._manifest_from_tree(entries)
+            if manifest_content is not None:
+                manifest = self._load_manifest(manifest_content, component.name)
+                include.update(manifest.files['include'])
+                exclude.update(manifest.files['exclude'])
+
+            # Stream files of the component directly from the object database,
+            # files of the previous version are updated from a temporary directory
+            staging_path = tempfile.mkdtemp() if os.path.isdir(download_path) else download_path
+            create_directory(staging_path)
+            try:
+                self._client.archive(
+                    repo=self.git_repo,
+                    bare_path=self.cache_path(),
+                    ref=commit_id,
+                    destination=staging_path,
+                    path=self.component_path,
+                    member_filter=PathFilter(include=include, exclude=exclude).match)
+                if staging_path != download_path:
+                    sync_directory(staging_path, download_path)
+            finally:
+                if staging_path != download_path:
+                    shutil.rmtree(staging_path)
+            return download_path
 
-            if os.path.isdir(download_path):
-                shutil.rmtree(download_path)
+        with self._worktree(commit_id, [self.component_path]) as worktree_path:
+            source_path = os.path.join(worktree_path, self.component_path)
 
             possible_manifest_filepath = os.path.join(source_path, MANIFEST_FILENAME)
             include, exclude = set(), set()
@@ -122,47 +356,41 @@ class GitSource(BaseSource):
                 include.update(manifest.files['include'])
                 exclude.update(manifest.files['exclude'])
 
-            copy_filtered_directory(source_path, download_path, include=include, exclude=exclude)
-        finally:
-            shutil.rmtree(temp_dir)
+            sync_directory(
+                source_path, download_path, paths=filtered_paths(source_path, include=include, exclude=exclude))
 
         return download_path
 
     def versions(self, name, details=None, spec='*', target=None):
         """For git returns hash of locked commit, ignoring manifest"""
         version = None if spec == '*' else spec
-        temp_dir = tempfile.mkdtemp()
-        try:
-            commit_id = self._checkout_git_source(version, temp_dir, selected_paths=[self.component_path])
-            source_path = os.path.join(str(temp_dir), self.component_path)
-
-            if not os.path.isdir(source_path):
-                dependency_description = 'commit id "{}"'.format(commit_id)
-                if version:
-                    dependency_description = 'version "{}" ({})'.format(version, dependency_description)
-                raise FetchingError(
-                    'Directory {} wasn\'t found for the {} of the git repository "{}"'.format(
-                        self.component_path, dependency_description, self.git_repo))
-
-            manifest_path = os.path.join(source_path, MANIFEST_FILENAME)
-            targets = []
-            dependencies = []
-
-            if os.path.isfile(manifest_path):
-                manifest = ManifestManager(manifest_path, name=name).load()
-                dependencies = manifest.dependencies
-
-                if manifest.targets:  # only check when exists
-                    if target and target not in manifest.targets:
-                        raise FetchingError(
-                            'Version "{}" (commit id "{}") of the component "{}" does not support target "{}"'.format(
-                                version, commit_id, name, target))
-
-                    targets = manifest.targets
-
-            component_hash = hash_dir(source_path)
-        finally:
-            shutil.rmtree(temp_dir)
+        commit_id = self._client.get_commit_id_by_ref(self.git_repo, self.cache_path(), version)
+
+        cache_file = self._version_cache_file(commit_id)
+        resolved = read_json(cache_file)
+        if not isinstance(resolved, dict) or 'component_hash' not in resolved or 'manifest' not in resolved:
+            resolved, cacheable = self._resolve_version(commit_id, version)
+            if cacheable:
+                write_json(cache_file, resolved)
+                self.record_cache_update(cache_file)
+        self.record_cache_access(self.cache_path(), cache_file)
+        self._record_updated_mirrors()
+
+        component_hash = resolved['component_hash']
+        targets = []
+        dependencies = []
+
+        if resolved['manifest'] is not None:
+            manifest = self._load_manifest(resolved['manifest'], name)
+            dependencies = manifest.dependencies
+
+            if manifest.targets:  # only check when exists
+                if target and target not in manifest.targets:
+                    raise FetchingError(
+                        'Version "{}" (commit id "{}") of the component "{}" does not support target "{}"'.format(
+                            version, commit_id, name, target))
+
+                targets = manifest.targets
 
         return ComponentWithVersions(
             name=name,
@@ -194,4 +422,35 @@ class GitSource(BaseSource):
             return '*'
         ref = None if spec == '*' else spec
         commit_id = self._client.get_commit_id_by_ref(self.git_repo, self.cache_path(), ref)
+        self._record_updated_mirrors()
         return commit_id
+
+
+def prefetch_git_repositories(requirements):  # type: (Iterable[ComponentRequirement]) -> None
+    """
+    Update cached repositories of git dependencies in parallel, one job per repository,
+    by resolving their version specs before dependencies are processed one by one.
+    Errors are ignored here, they are raised again when the dependency is processed.
+    """
+    repositories = OrderedDict()  # type: OrderedDict[str, List[ComponentRequirement]]
+    for requirement in requirements:
+        if isinstance(requirement.source, GitSource):
+            repositories.setdefault(requirement.source.cache_path(), []).append(requirement)
+
+    jobs = min(getenv_int('IDF_COMPONENT_GIT_FETCH_JOBS', DEFAULT_FETCH_JOBS), len(repositories))
+    if jobs < 2:
+        return
+
+    def update_repository(repository_requirements):  # type: (List[ComponentRequirement]) -> None
+        for requirement in repository_requirements:
+            try:
+                requirement.version_spec
+            except Exception:  # nosec
+                pass
+
+    pool = ThreadPool(jobs)
+    try:
+        pool.map(update_repository, list(repositories.values()))
+    finally:
+        pool.close()
+        pool.join()
@@ -18,7 +18,9 @@ from ..archive_tools import ArchiveError, get_format_from_path, unpack_archive
 from ..config import component_registry_url
 from ..constants import IDF_COMPONENT_REGISTRY_URL, IDF_COMPONENT_STORAGE_URL, UPDATE_SUGGESTION
 from ..errors import FetchingError, hint
-from ..file_tools import copy_directory
+from ..file_cache import FileCache
+from ..file_lock import FileLock
+from ..file_tools import create_directory, replace_directory, sync_directory
 from ..hash_tools import validate_filtered_dir
 from . import utils
 from .base import BaseSource
@@ -29,7 +31,7 @@ except ImportError:
     from urlparse import urlparse  # type: ignore
 
 try:
-    from typing import TYPE_CHECKING, Dict
+    from typing import TYPE_CHECKING, Dict, List
 
     if TYPE_CHECKING:
         from ..manifest import SolvedComponent
@@ -139,6 +141,9 @@ class WebServiceSource(BaseSource):
         path = os.path.join(self.cache_path(), component_dir_name)
         return path
 
+    def cache_entries(self, component):  # type: (SolvedComponent) -> List[str]
+        return [self.component_cache_path(component)] if component.component_hash else []
+
     def versions(self, name, details=None, spec='*', target=None):
         cmp_with_versions = self.api_client.versions(component_name=name, spec=spec)
         versions = []
@@ -211,11 +216,29 @@ class WebServiceSource(BaseSource):
         if self.up_to_date(component, download_path):
             return download_path
 
-        # Check if component is in the cache
-        if validate_filtered_dir(self.component_cache_path(component), component.component_hash):
-            copy_directory(self.component_cache_path(component), download_path)
-            return download_path
+        cache_path = self.component_cache_path(component)
+        create_directory(self.cache_path())
+        # Parallel builds sharing the cache wait for one of them to download the component
+        with FileLock('{}.lock'.format(cache_path)):
+            # Check if component is in the cache
+            if validate_filtered_dir(cache_path, component.component_hash):
+                self.record_cache_access(cache_path)
+                self.record_cache_stats(
+                    archive_hits=1, archive_bytes_served=FileCache(self.system_cache_path).entry_size(cache_path))
+            else:
+                self._download_to_cache(component, cache_path)
+                self.record_cache_update(cache_path)
+
+            # Files not changed since the previous version of the component are kept
+            sync_directory(cache_path, download_path)
+
+        return download_path
 
+    def _download_to_cache(self, component, cache_path):  # type: (SolvedComponent, str) -> None
+        """
+        Download and unpack the component next to the cache entry, then publish the complete entry at once.
+        Files already stored in the cache by other entries are shared with them.
+        """
         component_manifest = self.api_client.component(component_name=component.name, version=component.version)
         url = component_manifest.download_url
 
@@ -227,17 +250,24 @@ class WebServiceSource(BaseSource):
             )
 
         tempdir = tempfile.mkdtemp()
+        # Temporary directories of entries start with a dot, they are not treated as entries of the cache
+        staging_path = tempfile.mkdtemp(prefix='.{}_'.format(os.path.basename(cache_path)), dir=self.cache_path())
 
         try:
             file_path = download_archive(url, tempdir)
-            unpack_archive(file_path, self.component_cache_path(component))
-            copy_directory(self.component_cache_path(component), download_path)
+            unpack_archive(file_path, staging_path)
+            deduplicated_size = FileCache(self.system_cache_path).deduplicate(staging_path)
+            replace_directory(staging_path, cache_path)
+            self.record_cache_stats(
+                archive_misses=1,
+                archive_bytes_downloaded=os.path.getsize(file_path),
+                archive_bytes_deduplicated=deduplicated_size)
         except FetchingError as e:
             raise FetchingError('Cannot download component {}@{}. {}'.format(component.name, component.version, str(e)))
         finally:
             shutil.rmtree(tempdir)
-
-        return download_path
+            if os.path.isdir(staging_path):
+                shutil.rmtree(staging_path)
 
     @property
     def service_url(self):
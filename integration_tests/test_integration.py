@@ -36,7 +36,7 @@ from .integration_test_helpers import (
     indirect=True)
 def test_git_folder_does_not_exists(project):
     res = build_project(project)
-    assert 'pathspec \'folder-not-exist\' did not match any file(s) known to git' in res
+    assert 'Directory folder-not-exist wasn\'t found' in res
 
 
 @pytest.mark.parametrize(
@@ -84,6 +84,10 @@ setuptools.setup(
         exclude=('*.tests', '*.tests.*', 'tests.*', 'tests', '*_tests', '*_tests_*', 'tests_*')),
     scripts=[],
     install_requires=REQUIRES,
+    extras_require={
+        'blake3': ['blake3;python_version>="3.7"'],
+        'pygit2': ['pygit2;python_version>="3.7"'],
+    },
     python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*',
     include_package_data=True,
     entry_points={
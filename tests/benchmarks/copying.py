@@ -0,0 +1,86 @@
+# SPDX-FileCopyrightText: 2023 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+"""
+Compare `copy_directory` with `shutil.copytree` on a generated component directory,
+and `sync_directory` updating a copy of the component with a few changed files:
+
+    python tests/benchmarks/copying.py --files 2000 --size 64 --rounds 5 --path /mnt/btrfs
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from io import open
+
+from idf_component_tools.file_tools import copy_directory, sync_directory
+
+try:
+    from typing import Any, Callable
+except ImportError:
+    pass
+
+
+def create_component(path, files, size):  # type: (str, int, int) -> str
+    component_path = os.path.join(path, 'cmp')
+    for i in range(files):
+        file_path = os.path.join(component_path, 'lib{}'.format(i % 10), 'src', 'file{}.c'.format(i))
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, 'wb') as f:
+            f.write(os.urandom(size * 1024))
+
+    return component_path
+
+
+def measure(name, func, rounds):  # type: (str, Callable[[int], Any], int) -> None
+    start = time.time()
+    for i in range(rounds):
+        func(i)
+    duration = time.time() - start
+    print('  {:<16} {:>9.2f} ms total, {:>8.3f} ms per call'.format(name, duration * 1000, duration * 1000 / rounds))
+
+
+def copy_with_jobs(component_path, destination, jobs):  # type: (str, str, int) -> None
+    os.environ['IDF_COMPONENT_COPY_JOBS'] = str(jobs)
+    copy_directory(component_path, destination)
+
+
+def main():  # type: () -> None
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=1000, help='Number of files in the generated component')
+    parser.add_argument('--size', type=int, default=32, help='Size of every file in KB')
+    parser.add_argument('--rounds', type=int, default=5, help='Number of calls of every operation')
+    parser.add_argument('--path', help='Directory on the file system to test, temporary directory by default')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(dir=args.path)
+    try:
+        component_path = create_component(temp_dir, args.files, args.size)
+        destination = os.path.join(temp_dir, 'destination')
+
+        def copytree(_):  # type: (int) -> None
+            if os.path.exists(destination):
+                shutil.rmtree(destination)
+            shutil.copytree(component_path, destination)
+
+        print('copy_directory:')
+        measure('shutil.copytree', copytree, args.rounds)
+        for jobs in (1, 2, 4, 8):
+            measure('{} threads'.format(jobs), lambda _: copy_with_jobs(component_path, destination, jobs), args.rounds)
+
+        def change_files(_):  # type: (int) -> None
+            for i in range(0, args.files, 100):
+                file_path = os.path.join(destination, 'lib{}'.format(i % 10), 'src', 'file{}.c'.format(i))
+                with open(file_path, 'ab') as f:
+                    f.write(b'changed')
+
+        print('update with 1% of changed files:')
+        measure('copy_directory', lambda i: change_files(i) or copy_directory(component_path, destination), args.rounds)
+        measure('sync_directory', lambda i: change_files(i) or sync_directory(component_path, destination), args.rounds)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
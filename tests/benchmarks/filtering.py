@@ -0,0 +1,83 @@
+# SPDX-FileCopyrightText: 2023 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+"""
+Compare the single pass walk of `filtered_paths` with the previous implementation based on `Path.glob`
+on a generated component with a git repository, build directory and managed components:
+
+    python tests/benchmarks/filtering.py --files 2000 --ignored 20000 --rounds 5
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from io import open
+from pathlib import Path
+
+from idf_component_tools.file_tools import DEFAULT_EXCLUDE, filtered_paths
+
+try:
+    from typing import Any, Callable, Set
+except ImportError:
+    pass
+
+
+def create_files(path, files):  # type: (str, int) -> None
+    for i in range(files):
+        file_path = os.path.join(path, 'dir{}'.format(i % 20), 'sub{}'.format(i % 7), 'file{}.c'.format(i))
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, 'w') as f:
+            f.write(u'int file{0}(void) {{ return {0}; }}\n'.format(i))
+
+
+def create_component(path, files, ignored):  # type: (str, int, int) -> str
+    component_path = os.path.join(path, 'cmp')
+    create_files(os.path.join(component_path, 'src'), files)
+    # Directories excluded by default patterns
+    for name in ('.git', 'build', 'managed_components'):
+        create_files(os.path.join(component_path, name), ignored // 3)
+
+    return component_path
+
+
+def glob_filtered_paths(path):  # type: (str) -> Set[Path]
+    base_path = Path(path)
+    paths = set(base_path.glob('**/*'))
+    for pattern in DEFAULT_EXCLUDE:
+        paths -= set(base_path.glob(pattern))
+        if pattern.endswith('/**/*'):
+            paths -= set(base_path.glob(pattern[:pattern.rindex('/**/*')]))
+
+    return paths
+
+
+def measure(name, func, rounds):  # type: (str, Callable[[int], Any], int) -> None
+    start = time.time()
+    for i in range(rounds):
+        func(i)
+    duration = time.time() - start
+    print('  {:<12} {:>9.2f} ms total, {:>8.3f} ms per call'.format(name, duration * 1000, duration * 1000 / rounds))
+
+
+def main():  # type: () -> None
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=1000, help='Number of files of the component')
+    parser.add_argument('--ignored', type=int, default=10000, help='Number of files in excluded directories')
+    parser.add_argument('--rounds', type=int, default=5, help='Number of calls of every operation')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        component_path = create_component(temp_dir, args.files, args.ignored)
+        assert filtered_paths(component_path) == glob_filtered_paths(component_path)
+
+        print('filtered_paths:')
+        measure('glob', lambda _: glob_filtered_paths(component_path), args.rounds)
+        measure('walk', lambda _: filtered_paths(component_path), args.rounds)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
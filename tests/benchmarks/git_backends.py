@@ -0,0 +1,93 @@
+# SPDX-FileCopyrightText: 2023 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+"""
+Compare read-only operations of git backends on a generated repository:
+
+    python tests/benchmarks/git_backends.py --files 2000 --rounds 200
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from io import open
+
+from idf_component_tools.git_backends import CliGitBackend, GitBackend, Pygit2GitBackend
+from idf_component_tools.git_client import GitClient, parse_tree
+
+try:
+    from typing import Any, Callable
+except ImportError:
+    pass
+
+
+def create_repository(path, files):  # type: (str, int) -> str
+    repo_path = os.path.join(path, 'repo')
+    subprocess.check_output(['git', 'init', repo_path])
+    for i in range(files):
+        file_path = os.path.join(repo_path, 'cmp{}'.format(i % 10), 'src', 'file{}.c'.format(i))
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, 'w') as f:
+            f.write(u'int file{0}(void) {{ return {0}; }}\n'.format(i))
+
+    subprocess.check_output(['git', 'add', '.'], cwd=repo_path)
+    subprocess.check_output(
+        ['git', '-c', 'user.name=Benchmark', '-c', 'user.email=benchmark@example.com', 'commit', '-m', 'Init'],
+        cwd=repo_path)
+
+    bare_path = os.path.join(path, 'bare')
+    subprocess.check_output(['git', 'clone', '--bare', repo_path, bare_path])
+    return bare_path
+
+
+def measure(name, func, rounds):  # type: (str, Callable[[int], Any], int) -> None
+    start = time.time()
+    for i in range(rounds):
+        func(i)
+    duration = time.time() - start
+    print('  {:<12} {:>9.2f} ms total, {:>8.3f} ms per call'.format(name, duration * 1000, duration * 1000 / rounds))
+
+
+def checkout(backend, bare_path, commit_id, temp_dir, i):  # type: (GitBackend, str, str, str, int) -> None
+    checkout_path = os.path.join(temp_dir, backend.name, str(i))
+    os.makedirs(checkout_path)
+    backend.checkout(bare_path, commit_id, checkout_path, ['cmp0'])
+
+
+def main():  # type: () -> None
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=1000, help='Number of files in the generated repository')
+    parser.add_argument('--rounds', type=int, default=100, help='Number of calls of every operation')
+    args = parser.parse_args()
+
+    backends = [CliGitBackend('git', GitClient(backend='cli').run)]
+    if Pygit2GitBackend.available():
+        backends.append(Pygit2GitBackend())
+    else:
+        print('pygit2 is not installed, only git CLI is measured')
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        bare_path = create_repository(temp_dir, args.files)
+        commit_id = backends[0].resolve_ref(bare_path, 'HEAD') or ''
+        for backend in backends:
+            print('{} backend:'.format(backend.name))
+            measure('resolve ref', lambda _: backend.resolve_ref(bare_path, 'HEAD'), args.rounds)
+            measure('has object', lambda _: backend.has_object(bare_path, commit_id), args.rounds)
+            measure(
+                'list tree',
+                lambda i: parse_tree(backend.read_object(bare_path, '{}:cmp{}/src'.format(commit_id, i % 10)).data),
+                args.rounds)
+            measure(
+                'read blob', lambda i: backend.read_object(
+                    bare_path, '{}:cmp{}/src/file{}.c'.format(commit_id, i % 10, i % args.files)), args.rounds)
+            measure(
+                'checkout', lambda i: checkout(backend, bare_path, commit_id, temp_dir, i), max(args.rounds // 10, 1))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# SPDX-FileCopyrightText: 2023 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+"""
+Measure hashing of a generated component directory with different numbers of threads and hash algorithms:
+
+    python tests/benchmarks/hashing.py --files 2000 --size 64 --rounds 5
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from io import open
+
+from idf_component_tools.hash_tools import HASH_ALGORITHMS, file_digests, hash_dir
+
+try:
+    from typing import Any, Callable
+except ImportError:
+    pass
+
+
+def create_component(path, files, size):  # type: (str, int, int) -> str
+    component_path = os.path.join(path, 'cmp')
+    for i in range(files):
+        file_path = os.path.join(component_path, 'lib{}'.format(i % 10), 'src', 'file{}.c'.format(i))
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, 'wb') as f:
+            f.write(os.urandom(size * 1024))
+
+    return component_path
+
+
+def measure(name, func, rounds, size=0):  # type: (str, Callable[[int], Any], int, int) -> None
+    start = time.time()
+    for i in range(rounds):
+        func(i)
+    duration = time.time() - start
+    throughput = ', {:>8.1f} MB/s'.format(size * rounds / duration / 1024 / 1024) if size else ''
+    print(
+        '  {:<12} {:>9.2f} ms total, {:>8.3f} ms per call{}'.format(
+            name, duration * 1000, duration * 1000 / rounds, throughput))
+
+
+def hash_with_jobs(component_path, jobs):  # type: (str, int) -> str
+    os.environ['IDF_COMPONENT_HASH_JOBS'] = str(jobs)
+    return hash_dir(component_path)
+
+
+def main():  # type: () -> None
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=1000, help='Number of files in the generated component')
+    parser.add_argument('--size', type=int, default=32, help='Size of every file in KB')
+    parser.add_argument('--rounds', type=int, default=5, help='Number of calls of every operation')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        component_path = create_component(temp_dir, args.files, args.size)
+        print('hash_dir:')
+        size = args.files * args.size * 1024
+        for jobs in (1, 2, 4, 8):
+            measure('{} threads'.format(jobs), lambda _: hash_with_jobs(component_path, jobs), args.rounds, size)
+
+        print('file_digests, 1 thread:')
+        os.environ['IDF_COMPONENT_HASH_JOBS'] = '1'
+        for algorithm in sorted(HASH_ALGORITHMS):
+            measure(algorithm, lambda _: file_digests(component_path, algorithm=algorithm), args.rounds, size)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
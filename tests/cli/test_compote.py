@@ -140,6 +140,84 @@ def test_cache_size(monkeypatch, tmp_path, file_with_size):
     output = subprocess.check_output(['compote', 'cache', 'size', '--bytes'])
     assert '14' == output.decode('utf-8').strip()
 
+    # Entries changed bypassing the component manager are measured again on request
+    file_with_size(tmp_path / 'file1.txt', 20)
+    output = subprocess.check_output(['compote', 'cache', 'size', '--bytes'])
+    assert '14' == output.decode('utf-8').strip()
+
+    output = subprocess.check_output(['compote', 'cache', 'size', '--bytes', '--recompute'])
+    assert '20' == output.decode('utf-8').strip()
+
+
+def test_cache_maintain(monkeypatch, tmp_path):
+    monkeypatch.setenv('IDF_COMPONENT_CACHE_PATH', str(tmp_path))
+
+    output = subprocess.check_output(['compote', 'cache', 'maintain'])
+    assert 'No git repositories found in the cache' in output.decode('utf-8')
+
+    repo_path = tmp_path / 'repo'
+    subprocess.check_output(['git', 'init', str(repo_path)])
+    (repo_path / 'file.txt').write_text(u'content')
+    subprocess.check_output(['git', 'add', '*'], cwd=str(repo_path))
+    subprocess.check_output(
+        ['git', '-c', 'user.name=Test', '-c', 'user.email=test@test.com', 'commit', '-m', 'Init'], cwd=str(repo_path))
+    bare_path = tmp_path / 'b_git_12345678'
+    subprocess.check_output(['git', 'init', '--bare', str(bare_path)])
+    subprocess.check_output(['git', 'remote', 'add', 'origin', '--mirror=fetch', str(repo_path)], cwd=str(bare_path))
+    subprocess.check_output(['git', '-c', 'fetch.unpackLimit=1000', 'fetch', 'origin'], cwd=str(bare_path))
+
+    output = subprocess.check_output(['compote', 'cache', 'maintain']).decode('utf-8')
+    assert 'b_git_12345678:' in output
+    assert 'loose objects: 3 -> 0' in output
+    assert 'Maintained 1 git repositories' in output
+
+
+def test_cache_stats(monkeypatch, tmp_path):
+    monkeypatch.setenv('IDF_COMPONENT_CACHE_PATH', str(tmp_path))
+    FileCache(str(tmp_path)).record_stats(archive_hits=3, archive_misses=1, archive_bytes_served=2048)
+
+    output = subprocess.check_output(['compote', 'cache', 'stats']).decode('utf-8')
+    assert 'Component archives: 3 hits, 1 misses, hit rate 75.0%, 2.00 KB served from cache' in output
+
+    output = subprocess.check_output(['compote', 'cache', 'stats', '--json']).decode('utf-8')
+    stats = json.loads(output)
+    assert stats['archive_hits'] == 3
+    assert stats['api_hits'] == 0
+
+
+def test_cache_gc(monkeypatch, tmp_path, file_with_size):
+    monkeypatch.setenv('IDF_COMPONENT_CACHE_PATH', str(tmp_path))
+    entry_path = tmp_path / 'service_12345678' / 'cmp_1.0.0_abcdefgh'
+    entry_path.mkdir(parents=True)
+    file_with_size(entry_path / 'file.c', 1024)
+    os.utime(str(entry_path), (0, 0))
+
+    output = subprocess.check_output(['compote', 'cache', 'gc', '--dry-run']).decode('utf-8')
+    assert 'Would remove service_12345678/cmp_1.0.0_abcdefgh (1.00 KB)' in output
+    assert entry_path.is_dir()
+
+    output = subprocess.check_output(['compote', 'cache', 'gc']).decode('utf-8')
+    assert 'Removed 1 unreferenced cache entries, 1.00 KB reclaimed' in output
+    assert not entry_path.exists()
+
+
+def test_cache_prune(monkeypatch, tmp_path, file_with_size):
+    monkeypatch.setenv('IDF_COMPONENT_CACHE_PATH', str(tmp_path))
+    (tmp_path / 'service_12345678' / 'cmp_1.0.0_abcdefgh').mkdir(parents=True)
+    file_with_size(tmp_path / 'service_12345678' / 'cmp_1.0.0_abcdefgh' / 'file.c', 2 * 1024 * 1024)
+
+    output = subprocess.check_output(['compote', 'cache', 'prune'], stderr=subprocess.STDOUT).decode('utf-8')
+    assert 'Neither maximum size nor maximum age of the cache is set' in output
+
+    output = subprocess.check_output(['compote', 'cache', 'prune', '--max-size', '1', '--dry-run']).decode('utf-8')
+    assert 'Would remove service_12345678/cmp_1.0.0_abcdefgh (2.00 MB' in output
+    assert (tmp_path / 'service_12345678' / 'cmp_1.0.0_abcdefgh').is_dir()
+
+    monkeypatch.setenv('IDF_COMPONENT_CACHE_MAX_SIZE_MB', '1')
+    output = subprocess.check_output(['compote', 'cache', 'prune']).decode('utf-8')
+    assert 'Removed 1 cache entries, 2.00 MB freed' in output
+    assert not (tmp_path / 'service_12345678' / 'cmp_1.0.0_abcdefgh').exists()
+
 
 def test_version():
     output = subprocess.check_output(['compote', 'version'])
@@ -5,6 +5,7 @@ import json
 import os
 import re
 import warnings
+from io import open
 
 import jsonschema
 import pytest
@@ -13,7 +14,8 @@ import yaml
 from idf_component_manager.dependencies import detect_unused_components
 from idf_component_tools.errors import ManifestError, MetadataKeyWarning
 from idf_component_tools.manifest import (
-    JSON_SCHEMA, SLUG_REGEX, ComponentVersion, ManifestManager, ManifestValidator, SolvedComponent)
+    JSON_SCHEMA, SLUG_REGEX, ComponentRequirement, ComponentVersion, ManifestManager, ManifestValidator,
+    SolvedComponent)
 from idf_component_tools.manifest.constants import DEFAULT_KNOWN_TARGETS, known_targets
 from idf_component_tools.manifest.if_parser import parse_if_clause
 from idf_component_tools.sources import LocalSource
@@ -72,6 +74,17 @@ class TestManifestPipeline(object):
 
         assert len(parser.manifest_tree.keys()) == 7
 
+    def test_parse_string(self, fixtures_path):
+        with open(os.path.join(fixtures_path, 'idf_component.yml'), encoding='utf-8') as f:
+            parser = ManifestManager.from_string(f.read(), name='fixtures')
+
+        assert len(parser.manifest_tree.keys()) == 7
+        assert parser.load().targets == ManifestManager(
+            os.path.join(fixtures_path, 'idf_component.yml'), name='fixtures').load().targets
+
+        with pytest.raises(ManifestError, match='Cannot parse'):
+            ManifestManager.from_string('version: [', name='invalid')
+
     def test_prepare(self, fixtures_path):
         manifest_path = os.path.join(fixtures_path, 'idf_component.yml')
         parser = ManifestManager(manifest_path, name='fixtures')
@@ -493,3 +506,15 @@ def test_json_schema():
         validator = jsonschema.Draft4Validator  # python 3.4
 
     validator.check_schema(json.loads(schema_str))
+
+
+def test_requirement_version_spec_is_normalized_once(mocker):
+    source = LocalSource(source_details={'path': '.'})
+    normalize_spec = mocker.patch.object(LocalSource, 'normalize_spec', return_value='1.0.0')
+    requirement = ComponentRequirement('cmp', source, version_spec='1.0')
+
+    assert requirement.version_spec == '1.0.0'
+    assert requirement.version_spec == '1.0.0'
+    repr(requirement)
+
+    normalize_spec.assert_called_once_with('1.0')
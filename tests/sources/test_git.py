@@ -1,16 +1,42 @@
 # SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
 # SPDX-License-Identifier: Apache-2.0
 
+import os
+import subprocess
 import tempfile
 
 import pytest
 
-from idf_component_tools import sources
+from idf_component_tools import file_tools, hash_tools, sources
+from idf_component_tools.errors import FetchingError
+from idf_component_tools.file_cache import FileCache
+from idf_component_tools.git_backends import Pygit2GitBackend
 from idf_component_tools.git_client import GitClient
+from idf_component_tools.hash_tools import hash_dir
+from idf_component_tools.manifest import ComponentRequirement, SolvedComponent
+from idf_component_tools.sources.git import prefetch_git_repositories
 
 COMMIT_ID = '38041fa9e7f8a79b8ff8cd247c73cf92b7e3c23a'
 
 
+@pytest.fixture
+def git_repository_with_component(tmp_path):
+    repo_path = tmp_path / 'repo'
+    component_path = repo_path / 'cmp'
+    (component_path / 'include').mkdir(parents=True)
+    (component_path / 'include' / 'cmp.h').write_text(u'void cmp(void);')
+    (component_path / 'cmp.c').write_text(u'void cmp(void) {}')
+    (component_path / 'idf_component.yml').write_text(u'version: "1.0.0"\ntargets:\n  - esp32\n')
+
+    subprocess.check_output(['git', 'init', str(repo_path)])
+    subprocess.check_output(['git', 'config', 'user.email', 'test@test.com'], cwd=str(repo_path))
+    subprocess.check_output(['git', 'config', 'user.name', 'Test Test'], cwd=str(repo_path))
+    subprocess.check_output(['git', 'add', '*'], cwd=str(repo_path))
+    subprocess.check_output(['git', 'commit', '-m', '"Init commit"'], cwd=str(repo_path))
+
+    return str(repo_path)
+
+
 def test_validate_version_spec_git():
     source = sources.GitSource({'git': ''})
     assert source.validate_version_spec(None)
@@ -46,3 +72,277 @@ def test_checkout_git_source(monkeypatch):
 def test_git_source_component_path(path, component_path):
     source = sources.GitSource({'git': '', 'path': path})
     assert source.component_path == component_path
+
+
+def test_versions_from_object_database(git_repository_with_component, tmp_path, monkeypatch):
+    def prepare_ref(*args, **kwargs):
+        raise AssertionError('Checkout is not expected')
+
+    monkeypatch.setattr(GitClient, 'prepare_ref', prepare_ref)
+    source = sources.GitSource(
+        {
+            'git': git_repository_with_component,
+            'path': 'cmp'
+        }, system_cache_path=str(tmp_path / 'cache'))
+
+    version = source.versions('cmp').versions[0]
+
+    assert version.component_hash == hash_dir(os.path.join(git_repository_with_component, 'cmp'))
+    assert version.targets == ['esp32']
+
+
+def test_versions_read_blobs_without_mirror_updates(git_repository_with_component, tmp_path, mocker):
+    source = sources.GitSource(
+        {
+            'git': git_repository_with_component,
+            'path': 'cmp'
+        }, system_cache_path=str(tmp_path / 'cache'))
+    update = mocker.spy(GitClient, '_update_bare_repo')
+
+    version = source.versions('cmp').versions[0]
+
+    # Mirror is updated for the requested ref and the commit, not for every blob of the component
+    assert [call[0][3] for call in update.call_args_list] == [None, str(version)]
+
+
+def test_versions_with_symlink_use_checkout(git_repository_with_component, tmp_path):
+    os.symlink('cmp.c', os.path.join(git_repository_with_component, 'cmp', 'link.c'))
+    subprocess.check_output(['git', 'add', '*'], cwd=git_repository_with_component)
+    subprocess.check_output(['git', 'commit', '-m', '"Add symlink"'], cwd=git_repository_with_component)
+    source = sources.GitSource(
+        {
+            'git': git_repository_with_component,
+            'path': 'cmp'
+        }, system_cache_path=str(tmp_path / 'cache'))
+
+    version = source.versions('cmp').versions[0]
+
+    assert version.component_hash == hash_dir(os.path.join(git_repository_with_component, 'cmp'))
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason='symlinks are not supported')
+@pytest.mark.parametrize(
+    'backend', [
+        'cli',
+        pytest.param(
+            'pygit2', marks=pytest.mark.skipif(not Pygit2GitBackend.available(), reason='pygit2 is not installed'))
+    ])
+def test_versions_of_root_component_with_symlink(git_repository_with_component, tmp_path, monkeypatch, backend):
+    monkeypatch.setenv('IDF_COMPONENT_GIT_BACKEND', backend)
+    component_path = os.path.join(git_repository_with_component, 'cmp')
+    os.symlink('cmp.c', os.path.join(component_path, 'link.c'))
+    subprocess.check_output(['git', 'init', component_path])
+    subprocess.check_output(['git', 'config', 'user.email', 'test@test.com'], cwd=component_path)
+    subprocess.check_output(['git', 'config', 'user.name', 'Test Test'], cwd=component_path)
+    subprocess.check_output(['git', 'add', '.'], cwd=component_path)
+    subprocess.check_output(['git', 'commit', '-m', '"Init commit"'], cwd=component_path)
+    source = sources.GitSource({'git': component_path}, system_cache_path=str(tmp_path / 'cache'))
+
+    version = source.versions('cmp').versions[0]
+
+    assert version.component_hash == hash_dir(component_path)
+
+
+def test_versions_path_does_not_exist(git_repository_with_component, tmp_path):
+    source = sources.GitSource(
+        {
+            'git': git_repository_with_component,
+            'path': 'not_exists'
+        }, system_cache_path=str(tmp_path / 'cache'))
+
+    with pytest.raises(FetchingError, match='Directory not_exists wasn\'t found'):
+        source.versions('cmp')
+
+
+def test_versions_cached_by_commit(git_repository_with_component, tmp_path, monkeypatch):
+    source = sources.GitSource(
+        {
+            'git': git_repository_with_component,
+            'path': 'cmp'
+        }, system_cache_path=str(tmp_path / 'cache'))
+    version = source.versions('cmp', target='esp32').versions[0]
+
+    def list_tree(*args, **kwargs):
+        raise AssertionError('Reading of the object database is not expected')
+
+    monkeypatch.setattr(GitClient, 'list_tree', list_tree)
+    cached_version = source.versions('cmp', target='esp32').versions[0]
+
+    assert cached_version.component_hash == version.component_hash
+    assert cached_version.targets == ['esp32']
+    assert len(os.listdir(source.versions_cache_path())) == 1
+
+    # Only the first update of the repository fetches, the branch was checked recently for others
+    stats = FileCache(str(tmp_path / 'cache')).stats()
+    assert stats['git_fetches'] == 1
+    assert stats['git_fetches_skipped'] >= 1
+    assert stats['git_bytes_fetched'] > 0
+
+    with pytest.raises(FetchingError, match='does not support target "esp32s2"'):
+        source.versions('cmp', target='esp32s2')
+
+
+def test_download_from_archive(git_repository_with_component, tmp_path, monkeypatch):
+    cmp_path = os.path.join(git_repository_with_component, 'cmp')
+    with open(os.path.join(cmp_path, 'idf_component.yml'), 'a') as f:
+        f.write(u'files:\n  exclude:\n    - "*.c"\n')
+    os.makedirs(os.path.join(cmp_path, 'build'))
+    with open(os.path.join(cmp_path, 'build', 'output.bin'), 'w') as f:
+        f.write(u'binary')
+    subprocess.check_output(['git', 'add', '-f', '*'], cwd=git_repository_with_component)
+    subprocess.check_output(['git', 'commit', '-m', '"Add excluded files"'], cwd=git_repository_with_component)
+
+    def prepare_ref(*args, **kwargs):
+        raise AssertionError('Checkout is not expected')
+
+    monkeypatch.setattr(GitClient, 'prepare_ref', prepare_ref)
+    source = sources.GitSource(
+        {
+            'git': git_repository_with_component,
+            'path': 'cmp'
+        }, system_cache_path=str(tmp_path / 'cache'))
+    version = source.versions('cmp').versions[0]
+    component = SolvedComponent('cmp', version, source, component_hash=version.component_hash)
+    download_path = str(tmp_path / 'managed_components' / 'cmp')
+
+    source.download(component, download_path)
+
+    assert sorted(os.listdir(download_path)) == ['idf_component.yml', 'include']
+    assert os.path.isfile(os.path.join(download_path, 'include', 'cmp.h'))
+
+    # Files of another version are updated in place, unchanged files are kept
+    header_inode = os.stat(os.path.join(download_path, 'include', 'cmp.h')).st_ino
+    with open(os.path.join(download_path, 'idf_component.yml'), 'a') as f:
+        f.write(u'# previous version\n')
+    with open(os.path.join(download_path, 'removed.c'), 'w') as f:
+        f.write(u'')
+
+    source.download(component, download_path)
+
+    assert sorted(os.listdir(download_path)) == ['idf_component.yml', 'include']
+    assert os.stat(os.path.join(download_path, 'include', 'cmp.h')).st_ino == header_inode
+    with open(os.path.join(download_path, 'idf_component.yml')) as f:
+        assert 'previous version' not in f.read()
+
+
+def test_download_reuses_worktree(git_repository_with_component, tmp_path, mocker):
+    os.symlink('cmp.c', os.path.join(git_repository_with_component, 'cmp', 'link.c'))
+    subprocess.check_output(['git', 'add', '*'], cwd=git_repository_with_component)
+    subprocess.check_output(['git', 'commit', '-m', '"Add symlink"'], cwd=git_repository_with_component)
+    prepare_ref = mocker.spy(GitClient, 'prepare_ref')
+    source = sources.GitSource(
+        {
+            'git': git_repository_with_component,
+            'path': 'cmp'
+        }, system_cache_path=str(tmp_path / 'cache'))
+
+    version = source.versions('cmp').versions[0]
+    component = SolvedComponent('cmp', version, source, component_hash=version.component_hash)
+    download_path = str(tmp_path / 'managed_components' / 'cmp')
+    source.download(component, download_path)
+
+    assert prepare_ref.call_count == 1
+    assert os.path.isfile(os.path.join(download_path, 'link.c'))
+    assert hash_dir(download_path) == version.component_hash
+    assert sorted(os.listdir(
+        source.worktrees_path())) == [str(version), '{}.json'.format(version), '{}.lock'.format(version)]
+
+
+def test_worktree_is_locked_while_read(git_repository_with_component, tmp_path, mocker):
+    fcntl = pytest.importorskip('fcntl')
+    os.symlink('cmp.c', os.path.join(git_repository_with_component, 'cmp', 'link.c'))
+    subprocess.check_output(['git', 'add', '*'], cwd=git_repository_with_component)
+    subprocess.check_output(['git', 'commit', '-m', '"Add symlink"'], cwd=git_repository_with_component)
+    source = sources.GitSource(
+        {
+            'git': git_repository_with_component,
+            'path': 'cmp'
+        }, system_cache_path=str(tmp_path / 'cache'))
+
+    def is_locked(worktree_path):  # type: (str) -> bool
+        fd = os.open('{}.lock'.format(worktree_path), os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return False
+        except (IOError, OSError):
+            return True
+        finally:
+            os.close(fd)
+
+    # Other processes can't replace the worktree while files are read from it
+    locked_reads = []
+
+    def hash_dir(path, *args, **kwargs):
+        locked_reads.append(is_locked(os.path.dirname(path)))
+        return hash_tools.hash_dir(path, *args, **kwargs)
+
+    def sync_directory(source_directory, *args, **kwargs):
+        locked_reads.append(is_locked(os.path.dirname(source_directory)))
+        return file_tools.sync_directory(source_directory, *args, **kwargs)
+
+    mocker.patch('idf_component_tools.sources.git.hash_dir', side_effect=hash_dir)
+    mocker.patch('idf_component_tools.sources.git.sync_directory', side_effect=sync_directory)
+
+    version = source.versions('cmp').versions[0]
+    component = SolvedComponent('cmp', version, source, component_hash=version.component_hash)
+    source.download(component, str(tmp_path / 'managed_components' / 'cmp'))
+
+    assert locked_reads == [True, True]
+
+
+def test_prefetch_git_repositories(git_repository_with_component, tmp_path, mocker):
+    other_repository = str(tmp_path / 'other_repo')
+    subprocess.check_output(['git', 'clone', git_repository_with_component, other_repository])
+    update = mocker.spy(GitClient, '_update_bare_repo')
+    requirements = [
+        ComponentRequirement(
+            name, sources.GitSource({
+                'git': repo,
+                'path': 'cmp'
+            }, system_cache_path=str(tmp_path / 'cache')))
+        for name, repo in [('cmp', git_repository_with_component), ('other_cmp', other_repository)]
+    ]
+
+    prefetch_git_repositories(requirements)
+
+    assert sorted(call[0][2] for call in update.call_args_list) == sorted(
+        requirement.source.cache_path() for requirement in requirements)
+
+    # Repositories are not requested again
+    run = mocker.spy(GitClient, 'run')
+    for requirement in requirements:
+        assert requirement.source.versions(requirement.name).versions
+    assert not {'fetch', 'ls-remote'} & {call[0][1][0] for call in run.call_args_list}
+
+
+def test_components_from_one_repository_share_checkout(git_repository_with_component, tmp_path, mocker):
+    for name in ['cmp', 'cmp2']:
+        component_path = os.path.join(git_repository_with_component, name)
+        if not os.path.isdir(component_path):
+            os.makedirs(component_path)
+            with open(os.path.join(component_path, 'cmp2.c'), 'w') as f:
+                f.write(u'void cmp2(void) {}')
+        os.symlink('idf_component.yml' if name == 'cmp' else 'cmp2.c', os.path.join(component_path, 'link'))
+    subprocess.check_output(['git', 'add', '*'], cwd=git_repository_with_component)
+    subprocess.check_output(['git', 'commit', '-m', '"Add second component"'], cwd=git_repository_with_component)
+
+    prepare_ref = mocker.spy(GitClient, 'prepare_ref')
+    cache_path = str(tmp_path / 'cache')
+    component_sources = [
+        sources.GitSource({
+            'git': git_repository_with_component,
+            'path': name
+        }, system_cache_path=cache_path) for name in ['cmp', 'cmp2']
+    ]
+
+    for source in component_sources:
+        version = source.versions('cmp').versions[0]
+        assert version.component_hash == hash_dir(os.path.join(git_repository_with_component, source.component_path))
+
+    assert prepare_ref.call_count == 1
+    assert prepare_ref.call_args[1]['selected_paths'] == ['cmp', 'cmp2']
+
+    bare_path = component_sources[0].cache_path()
+    assert component_sources[0]._client._cli_backend.object_reader(bare_path) is \
+        component_sources[1]._client._cli_backend.object_reader(bare_path)
@@ -4,14 +4,18 @@
 import filecmp
 import os
 import shutil
+from io import open
 
 import pytest
 import vcr
 
+from idf_component_tools.api_client import ComponentDetails
+from idf_component_tools.archive_tools import unpack_archive
 from idf_component_tools.errors import FetchingError, UserHint
+from idf_component_tools.file_cache import FileCache
 from idf_component_tools.hash_tools import hash_dir
 from idf_component_tools.manifest import ComponentVersion, SolvedComponent
-from idf_component_tools.sources import WebServiceSource
+from idf_component_tools.sources import WebServiceSource, web_service
 from idf_component_tools.sources.web_service import download_archive
 
 
@@ -70,6 +74,66 @@ class TestComponentWebServiceSource(object):
 
         assert os.path.isfile(os.path.join(local_path, 'idf_component.yml'))
 
+    def test_download_publishes_complete_entries(self, monkeypatch, fixtures_path, tmp_path):
+        cache_dir = tmp_path / 'cache'
+        archive_path = os.path.join(fixtures_path, 'archives', 'cmp_1.0.0.tar.gz')
+
+        class ApiClient(object):
+            def component(self, component_name, version):
+                return ComponentDetails(name=component_name, version=version, download_url='file://' + archive_path)
+
+        source = WebServiceSource(
+            source_details={'service_url': 'https://example.com/api'}, system_cache_path=str(cache_dir))
+        source.api_client = ApiClient()
+        unpack_archive(archive_path, str(tmp_path / 'unpacked'))
+        cmp = SolvedComponent('test/cmp', '1.0.0', source, component_hash=hash_dir(str(tmp_path / 'unpacked')))
+        cache_path = source.component_cache_path(cmp)
+        os.makedirs(cache_path)
+        with open(os.path.join(cache_path, 'partial.c'), 'w') as f:
+            f.write(u'')
+
+        def failed_download(url, download_dir):
+            raise FetchingError('Connection reset')
+
+        monkeypatch.setattr(web_service, 'download_archive', failed_download)
+        with pytest.raises(FetchingError, match='Connection reset'):
+            source.download(cmp, str(tmp_path / 'failed'))
+
+        # Failed download leaves the entry untouched, and no temporary directories
+        assert os.listdir(cache_path) == ['partial.c']
+        assert sorted(os.listdir(source.cache_path())) == sorted(
+            [os.path.basename(cache_path)] + ['{}.lock'.format(os.path.basename(cache_path))])
+
+        monkeypatch.undo()
+        download_path = str(tmp_path / 'downloaded')
+        source.download(cmp, download_path)
+
+        assert os.path.isfile(os.path.join(cache_path, 'idf_component.yml'))
+        assert not os.path.exists(os.path.join(cache_path, 'partial.c'))
+        assert FileCache(str(cache_dir)).stats()['archive_misses'] == 1
+
+        source.download(cmp, str(tmp_path / 'downloaded_again'))
+        stats = FileCache(str(cache_dir)).stats()
+        assert (stats['archive_hits'], stats['archive_misses']) == (1, 1)
+        assert stats['archive_bytes_served'] > 0
+        assert stats['archive_bytes_downloaded'] > 0
+        assert filecmp.cmp(
+            os.path.join(cache_path, 'idf_component.yml'), os.path.join(download_path, 'idf_component.yml'))
+
+        # Managed directory of another version is updated in place, unchanged files are kept
+        unchanged_inode = os.stat(os.path.join(download_path, 'cmp.c')).st_ino
+        with open(os.path.join(download_path, 'CMakeLists.txt'), 'w') as f:
+            f.write(u'# previous version')
+        with open(os.path.join(download_path, 'removed.c'), 'w') as f:
+            f.write(u'')
+
+        source.download(cmp, download_path)
+
+        assert os.stat(os.path.join(download_path, 'cmp.c')).st_ino == unchanged_inode
+        assert filecmp.cmp(
+            os.path.join(cache_path, 'CMakeLists.txt'), os.path.join(download_path, 'CMakeLists.txt'), shallow=False)
+        assert not os.path.exists(os.path.join(download_path, 'removed.c'))
+
     def test_download_local_file(self, fixtures_path, tmp_path):
         source_file = os.path.join(fixtures_path, 'archives', 'cmp_1.0.0.tar.gz')
 
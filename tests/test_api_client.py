@@ -2,15 +2,17 @@
 # SPDX-License-Identifier: Apache-2.0
 import os
 import sys
+import time
 
 import pytest
 import vcr
 
 from idf_component_manager import version
-from idf_component_tools.api_client import APIClient, env_cache_time, join_url, user_agent
+from idf_component_tools.api_client import APIClient, LedgerFileCache, env_cache_time, join_url, user_agent
 from idf_component_tools.api_client_errors import NoRegistrySet
 from idf_component_tools.config import component_registry_url
 from idf_component_tools.constants import IDF_COMPONENT_REGISTRY_URL, IDF_COMPONENT_STORAGE_URL
+from idf_component_tools.file_cache import FileCache
 
 
 @pytest.fixture
@@ -167,3 +169,31 @@ class TestAPIClient(object):
         result = client.component(component_name='example/cmp_yanked', version=version)
 
         assert result.version == '1.0.1'
+
+
+def test_api_cache_size_is_recorded(tmp_path):
+    file_cache = FileCache(str(tmp_path))
+    api_cache_path = tmp_path / '.api_client'
+    api_cache_path.mkdir()
+    (api_cache_path / 'response').write_bytes(b'0' * 10)
+    assert file_cache.size() == 10
+
+    api_cache = LedgerFileCache(str(api_cache_path), file_cache)
+    api_cache.set('key', b'1' * 100)
+    assert file_cache.size() == 10 + os.path.getsize(api_cache._fn('key'))
+
+    api_cache.delete('key')
+    assert file_cache.size() == 10
+
+
+def test_api_cache_hits_are_recorded(tmp_path, monkeypatch):
+    file_cache = FileCache(str(tmp_path))
+    api_cache = LedgerFileCache(str(tmp_path / '.api_client'), file_cache)
+    api_cache.set('key', b'response')
+    monkeypatch.setattr(time, 'time', lambda: 2000000000.0)
+
+    assert api_cache.get('missing') is None
+    assert [entry.accessed for entry in file_cache.entries()] != [2000000000.0]
+
+    assert api_cache.get('key') == b'response'
+    assert [entry.accessed for entry in file_cache.entries()] == [2000000000.0]
@@ -0,0 +1,117 @@
+# SPDX-FileCopyrightText: 2023 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+import errno
+import os
+import stat
+
+import pytest
+
+from idf_component_tools import copy_tools
+from idf_component_tools.copy_tools import COPY_FILE_RANGE, PARALLEL_COPY_MIN_FILES, REFLINK, copy_file, copy_files
+
+
+@pytest.fixture(autouse=True)
+def reset_copy_methods(monkeypatch):
+    monkeypatch.setattr(copy_tools, '_unsupported', set())
+
+
+@pytest.fixture
+def source_file(tmp_path):
+    path = tmp_path / 'source.bin'
+    path.write_bytes(os.urandom(300000))
+    os.chmod(str(path), 0o750)
+    os.utime(str(path), (1000000000, 1000000000))
+    return path
+
+
+def assert_copied(source, destination):
+    assert destination.read_bytes() == source.read_bytes()
+    assert stat.S_IMODE(os.stat(str(destination)).st_mode) == stat.S_IMODE(os.stat(str(source)).st_mode)
+    assert os.path.getmtime(str(destination)) == os.path.getmtime(str(source))
+
+
+def test_copy_file(source_file, tmp_path, mocker):
+    destination = tmp_path / 'destination.bin'
+    methods = [name for name, _ in copy_tools._methods()]
+    spies = {REFLINK: mocker.spy(copy_tools, '_reflink'), COPY_FILE_RANGE: mocker.spy(copy_tools, '_copy_file_range')}
+
+    copy_file(str(source_file), str(destination))
+
+    assert_copied(source_file, destination)
+    # The fastest method available on the platform is tried first
+    if methods:
+        assert spies[methods[0]].call_count == 1
+
+
+def test_copy_file_overwrites_destination(source_file, tmp_path):
+    destination = tmp_path / 'destination.bin'
+    destination.write_bytes(os.urandom(500000))
+
+    copy_file(str(source_file), str(destination))
+
+    assert_copied(source_file, destination)
+
+
+def test_copy_file_fallback(source_file, tmp_path, mocker):
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, 'Cross-device link')
+
+    copyfileobj = mocker.spy(copy_tools.shutil, 'copyfileobj')
+    reflink = mocker.patch.object(copy_tools, '_reflink', side_effect=unsupported)
+    copy_file_range = mocker.patch.object(copy_tools, '_copy_file_range', side_effect=unsupported)
+    mocker.patch.object(
+        copy_tools,
+        '_methods',
+        return_value=[(REFLINK, copy_tools._reflink), (COPY_FILE_RANGE, copy_tools._copy_file_range)])
+
+    copy_file(str(source_file), str(tmp_path / 'first.bin'))
+    copy_file(str(source_file), str(tmp_path / 'second.bin'))
+
+    assert_copied(source_file, tmp_path / 'first.bin')
+    assert_copied(source_file, tmp_path / 'second.bin')
+    # Unsupported methods are not tried again for the same file systems
+    assert reflink.call_count == 1
+    assert copy_file_range.call_count == 1
+    assert copyfileobj.call_count == 2
+
+
+def test_copy_file_partial_copy_is_restarted(source_file, tmp_path, mocker):
+    def short_copy(source_fd, destination_fd, size):
+        os.write(destination_fd, b'partial')
+        return False
+
+    copyfileobj = mocker.spy(copy_tools.shutil, 'copyfileobj')
+    mocker.patch.object(copy_tools, '_methods', return_value=[(COPY_FILE_RANGE, short_copy)])
+
+    copy_file(str(source_file), str(tmp_path / 'destination.bin'))
+
+    assert_copied(source_file, tmp_path / 'destination.bin')
+    assert copyfileobj.call_count == 1
+
+
+def test_copy_file_errors_are_raised(source_file, tmp_path, mocker):
+    def no_space(*args):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    mocker.patch.object(copy_tools, '_methods', return_value=[(COPY_FILE_RANGE, no_space)])
+
+    with pytest.raises(OSError):
+        copy_file(str(source_file), str(tmp_path / 'destination.bin'))
+
+
+@pytest.mark.parametrize('jobs', ['1', '4'])
+def test_copy_files(tmp_path, monkeypatch, jobs):
+    monkeypatch.setenv('IDF_COMPONENT_COPY_JOBS', jobs)
+    (tmp_path / 'source').mkdir()
+    (tmp_path / 'destination').mkdir()
+    pairs = []
+    for index in range(PARALLEL_COPY_MIN_FILES * 2):
+        source = tmp_path / 'source' / 'file_{}.c'.format(index)
+        source.write_bytes(os.urandom(index * 100))
+        pairs.append((str(source), str(tmp_path / 'destination' / source.name)))
+
+    copy_files(pairs)
+
+    for source, destination in pairs:
+        with open(source, 'rb') as s, open(destination, 'rb') as d:
+            assert s.read() == d.read()
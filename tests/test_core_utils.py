@@ -3,8 +3,8 @@
 import pytest
 from pytest import raises
 
-from idf_component_manager.core_utils import parse_example
-from idf_component_tools.errors import FatalError
+from idf_component_manager.core_utils import parse_example, raise_component_modified_error
+from idf_component_tools.errors import ComponentModifiedError, FatalError
 
 
 @pytest.mark.parametrize(
@@ -42,3 +42,15 @@ def test_create_example_name_error(example):
     with raises(FatalError,
                 match='Cannot parse EXAMPLE argument. Please use format like: namespace/component=1.0.0:example_name'):
         parse_example(example, 'test')
+
+
+def test_component_modified_error_lists_changes(tmp_path):
+    changes = {'cmp': [('file{}.c'.format(i), 'modified') for i in range(12)]}
+
+    with raises(ComponentModifiedError) as e:
+        raise_component_modified_error(str(tmp_path / 'managed_components'), ['cmp', 'other'], changes)
+
+    message = str(e.value)
+    assert 'Changes in "cmp":\n  modified: file0.c\n' in message
+    assert '  modified: file9.c\n  and 2 more' in message
+    assert 'Changes in "other"' not in message
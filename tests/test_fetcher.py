@@ -2,12 +2,16 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import os.path
+import shutil
+import time
 from io import open
 
 import pytest
 
+from idf_component_tools import hash_tools
 from idf_component_tools.errors import ComponentModifiedError, InvalidComponentHashError
-from idf_component_tools.hash_tools import HASH_FILENAME
+from idf_component_tools.hash_tools import (
+    DIGEST_CACHE_FILENAME, HASH_FILENAME, HASH_TREE_FILENAME, STAT_SNAPSHOT_FILENAME, hash_dir)
 from idf_component_tools.manifest import ComponentVersion, SolvedComponent
 from idf_component_tools.sources import WebServiceSource
 from idf_component_tools.sources.fetcher import ComponentFetcher
@@ -40,3 +44,82 @@ def test_fetcher_download_and_create_hash(fixtures_path):
 
     finally:
         os.remove(os.path.join(component_path, HASH_FILENAME))
+        digest_cache = os.path.join(component_path, DIGEST_CACHE_FILENAME)
+        if os.path.exists(digest_cache):
+            os.remove(digest_cache)
+
+
+def test_fetcher_reports_modified_files(fixtures_path, tmp_path, monkeypatch):
+    monkeypatch.setenv('IDF_COMPONENT_HASH_FORMAT', '2')
+    component_path = tmp_path / 'cmp'
+    shutil.copytree(os.path.join(fixtures_path, 'components', 'cmp'), str(component_path))
+    source = WebServiceSource({'service_url': 'https://repo.example.com'})
+    component = SolvedComponent('cmp', ComponentVersion('1.0.0'), source, component_hash=hash_dir(str(component_path)))
+    fetcher = ComponentFetcher(component, str(tmp_path))
+
+    fetcher.create_hash(str(component_path), component.component_hash)
+    assert (component_path / HASH_TREE_FILENAME).is_file()
+
+    with open(str(component_path / 'cmp.c'), mode='a', encoding='utf-8') as f:
+        f.write(u'// changed')
+
+    with pytest.raises(ComponentModifiedError) as e:
+        fetcher.download()
+
+    assert e.value.changes == [('cmp.c', 'modified')]
+
+
+def test_fetcher_records_stat_snapshot(fixtures_path, tmp_path, monkeypatch):
+    monkeypatch.setenv('IDF_COMPONENT_INTEGRITY', 'stat')
+    component_path = tmp_path / 'cmp'
+    shutil.copytree(os.path.join(fixtures_path, 'components', 'cmp'), str(component_path))
+    source = WebServiceSource({'service_url': 'https://repo.example.com'})
+    component = SolvedComponent('cmp', ComponentVersion('1.0.0'), source, component_hash=hash_dir(str(component_path)))
+    fetcher = ComponentFetcher(component, str(tmp_path))
+
+    fetcher.create_hash(str(component_path), component.component_hash)
+
+    assert (component_path / STAT_SNAPSHOT_FILENAME).is_file()
+    assert fetcher.download() == str(component_path)
+
+
+def test_fetcher_download_with_stat_integrity_does_not_hash_files(fixtures_path, tmp_path, monkeypatch, mocker):
+    monkeypatch.setenv('IDF_COMPONENT_INTEGRITY', 'stat')
+    component_path = tmp_path / 'cmp'
+    shutil.copytree(os.path.join(fixtures_path, 'components', 'cmp'), str(component_path))
+    old = time.time() - 60
+    for root, _, names in os.walk(str(component_path)):
+        for name in names:
+            os.utime(os.path.join(root, name), (old, old))
+    source = WebServiceSource({'service_url': 'https://repo.example.com'})
+    component = SolvedComponent('cmp', ComponentVersion('1.0.0'), source, component_hash=hash_dir(str(component_path)))
+    fetcher = ComponentFetcher(component, str(tmp_path))
+    fetcher.create_hash(str(component_path), component.component_hash)
+
+    hash_file_spy = mocker.spy(hash_tools, 'hash_file')
+    assert fetcher.download() == str(component_path)
+    assert fetcher.download() == str(component_path)
+
+    # Both the fetcher and the source trust the stat snapshot
+    assert hash_file_spy.call_count == 0
+
+
+def test_fetcher_repeat_download_hashes_files_once(fixtures_path, tmp_path, mocker):
+    component_path = tmp_path / 'cmp'
+    shutil.copytree(os.path.join(fixtures_path, 'components', 'cmp'), str(component_path))
+    old = time.time() - 60
+    files = [os.path.join(root, name) for root, _, names in os.walk(str(component_path)) for name in names]
+    for path in files:
+        os.utime(path, (old, old))
+    source = WebServiceSource({'service_url': 'https://repo.example.com'})
+    component = SolvedComponent('cmp', ComponentVersion('1.0.0'), source, component_hash=hash_dir(str(component_path)))
+    fetcher = ComponentFetcher(component, str(tmp_path))
+    fetcher.create_hash(str(component_path), component.component_hash)
+
+    hash_file_spy = mocker.spy(hash_tools, 'hash_file')
+    assert fetcher.download() == str(component_path)
+    # Files are validated by the fetcher, the source reuses digests of the check
+    assert hash_file_spy.call_count == len(files)
+
+    assert fetcher.download() == str(component_path)
+    assert hash_file_spy.call_count == len(files)
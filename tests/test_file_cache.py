@@ -0,0 +1,212 @@
+# SPDX-FileCopyrightText: 2023 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+import os
+import time
+
+from idf_component_manager.dependencies import register_project_in_cache
+from idf_component_tools.file_cache import FileCache
+from idf_component_tools.manifest import SolvedComponent, SolvedManifest
+from idf_component_tools.sources import IDFSource, WebServiceSource
+
+
+def _create_entries(cache_path, file_with_size):
+    for path, size in [
+        ('service_12345678/cmp_1.0.0_abcdefgh/file.c', 100),
+        ('service_12345678/cmp_2.0.0_abcdefgh/file.c', 200),
+        ('b_git_12345678/objects/pack.pack', 300),
+        ('w_git_12345678/0123456789/file.c', 400),
+    ]:
+        file_path = cache_path / path
+        if not file_path.parent.is_dir():
+            file_path.parent.mkdir(parents=True)
+        file_with_size(file_path, size)
+    file_with_size(cache_path / 'w_git_12345678' / '0123456789.json', 10)
+
+
+def test_cache_entries(tmp_path, file_with_size):
+    _create_entries(tmp_path, file_with_size)
+    file_cache = FileCache(str(tmp_path))
+    file_cache.record_access(str(tmp_path / 'service_12345678' / 'cmp_1.0.0_abcdefgh'))
+
+    entries = {entry.key: entry for entry in file_cache.entries()}
+
+    assert sorted(entries) == [
+        'b_git_12345678', 'service_12345678/cmp_1.0.0_abcdefgh', 'service_12345678/cmp_2.0.0_abcdefgh',
+        'w_git_12345678/0123456789'
+    ]
+    assert entries['service_12345678/cmp_2.0.0_abcdefgh'].size == 200
+    assert entries['service_12345678/cmp_1.0.0_abcdefgh'].accessed >= \
+        entries['service_12345678/cmp_2.0.0_abcdefgh'].accessed
+
+
+def test_prune_least_recently_used(tmp_path, file_with_size):
+    _create_entries(tmp_path, file_with_size)
+    file_cache = FileCache(str(tmp_path))
+    now = time.time()
+    for index, key in enumerate(['w_git_12345678/0123456789', 'service_12345678/cmp_1.0.0_abcdefgh', 'b_git_12345678',
+                                 'service_12345678/cmp_2.0.0_abcdefgh']):
+        path = str(tmp_path / key)
+        os.utime(path, (now - 100 + index, now - 100 + index))
+
+    # Recently used entry is kept
+    file_cache.record_access(str(tmp_path / 'w_git_12345678' / '0123456789' / 'file.c'))
+
+    removed = file_cache.prune(max_size=700, dry_run=True)
+    assert [entry.key for entry in removed] == ['service_12345678/cmp_1.0.0_abcdefgh', 'b_git_12345678']
+    assert (tmp_path / 'b_git_12345678').is_dir()
+
+    removed = file_cache.prune(max_size=700)
+    assert [entry.key for entry in removed] == ['service_12345678/cmp_1.0.0_abcdefgh', 'b_git_12345678']
+    assert not (tmp_path / 'b_git_12345678').exists()
+    assert not (tmp_path / 'service_12345678' / 'cmp_1.0.0_abcdefgh').exists()
+    assert sum(entry.size for entry in file_cache.entries()) == 600
+
+    removed = file_cache.prune(max_age=50)
+    assert [entry.key for entry in removed] == ['service_12345678/cmp_2.0.0_abcdefgh']
+
+    removed = file_cache.prune(max_size=100)
+    assert [entry.key for entry in removed] == ['w_git_12345678/0123456789']
+    # Metadata of the worktree is removed with it
+    assert not (tmp_path / 'w_git_12345678' / '0123456789.json').exists()
+    assert file_cache.entries() == []
+
+
+def test_cache_size_ledger(tmp_path, file_with_size):
+    _create_entries(tmp_path, file_with_size)
+    file_cache = FileCache(str(tmp_path))
+    assert file_cache.size() == 1000
+
+    # Known sizes are taken from the ledger without scanning entries
+    file_with_size(tmp_path / 'b_git_12345678' / 'objects' / 'pack.idx', 50)
+    assert file_cache.size() == 1000
+
+    file_cache.record_growth(str(tmp_path / 'b_git_12345678' / 'objects' / 'pack.idx'), 50)
+    assert file_cache.size() == 1050
+
+    file_with_size(tmp_path / 'service_12345678' / 'cmp_1.0.0_abcdefgh' / 'file.h', 25)
+    file_cache.record_update(str(tmp_path / 'service_12345678' / 'cmp_1.0.0_abcdefgh'))
+    assert file_cache.size() == 1075
+
+    file_with_size(tmp_path / 'w_git_12345678' / '0123456789' / 'file.c', 100)
+    assert file_cache.size() == 1075
+    assert sum(entry.size for entry in file_cache.entries(recompute=True)) == 775
+    assert file_cache.size() == 775
+
+
+def test_cache_stats(tmp_path, file_with_size):
+    _create_entries(tmp_path, file_with_size)
+    file_cache = FileCache(str(tmp_path))
+    assert file_cache.stats()['archive_hits'] == 0
+
+    file_cache.record_stats(archive_hits=1, archive_bytes_served=100)
+    file_cache.record_stats(archive_hits=1, archive_misses=1)
+    stats = file_cache.stats()
+    assert (stats['archive_hits'], stats['archive_misses'], stats['archive_bytes_served']) == (2, 1, 100)
+
+    # Statistics are not an entry of the cache
+    assert file_cache.size() == 1000
+
+    file_with_size(tmp_path / 'b_git_12345678' / 'objects' / 'pack.idx', 50)
+    assert file_cache.record_update(str(tmp_path / 'b_git_12345678')) == 50
+
+
+def test_register_project(tmp_path):
+    source = WebServiceSource(
+        source_details={'service_url': 'https://example.com/api'}, system_cache_path=str(tmp_path / 'cache'))
+    solution = SolvedManifest(
+        [
+            SolvedComponent('idf', '5.1.0', IDFSource({})),
+            SolvedComponent('test/cmp', '1.0.0', source, component_hash='a' * 64),
+        ],
+        manifest_hash='0' * 64)
+    lock_path = str(tmp_path / 'dependencies.lock')
+
+    register_project_in_cache(lock_path, solution)
+
+    projects = FileCache(str(tmp_path / 'cache')).projects()
+    assert list(projects) == [lock_path]
+    component = projects[lock_path]['components']['test/cmp']
+    assert component['component_hash'] == 'a' * 64
+    assert component['entries'] == [
+        FileCache(str(tmp_path / 'cache')).entry_key(source.component_cache_path(solution.dependencies[1]))
+    ]
+
+
+def test_gc_unreferenced_entries(tmp_path, file_with_size):
+    _create_entries(tmp_path, file_with_size)
+    file_cache = FileCache(str(tmp_path))
+    old = time.time() - 2 * 60 * 60
+    for key in ['service_12345678/cmp_1.0.0_abcdefgh', 'service_12345678/cmp_2.0.0_abcdefgh']:
+        os.utime(str(tmp_path / key), (old, old))
+
+    lock_path = tmp_path / 'project' / 'dependencies.lock'
+    lock_path.parent.mkdir()
+    lock_path.write_text(u'')
+    file_cache.register_project(
+        str(lock_path),
+        {
+            'cmp': {
+                'version': '2.0.0',
+                'entries': [str(tmp_path / 'service_12345678' / 'cmp_2.0.0_abcdefgh')]
+            },
+        },
+    )
+    removed_lock_path = str(tmp_path / 'removed' / 'dependencies.lock')
+    file_cache.register_project(removed_lock_path, {})
+
+    result = file_cache.gc(dry_run=True)
+    assert [entry.key for entry in result.entries] == ['service_12345678/cmp_1.0.0_abcdefgh']
+    assert result.projects == [removed_lock_path]
+    assert (tmp_path / 'service_12345678' / 'cmp_1.0.0_abcdefgh').is_dir()
+    assert removed_lock_path in file_cache.projects()
+
+    # Recently used worktree is kept, git mirrors are not collected
+    result = file_cache.gc()
+    assert [entry.key for entry in result.entries] == ['service_12345678/cmp_1.0.0_abcdefgh']
+    assert not (tmp_path / 'service_12345678' / 'cmp_1.0.0_abcdefgh').exists()
+    assert list(file_cache.projects()) == [str(lock_path)]
+
+    # Entries of the project are released when its lock file is removed
+    lock_path.unlink()
+    result = file_cache.gc()
+    assert [entry.key for entry in result.entries] == ['service_12345678/cmp_2.0.0_abcdefgh']
+    assert file_cache.projects() == {}
+
+
+def _write_files(path, files):
+    for name, content in files.items():
+        file_path = path / name
+        if not file_path.parent.is_dir():
+            file_path.parent.mkdir(parents=True)
+        file_path.write_bytes(content)
+
+
+def test_deduplicate_entries(tmp_path, monkeypatch):
+    file_cache = FileCache(str(tmp_path))
+    first = tmp_path / 'service_12345678' / 'cmp_1.0.0_abcdefgh'
+    second = tmp_path / 'service_12345678' / 'cmp_1.0.1_abcdefgh'
+    _write_files(first, {'src/cmp.c': b'0' * 100, 'run.sh': b'#!/bin/sh'})
+    _write_files(second, {'src/cmp.c': b'0' * 100, 'run.sh': b'#!/bin/sh', 'new.c': b'1' * 10})
+    os.chmod(str(second / 'run.sh'), 0o755)
+
+    assert file_cache.deduplicate(str(first)) == 0
+    assert file_cache.deduplicate(str(second)) == 100
+
+    assert os.path.samefile(str(first / 'src' / 'cmp.c'), str(second / 'src' / 'cmp.c'))
+    # Files with different permissions are not shared
+    assert not os.path.samefile(str(first / 'run.sh'), str(second / 'run.sh'))
+    assert os.stat(str(second / 'run.sh')).st_mode & 0o111
+    assert (second / 'src' / 'cmp.c').read_bytes() == b'0' * 100
+    # The blob store is not an entry of the cache
+    assert file_cache.size() == 109 + 119
+
+    # Blobs of removed entries are removed by the garbage collection
+    os.utime(str(second), (0, 0))
+    result = file_cache.gc()
+    assert [entry.key for entry in result.entries] == ['service_12345678/cmp_1.0.1_abcdefgh']
+    assert result.blobs_size == len(b'#!/bin/sh') + 10
+    assert (first / 'src' / 'cmp.c').read_bytes() == b'0' * 100
+
+    monkeypatch.setenv('IDF_COMPONENT_CACHE_DEDUP', '0')
+    _write_files(second, {'src/cmp.c': b'0' * 100})
+    assert file_cache.deduplicate(str(second)) == 0
@@ -0,0 +1,46 @@
+# SPDX-FileCopyrightText: 2023 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+import subprocess
+import sys
+import threading
+import time
+
+from idf_component_tools.file_lock import FileLock
+
+
+def test_file_lock_is_exclusive_for_threads(tmp_path):
+    lock_path = str(tmp_path / 'dir' / 'file.lock')
+    events = []
+
+    def hold_lock():
+        with FileLock(lock_path):
+            events.append('second')
+
+    with FileLock(lock_path):
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        time.sleep(0.2)
+        events.append('first')
+
+    thread.join()
+    assert events == ['first', 'second']
+
+
+def test_file_lock_is_exclusive_for_processes(tmp_path):
+    lock_path = str(tmp_path / 'file.lock')
+    script = (
+        'import sys, time\n'
+        'from idf_component_tools.file_lock import FileLock\n'
+        'with FileLock(sys.argv[1]):\n'
+        '    print("locked")\n'
+        '    sys.stdout.flush()\n'
+        '    time.sleep(0.5)\n')
+
+    process = subprocess.Popen([sys.executable, '-c', script, lock_path], stdout=subprocess.PIPE)
+    try:
+        assert process.stdout.readline().strip() == b'locked'
+        started = time.time()
+        with FileLock(lock_path):
+            assert time.time() - started > 0.2
+    finally:
+        process.wait()
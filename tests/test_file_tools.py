@@ -3,12 +3,14 @@
 
 import os
 import shutil
+import stat
 from pathlib import Path
 
 import pytest
 
 from idf_component_tools.file_tools import (
-    check_unexpected_component_files, copy_filtered_directory, directory_size, filtered_paths, human_readable_size)
+    DEFAULT_EXCLUDE, PathFilter, check_unexpected_component_files, copy_directory, copy_filtered_directory,
+    directory_size, filtered_paths, human_readable_size, replace_directory, sync_directory)
 
 
 @pytest.fixture
@@ -20,6 +22,60 @@ def assets_path(tmp_path, fixtures_path):
     return subdir.as_posix()
 
 
+@pytest.fixture
+def component_tree(tmp_path):
+    root = tmp_path / 'cmp'
+    for name in [
+            'CMakeLists.txt',
+            'idf_component.yml',
+            '.gitlab-ci.yml',
+            'src/cmp.c',
+            'src/.hidden.c',
+            'src/sub/deep/cmp_deep.c',
+            'include/cmp.h',
+            '.git/config',
+            '.git/objects/ab/cdef',
+            'build/config/sdkconfig.h',
+            'managed_components/dep/dep.c',
+            'docs/build/index.html',
+            'docs/readme.txt',
+            'test/__pycache__/test.cpython-311.pyc',
+            'dist/cmp.tgz',
+            '.component_hash',
+    ]:
+        path = root / name
+        if not path.parent.is_dir():
+            path.parent.mkdir(parents=True)
+        path.write_text(u'{}'.format(name))
+
+    (root / 'empty' / 'nested').mkdir(parents=True)
+    if hasattr(os, 'symlink'):
+        os.symlink(str(root / 'src'), str(root / 'linked_src'))
+        os.symlink(str(root / 'src' / 'cmp.c'), str(root / 'linked.c'))
+
+    return str(root)
+
+
+def glob_filtered_paths(path, include=None, exclude=None, exclude_default=True):
+    """Reference implementation of `filtered_paths` based on `Path.glob`"""
+    base_path = Path(path)
+    paths = set(base_path.glob('**/*'))
+
+    if exclude_default:
+        for pattern in DEFAULT_EXCLUDE:
+            paths -= set(base_path.glob(pattern))
+            if pattern.endswith('/**/*'):
+                paths -= set(base_path.glob(pattern[:pattern.rindex('/**/*')]))
+
+    for pattern in exclude or []:
+        paths -= set(base_path.glob(pattern))
+
+    for pattern in include or []:
+        paths |= set(base_path.glob(pattern))
+
+    return paths
+
+
 def test_filtered_path_default(assets_path):
     assert filtered_paths(assets_path) == set(
         [
@@ -74,6 +130,74 @@ def test_filtered_path_exclude_empty_dir(assets_path):
         ])
 
 
+@pytest.mark.parametrize(
+    'include, exclude, exclude_default', [
+        (None, None, True),
+        (None, None, False),
+        (None, ['**/file.txt'], True),
+        (None, ['ignore.dir'], True),
+        (None, ['ignore.dir/**/*'], True),
+        (['.gitlab-ci.yml'], ['**/*'], True),
+        (['**/*.txt'], ['**/*'], True),
+    ])
+def test_path_filter_matches_filtered_paths(assets_path, include, exclude, exclude_default):
+    path_filter = PathFilter(include=include, exclude=exclude, exclude_default=exclude_default)
+    expected = filtered_paths(assets_path, include=include, exclude=exclude, exclude_default=exclude_default)
+
+    matched = set()
+    for root, dirs, files in os.walk(assets_path):
+        for name in dirs + files:
+            path = Path(root, name)
+            if path_filter.match(path.relative_to(assets_path).as_posix(), is_dir=path.is_dir()):
+                matched.add(path)
+
+    assert matched == expected
+
+
+@pytest.mark.parametrize(
+    'include, exclude, exclude_default', [
+        (None, None, True),
+        (None, None, False),
+        (None, ['**/*.c'], True),
+        (None, ['src'], True),
+        (None, ['src/**/*'], True),
+        (None, ['**/sub/**'], True),
+        (None, ['docs/**/*', 'empty/*'], True),
+        (['**/build/**/*'], None, True),
+        (['.git/config', 'build'], None, True),
+        (['**/*.c'], ['**/*'], True),
+        (['linked_src/**/*.c'], ['**/*'], True),
+        (['src/[!s]*', 'include/?mp.h'], ['**/*'], False),
+        (['**'], None, True),
+        (['**/**'], ['**/*'], True),
+        (['src/**'], ['**/*'], True),
+    ])
+def test_filtered_paths_same_as_glob(component_tree, include, exclude, exclude_default):
+    assert filtered_paths(
+        component_tree, include=include, exclude=exclude, exclude_default=exclude_default) == glob_filtered_paths(
+            component_tree, include=include, exclude=exclude, exclude_default=exclude_default)
+
+
+@pytest.mark.parametrize('include', [['**'], ['**/**'], ['./**']])
+def test_filtered_paths_recursive_wildcard_includes_base_directory(assets_path, include):
+    paths = filtered_paths(assets_path, include=include)
+
+    assert Path(assets_path) in paths
+    assert paths == glob_filtered_paths(assets_path, include=include)
+
+
+def test_filtered_paths_prunes_excluded_directories(component_tree, mocker):
+    listdir = mocker.spy(os, 'scandir' if hasattr(os, 'scandir') else 'listdir')
+
+    filtered_paths(component_tree)
+
+    listed = set(Path(str(call.args[0])).relative_to(component_tree).as_posix() for call in listdir.call_args_list)
+    assert 'src/sub' in listed
+    assert '.git' not in listed
+    assert 'build' not in listed
+    assert 'managed_components' not in listed
+
+
 def test_filtered_path_exclude_dir_with_file(assets_path):
     extra_path = Path(assets_path, 'ignore.dir', 'extra').as_posix()
     os.mkdir(extra_path)
@@ -151,3 +275,143 @@ def test_human_readable_size(size, expected):
 def test_human_readable_size_with_negative_size():
     with pytest.raises(ValueError):
         human_readable_size(-1)
+
+
+def tree_state(path):
+    state = {}
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            file_path = os.path.join(root, name)
+            file_stat = os.lstat(file_path)
+            content = None
+            if os.path.isfile(file_path):
+                with open(file_path, 'rb') as f:
+                    content = f.read()
+            state[os.path.relpath(file_path, path)] = (stat.S_IFMT(file_stat.st_mode), file_stat.st_mode, content)
+    return state
+
+
+def test_copy_directory_same_as_copytree(component_tree, tmp_path):
+    os.chmod(os.path.join(component_tree, 'CMakeLists.txt'), 0o600)
+    (Path(component_tree) / 'existing').mkdir()
+    destination = tmp_path / 'destination'
+    destination.mkdir()
+    (destination / 'stale.c').write_text(u'stale')
+
+    copy_directory(component_tree, str(destination))
+    shutil.copytree(component_tree, str(tmp_path / 'copytree'))
+
+    assert tree_state(str(destination)) == tree_state(str(tmp_path / 'copytree'))
+    assert os.path.getmtime(str(destination / 'src' / 'cmp.c')) == os.path.getmtime(
+        os.path.join(component_tree, 'src', 'cmp.c'))
+
+
+def test_sync_directory(tmp_path):
+    source = tmp_path / 'source'
+    destination = tmp_path / 'destination'
+    for root in (source, destination):
+        (root / 'src').mkdir(parents=True)
+        (root / 'src' / 'same.c').write_text(u'int same;')
+        (root / 'src' / 'script.py').write_text(u'print()')
+    (source / 'src' / 'changed.c').write_text(u'int changed = 2;')
+    (destination / 'src' / 'changed.c').write_text(u'int changed = 1;')
+    (source / 'new' / 'dir').mkdir(parents=True)
+    (source / 'new' / 'dir' / 'new.c').write_text(u'int new;')
+    (source / 'was_dir').write_text(u'file')
+    (destination / 'was_dir' / 'sub').mkdir(parents=True)
+    (destination / 'was_dir' / 'sub' / 'old.c').write_text(u'int old;')
+    (source / 'was_file').mkdir()
+    (destination / 'was_file').write_text(u'file')
+    (destination / 'removed' / 'sub').mkdir(parents=True)
+    (destination / 'removed' / 'sub' / 'removed.c').write_text(u'int removed;')
+    (destination / '.component_hash').write_text(u'hash')
+    os.chmod(str(source / 'src' / 'script.py'), 0o755)
+    os.chmod(str(destination / 'src' / 'script.py'), 0o644)
+    old = 1000000000
+    os.utime(str(destination / 'src' / 'same.c'), (old, old))
+    same_inode = os.stat(str(destination / 'src' / 'same.c')).st_ino
+
+    sync_directory(str(source), str(destination))
+
+    assert tree_state(str(destination)) == tree_state(str(source))
+    # Files with the same content are not touched
+    same_stat = os.stat(str(destination / 'src' / 'same.c'))
+    assert same_stat.st_ino == same_inode
+    assert same_stat.st_mtime == old
+    assert os.path.getmtime(str(destination / 'src' / 'changed.c')) == os.path.getmtime(
+        str(source / 'src' / 'changed.c'))
+
+
+def test_sync_directory_same_size_and_mtime(tmp_path):
+    source = tmp_path / 'source'
+    destination = tmp_path / 'destination'
+    for root, content in ((source, u'#define V 2'), (destination, u'#define V 1')):
+        root.mkdir()
+        (root / 'v.h').write_text(content)
+        # Archives of the registry have the same mtime for all files
+        os.utime(str(root / 'v.h'), (1000000000, 1000000000))
+
+    sync_directory(str(source), str(destination))
+
+    assert (destination / 'v.h').read_text() == u'#define V 2'
+
+
+def test_sync_directory_skips_integrity_files(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    (source / 'cmp.c').write_text(u'int cmp;')
+    (source / '.component_hash_stamp').write_text(u'{}')
+    (source / '.component_hash_cache').write_text(u'{}')
+
+    sync_directory(str(source), str(tmp_path / 'destination'))
+
+    assert os.listdir(str(tmp_path / 'destination')) == ['cmp.c']
+
+
+def test_sync_directory_paths(tmp_path):
+    source = tmp_path / 'source'
+    (source / 'src').mkdir(parents=True)
+    (source / 'src' / 'cmp.c').write_text(u'int cmp;')
+    (source / 'src' / 'skipped.c').write_text(u'int skipped;')
+    destination = tmp_path / 'destination'
+
+    sync_directory(str(source), str(destination), paths=[source / 'src' / 'cmp.c'])
+
+    assert sorted(tree_state(str(destination))) == ['src', os.path.join('src', 'cmp.c')]
+
+    sync_directory(str(source), str(destination), paths=[source / 'src' / 'skipped.c'])
+
+    assert sorted(tree_state(str(destination))) == ['src', os.path.join('src', 'skipped.c')]
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason='symlinks are not supported')
+def test_sync_directory_replaces_symlinks(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    (source / 'cmp.c').write_text(u'int cmp;')
+    destination = tmp_path / 'destination'
+    destination.mkdir()
+    outside = tmp_path / 'outside.c'
+    outside.write_text(u'int outside;')
+    os.symlink(str(outside), str(destination / 'cmp.c'))
+
+    sync_directory(str(source), str(destination))
+
+    assert not os.path.islink(str(destination / 'cmp.c'))
+    assert (destination / 'cmp.c').read_text() == u'int cmp;'
+    assert outside.read_text() == u'int outside;'
+
+
+def test_replace_directory(tmp_path):
+    destination = tmp_path / 'entry'
+    destination.mkdir()
+    (destination / 'old.c').write_text(u'int old;')
+    source = tmp_path / '.entry_new'
+    source.mkdir()
+    (source / 'new.c').write_text(u'int new;')
+
+    replace_directory(str(source), str(destination))
+
+    assert os.listdir(str(destination)) == ['new.c']
+    # The previous directory is removed
+    assert os.listdir(str(tmp_path)) == ['entry']
@@ -0,0 +1,147 @@
+# SPDX-FileCopyrightText: 2023 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+import os
+import subprocess
+import sys
+from io import open
+
+import pytest
+
+from idf_component_tools import git_backends
+from idf_component_tools.git_backends import CliGitBackend, GitCommandError, Pygit2GitBackend
+from idf_component_tools.git_client import GitClient
+
+
+@pytest.fixture(scope='module')
+def bare_repository(tmpdir_factory):
+    repo_path = tmpdir_factory.mktemp('git_repo').strpath
+    subprocess.check_output(['git', 'init', repo_path])
+    subprocess.check_output(['git', 'config', 'user.email', 'test@test.com'], cwd=repo_path)
+    subprocess.check_output(['git', 'config', 'user.name', 'Test Test'], cwd=repo_path)
+
+    os.makedirs(os.path.join(repo_path, 'cmp', 'include'))
+    with open(os.path.join(repo_path, 'cmp', 'cmp.c'), 'w') as f:
+        f.write(u'void cmp(void) {}')
+    with open(os.path.join(repo_path, 'cmp', 'include', 'cmp.h'), 'w') as f:
+        f.write(u'void cmp(void);')
+    with open(os.path.join(repo_path, 'cmp', 'run.sh'), 'w') as f:
+        f.write(u'#!/bin/sh')
+    os.chmod(os.path.join(repo_path, 'cmp', 'run.sh'), 0o755)
+    if sys.platform != 'win32':
+        os.symlink('cmp.c', os.path.join(repo_path, 'cmp', 'link.c'))
+    os.makedirs(os.path.join(repo_path, 'other'))
+    with open(os.path.join(repo_path, 'other', 'file.txt'), 'w') as f:
+        f.write(u'other')
+
+    subprocess.check_output(['git', 'add', '.'], cwd=repo_path)
+    subprocess.check_output(['git', 'commit', '-m', 'Init commit'], cwd=repo_path)
+    subprocess.check_output(['git', 'tag', '-a', 'v1.0.0', '-m', 'Release'], cwd=repo_path)
+
+    bare_path = tmpdir_factory.mktemp('bare').strpath
+    subprocess.check_output(['git', 'clone', '--bare', repo_path, bare_path])
+    return bare_path
+
+
+def _backends():
+    yield CliGitBackend('git', GitClient(backend='cli').run)
+    if Pygit2GitBackend.available():
+        yield Pygit2GitBackend()
+
+
+def _git(bare_path, *args):
+    return subprocess.check_output(['git'] + list(args), cwd=bare_path).decode('utf-8').strip()
+
+
+def _files(path):
+    files = {}
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(root, filename)
+            relative_path = os.path.relpath(file_path, path).replace(os.sep, '/')
+            if os.path.islink(file_path):
+                files[relative_path] = ('link', os.readlink(file_path))
+            else:
+                with open(file_path, 'rb') as f:
+                    files[relative_path] = (os.stat(file_path).st_mode & 0o111 != 0, f.read())
+    return files
+
+
+def test_backends_read_same_objects(bare_repository):
+    commit_id = _git(bare_repository, 'rev-parse', 'HEAD')
+
+    for backend in _backends():
+        assert backend.resolve_ref(bare_repository, 'HEAD') == commit_id
+        # Annotated tags are not peeled, like by `git rev-parse --verify`
+        assert backend.resolve_ref(bare_repository, 'v1.0.0') == _git(bare_repository, 'rev-parse', 'v1.0.0')
+        assert backend.resolve_ref(bare_repository, 'not_exists') is None
+
+        assert backend.has_object(bare_repository, commit_id)
+        assert not backend.has_object(bare_repository, '0' * 40)
+
+        tree = backend.read_object(bare_repository, '{}:cmp'.format(commit_id))
+        assert tree.type == 'tree'
+        assert tree.sha == _git(bare_repository, 'rev-parse', '{}:cmp'.format(commit_id))
+
+        blob = backend.read_object(bare_repository, '{}:cmp/cmp.c'.format(commit_id))
+        assert blob.type == 'blob'
+        assert blob.data == b'void cmp(void) {}'
+        assert backend.read_object(bare_repository, '{}:cmp/not_exists'.format(commit_id)) is None
+
+
+def test_backends_check_out_same_files(bare_repository, tmp_path):
+    commit_id = _git(bare_repository, 'rev-parse', 'HEAD')
+
+    checkouts = []
+    for backend in _backends():
+        checkout_path = str(tmp_path / backend.name)
+        os.makedirs(checkout_path)
+        backend.checkout(bare_repository, commit_id, checkout_path, ['cmp'])
+        checkouts.append(_files(checkout_path))
+
+        with pytest.raises(GitCommandError, match='not_exists'):
+            backend.checkout(bare_repository, commit_id, str(tmp_path / 'failed'), ['not_exists'])
+
+    expected_files = ['cmp/cmp.c', 'cmp/include/cmp.h', 'cmp/run.sh']
+    if sys.platform != 'win32':
+        expected_files.append('cmp/link.c')
+    assert sorted(checkouts[0]) == sorted(expected_files)
+    assert checkouts[0]['cmp/run.sh'][0]
+    assert all(checkout == checkouts[0] for checkout in checkouts)
+
+
+def test_client_falls_back_to_cli(bare_repository, monkeypatch):
+    monkeypatch.setattr(git_backends, 'pygit2', None)
+
+    with pytest.warns(UserWarning, match='pygit2 is not installed'):
+        client = GitClient(backend='pygit2')
+
+    assert isinstance(client._backend(bare_repository), CliGitBackend)
+
+
+def test_client_uses_cli_for_partial_mirrors(bare_repository, tmp_path):
+    pytest.importorskip('pygit2')
+
+    partial_mirror = str(tmp_path / 'partial')
+    subprocess.check_output(['git', 'clone', '--bare', bare_repository, partial_mirror])
+    client = GitClient(backend='pygit2')
+    assert isinstance(client._backend(partial_mirror), Pygit2GitBackend)
+
+    _git(partial_mirror, 'config', 'remote.origin.promisor', 'true')
+    assert isinstance(client._backend(partial_mirror), CliGitBackend)
+    # Not initialized mirrors are handled by git CLI too
+    assert isinstance(client._backend(str(tmp_path / 'not_exists')), CliGitBackend)
+
+
+@pytest.mark.parametrize('paths', [['.'], ['cmp', '.']])
+def test_backends_check_out_whole_tree(bare_repository, tmp_path, paths):
+    commit_id = _git(bare_repository, 'rev-parse', 'HEAD')
+
+    checkouts = []
+    for backend in _backends():
+        checkout_path = str(tmp_path / backend.name)
+        os.makedirs(checkout_path)
+        backend.checkout(bare_repository, commit_id, checkout_path, paths)
+        checkouts.append(_files(checkout_path))
+
+    assert 'other/file.txt' in checkouts[0]
+    assert all(checkout == checkouts[0] for checkout in checkouts)
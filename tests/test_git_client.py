@@ -8,7 +8,7 @@ from io import open
 import pytest
 
 from idf_component_tools.errors import GitError
-from idf_component_tools.git_client import GitClient
+from idf_component_tools.git_client import MAINTENANCE_FILENAME, GitClient, partial_clone_filter
 
 
 @pytest.fixture(scope='session')
@@ -115,3 +115,256 @@ def test_git_path_does_not_exist(git_repository_with_two_branches, tmpdir_factor
             ref='new_branch',
             with_submodules=True,
             selected_paths=['path_not_exists'])
+
+
+def test_list_tree(git_repository_with_two_branches, tmpdir_factory):
+    client = GitClient()
+    git_repo = git_repository_with_two_branches['path']
+    cache_path = tmpdir_factory.mktemp('cache_folder').strpath
+    commit_id = git_repository_with_two_branches['new_branch_head']
+
+    root = client.list_tree(repo=git_repo, bare_path=cache_path, ref=commit_id)
+    assert sorted(entry.path for entry in root) == ['component1', 'component2']
+    assert all(entry.type == 'tree' for entry in root)
+
+    entries = client.list_tree(repo=git_repo, bare_path=cache_path, ref=commit_id, recursive=True)
+    assert sorted(entry.path for entry in entries
+                  if entry.type == 'blob') == ['component1/test_file', 'component2/test_file']
+
+    entries = client.list_tree(repo=git_repo, bare_path=cache_path, ref=commit_id, path='component2', recursive=True)
+    assert [entry.path for entry in entries] == ['test_file']
+
+    assert client.list_tree(
+        repo=git_repo, bare_path=cache_path, ref=git_repository_with_two_branches['default_head'],
+        path='component2') is None
+
+
+def test_read_blob(git_repository_with_two_branches, tmpdir_factory):
+    client = GitClient()
+    git_repo = git_repository_with_two_branches['path']
+    cache_path = tmpdir_factory.mktemp('cache_folder').strpath
+    commit_id = git_repository_with_two_branches['new_branch_head']
+
+    assert client.read_blob(repo=git_repo, bare_path=cache_path, ref=commit_id, path='component2/test_file') == \
+        b'component2'
+    assert client.read_blob(repo=git_repo, bare_path=cache_path, ref=commit_id, path='component2') is None
+    assert client.read_blob(repo=git_repo, bare_path=cache_path, ref=commit_id, path='not_exists') is None
+
+    entry = client.list_tree(repo=git_repo, bare_path=cache_path, ref=commit_id, path='component1')[0]
+    assert client.read_blob(repo=git_repo, bare_path=cache_path, ref=entry.sha) == b'component1'
+
+
+def test_partial_clone_mirror(git_repository_with_two_branches, tmpdir_factory):
+    git_repo = git_repository_with_two_branches['path']
+    subprocess.check_output(['git', 'config', 'uploadpack.allowFilter', 'true'], cwd=git_repo)
+    subprocess.check_output(['git', 'config', 'uploadpack.allowAnySHA1InWant', 'true'], cwd=git_repo)
+    client = GitClient(partial_clone_filter='blob:none')
+    cache_path = tmpdir_factory.mktemp('cache_folder').strpath
+    repo_url = 'file://{}'.format(git_repo)
+    commit_id = git_repository_with_two_branches['new_branch_head']
+
+    entries = client.list_tree(repo=repo_url, bare_path=cache_path, ref=commit_id, recursive=True)
+    assert client.is_partial_mirror(cache_path)
+
+    blobs = {entry.path: entry.sha for entry in entries if entry.type == 'blob'}
+    client.prefetch_blobs(repo=repo_url, bare_path=cache_path, ref=commit_id, blobs=[blobs['component2/test_file']])
+
+    missing = subprocess.check_output(
+        ['git', 'rev-list', '--objects', '--no-walk', '--missing=print', commit_id], cwd=cache_path).decode('utf-8')
+    assert '?{}'.format(blobs['component1/test_file']) in missing
+    assert '?{}'.format(blobs['component2/test_file']) not in missing
+
+    # Other blobs are still available on demand
+    assert client.read_blob(repo=repo_url, bare_path=cache_path, ref=commit_id, path='component1/test_file') == \
+        b'component1'
+
+
+def test_auto_partial_clone_of_new_mirror(git_repository_with_two_branches, tmpdir_factory, monkeypatch):
+    git_repo = git_repository_with_two_branches['path']
+    subprocess.check_output(['git', 'config', 'uploadpack.allowFilter', 'true'], cwd=git_repo)
+    repo_url = 'file://{}'.format(git_repo)
+    commit_id = git_repository_with_two_branches['new_branch_head']
+    monkeypatch.setenv('IDF_COMPONENT_GIT_PARTIAL_CLONE_THRESHOLD_MB', '1000')
+
+    # The first download of the repository is filtered, whatever its size
+    new_mirror = tmpdir_factory.mktemp('new_mirror').strpath
+    client = GitClient(partial_clone_filter='auto')
+    client.list_tree(repo=repo_url, bare_path=new_mirror, ref=commit_id)
+    assert client.is_partial_mirror(new_mirror)
+
+    # Existing full mirrors smaller than the threshold are kept
+    full_mirror = tmpdir_factory.mktemp('full_mirror').strpath
+    GitClient().list_tree(repo=repo_url, bare_path=full_mirror, ref=commit_id)
+    client = GitClient(partial_clone_filter='auto', fetch_interval=0)
+    client.list_tree(repo=repo_url, bare_path=full_mirror, ref='new_branch')
+    assert not client.is_partial_mirror(full_mirror)
+
+
+def test_partial_clone_filter(monkeypatch):
+    monkeypatch.delenv('IDF_COMPONENT_GIT_PARTIAL_CLONE_FILTER', raising=False)
+    assert partial_clone_filter() is None
+
+    monkeypatch.setenv('IDF_COMPONENT_GIT_PARTIAL_CLONE_FILTER', '0')
+    assert partial_clone_filter() is None
+
+    monkeypatch.setenv('IDF_COMPONENT_GIT_PARTIAL_CLONE_FILTER', 'tree:0')
+    assert partial_clone_filter() == 'tree:0'
+
+
+def _git_commands(run_spy):
+    return [call[0][1][0] for call in run_spy.call_args_list]
+
+
+def test_known_commit_is_not_fetched(git_repository_with_two_branches, tmpdir_factory, mocker):
+    git_repo = git_repository_with_two_branches['path']
+    cache_path = tmpdir_factory.mktemp('cache_folder').strpath
+    commit_id = git_repository_with_two_branches['new_branch_head']
+    GitClient().get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref='new_branch')
+
+    run = mocker.spy(GitClient, 'run')
+    client = GitClient(fetch_interval=0)
+    assert client.get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref=commit_id) == commit_id
+    assert client.list_tree(repo=git_repo, bare_path=cache_path, ref=commit_id) is not None
+
+    commands = _git_commands(run)
+    assert 'fetch' not in commands
+    assert 'ls-remote' not in commands
+
+
+def test_fetch_only_changed_refs(git_repository_with_two_branches, tmpdir_factory, mocker):
+    git_repo = git_repository_with_two_branches['path']
+    cache_path = tmpdir_factory.mktemp('cache_folder').strpath
+    GitClient().get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref=None)
+
+    # Checked recently, the remote is not requested
+    run = mocker.spy(GitClient, 'run')
+    client = GitClient()
+    assert client.get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref=None) == \
+        git_repository_with_two_branches['default_head']
+    assert 'ls-remote' not in _git_commands(run)
+
+    # Refs that are not changed in the remote are not fetched
+    run.reset_mock()
+    client = GitClient(fetch_interval=0)
+    client.get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref='new_branch')
+    assert 'ls-remote' in _git_commands(run)
+    assert 'fetch' not in _git_commands(run)
+
+    subprocess.check_output(['git', 'branch', 'fetched_branch', 'new_branch'], cwd=git_repo)
+    try:
+        run.reset_mock()
+        client = GitClient(fetch_interval=0)
+        commit_id = client.get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref='fetched_branch')
+        assert commit_id == git_repository_with_two_branches['new_branch_head']
+
+        fetch_args = [call[0][1] for call in run.call_args_list if call[0][1][0] == 'fetch']
+        assert fetch_args == [['fetch', 'origin', '--no-tags', '+refs/heads/fetched_branch:refs/heads/fetched_branch']]
+    finally:
+        subprocess.check_output(['git', 'branch', '-D', 'fetched_branch'], cwd=git_repo)
+
+
+def test_resolved_refs_are_memoized(git_repository_with_two_branches, tmpdir_factory, mocker):
+    git_repo = git_repository_with_two_branches['path']
+    cache_path = tmpdir_factory.mktemp('cache_folder').strpath
+    commit_id = git_repository_with_two_branches['new_branch_head']
+    GitClient().get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref='new_branch')
+    GitClient().get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref=commit_id)
+
+    run = mocker.spy(GitClient, 'run')
+    resolve_ref = mocker.spy(GitClient, '_resolve_ref')
+    assert GitClient().get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref='new_branch') == commit_id
+    assert GitClient().get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref=commit_id) == commit_id
+    assert resolve_ref.call_count == 0
+
+    # Stored on disk, for other processes
+    GitClient._resolved_refs.clear()
+    assert GitClient().get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref='new_branch') == commit_id
+    assert GitClient(fetch_interval=0).get_commit_id_by_ref(
+        repo=git_repo, bare_path=cache_path, ref=commit_id) == commit_id
+    assert _git_commands(run) == []
+    assert resolve_ref.call_count == 0
+
+    # Branches are resolved again after the check of the remote
+    assert GitClient(fetch_interval=0).get_commit_id_by_ref(
+        repo=git_repo, bare_path=cache_path, ref='new_branch') == commit_id
+    assert 'ls-remote' in _git_commands(run)
+    assert resolve_ref.call_count == 1
+
+
+def test_maintenance_after_fetch(git_repository_with_two_branches, tmpdir_factory, mocker):
+    git_repo = git_repository_with_two_branches['path']
+    cache_path = tmpdir_factory.mktemp('cache_folder').strpath
+    GitClient().get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref='new_branch')
+    maintain = mocker.spy(GitClient, 'maintain')
+
+    subprocess.check_output(['git', 'branch', 'maintained_branch', 'new_branch'], cwd=git_repo)
+    try:
+        GitClient(fetch_interval=0).get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref='maintained_branch')
+        subprocess.check_output(['git', 'branch', '-f', 'maintained_branch', 'default'], cwd=git_repo)
+        GitClient(fetch_interval=0).get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref='maintained_branch')
+    finally:
+        subprocess.check_output(['git', 'branch', '-D', 'maintained_branch'], cwd=git_repo)
+
+    # Maintenance runs only once in the interval
+    assert maintain.call_count == 1
+    assert maintain.call_args[1] == {'auto': True}
+    assert os.path.isfile(os.path.join(cache_path, MAINTENANCE_FILENAME))
+
+
+def test_maintain(git_repository_with_two_branches, tmpdir_factory):
+    client = GitClient()
+    git_repo = git_repository_with_two_branches['path']
+    cache_path = tmpdir_factory.mktemp('cache_folder').strpath
+    client.get_commit_id_by_ref(repo=git_repo, bare_path=cache_path, ref='new_branch')
+
+    stats = client.maintain(cache_path)
+
+    assert stats.after.loose_objects == 0
+    assert stats.after.packs == 1
+    assert os.path.isfile(os.path.join(cache_path, 'objects', 'info', 'commit-graph')) or \
+        os.path.isdir(os.path.join(cache_path, 'objects', 'info', 'commit-graphs'))
+
+
+def _commit_all(repo_path, message):
+    subprocess.check_output(['git', 'add', '.'], cwd=repo_path)
+    subprocess.check_output(
+        ['git', '-c', 'user.name=Test', '-c', 'user.email=test@test.com', 'commit', '-m', message], cwd=repo_path)
+
+
+def test_submodules_borrow_objects_from_shared_mirror(tmp_path, monkeypatch, mocker):
+    # Allow submodules from local paths
+    monkeypatch.setenv('GIT_CONFIG_COUNT', '1')
+    monkeypatch.setenv('GIT_CONFIG_KEY_0', 'protocol.file.allow')
+    monkeypatch.setenv('GIT_CONFIG_VALUE_0', 'always')
+
+    submodule_repo = str(tmp_path / 'sdk')
+    subprocess.check_output(['git', 'init', submodule_repo])
+    with open(os.path.join(submodule_repo, 'sdk.h'), 'w') as f:
+        f.write(u'void sdk(void);')
+    _commit_all(submodule_repo, 'SDK')
+
+    repo = str(tmp_path / 'repo')
+    subprocess.check_output(['git', 'init', repo])
+    subprocess.check_output(['git', 'submodule', 'add', submodule_repo, 'cmp/sdk'], cwd=repo)
+    _commit_all(repo, 'Add submodule')
+
+    mirrors_path = str(tmp_path / 'mirrors')
+    update_mirror = mocker.spy(GitClient, 'update_mirror')
+    run = mocker.spy(GitClient, 'run')
+    client = GitClient()
+    checkout_path = str(tmp_path / 'checkout')
+    os.makedirs(checkout_path)
+    client.prepare_ref(
+        repo=repo,
+        bare_path=str(tmp_path / 'bare'),
+        checkout_path=checkout_path,
+        selected_paths=['cmp'],
+        submodule_mirror_path=lambda url: os.path.join(mirrors_path, os.path.basename(url)))
+
+    assert os.path.isfile(os.path.join(checkout_path, 'cmp', 'sdk', 'sdk.h'))
+    assert update_mirror.call_args[1]['repo'] == submodule_repo
+    assert any(
+        '--reference' in call[0][1] and os.path.join(mirrors_path, 'sdk') in call[0][1] for call in run.call_args_list)
+    # Objects are copied from the mirror, the submodule doesn't depend on it
+    assert not os.path.exists(
+        os.path.join(str(tmp_path), 'bare', 'modules', 'cmp', 'sdk', 'objects', 'info', 'alternates'))
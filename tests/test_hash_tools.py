@@ -1,13 +1,19 @@
 # SPDX-FileCopyrightText: 2022-2023 Espressif Systems (Shanghai) CO LTD
 # SPDX-License-Identifier: Apache-2.0
 
+import hashlib
+import json
 import os
+import time
 
 import pytest
 
+from idf_component_tools import hash_tools
 from idf_component_tools.hash_tools import (
-    HashDoesNotExistError, HashNotEqualError, HashNotSHA256Error, hash_dir, hash_file, hash_object, validate_dir,
-    validate_managed_component_hash)
+    DIGEST_CACHE_FILENAME, HASH_FILENAME, HASH_TREE_FILENAME, LOCAL_STAMP_FILENAME, MMAP_MIN_SIZE,
+    PARALLEL_HASH_MIN_FILES, STAT_SNAPSHOT_FILENAME, HashDoesNotExistError, HashNotEqualError, HashNotSHA256Error,
+    diff_hash_trees, hash_dir, hash_file, hash_files, hash_object, hash_tree, validate_dir, validate_filtered_dir,
+    validate_managed_component_hash, write_hash_tree, write_stat_snapshot)
 
 
 @pytest.fixture
@@ -35,10 +41,35 @@ class TestHashTools(object):
 
         assert hash_file(file_path) == expected_sha
 
+    def test_hash_file_large(self, tmp_path):
+        file_path = tmp_path / 'large.bin'
+        content = os.urandom(MMAP_MIN_SIZE + 1)
+        file_path.write_bytes(content)
+
+        assert hash_file(str(file_path)) == hashlib.sha256(content).hexdigest()
+
+    @pytest.mark.skipif(not hasattr(hashlib, 'blake2b'), reason='blake2b is not available')
+    def test_hash_file_algorithm(self, fixture_path):
+        file_path = os.path.join(fixture_path(1), '1.txt')
+
+        assert hash_file(file_path, 'blake2b') == hashlib.blake2b(b'1', digest_size=32).hexdigest()
+
     def test_hash_dir(self, fixture_path):
         expected_sha = '299e78217cd6cb4f6962dde0de8c34a8aa8df7c80d8ac782d1944a4ec5b0ff8e'
         assert hash_dir(fixture_path(1)) == expected_sha
 
+    def test_hash_dir_parallel(self, tmp_path, monkeypatch):
+        for index in range(PARALLEL_HASH_MIN_FILES * 2):
+            directory = tmp_path / 'dir_{}'.format(index % 3)
+            if not directory.is_dir():
+                directory.mkdir()
+            (directory / 'file_{}.c'.format(index)).write_bytes(os.urandom(index * 1000))
+
+        digest = hash_dir(str(tmp_path))
+
+        monkeypatch.setenv('IDF_COMPONENT_HASH_JOBS', '1')
+        assert hash_dir(str(tmp_path)) == digest
+
     def test_hash_dir_ignore(self, fixture_path):
         expected_sha = '299e78217cd6cb4f6962dde0de8c34a8aa8df7c80d8ac782d1944a4ec5b0ff8e'
 
@@ -64,6 +95,26 @@ class TestHashTools(object):
         assert not validate_dir(fixture_path(3), expected_sha)
         assert not validate_dir(fixture_path(4), expected_sha)
 
+    def test_hash_tree(self):
+        file_hashes = [('a.c', 'a' * 64), ('src/b.c', 'b' * 64), ('src/sub/c.c', 'c' * 64), ('doc/d.md', 'd' * 64)]
+        tree = hash_tree(file_hashes)
+
+        assert tree['files'] == {'a.c': 'a' * 64}
+        assert sorted(tree['dirs']) == ['doc', 'src']
+        assert tree['dirs']['src']['dirs']['sub']['files'] == {'c.c': 'c' * 64}
+        assert tree == hash_tree(reversed(file_hashes))
+        assert diff_hash_trees(tree, tree) == []
+
+        changed = hash_tree(
+            [('a.c', 'a' * 64), ('src/b.c', 'e' * 64), ('src/sub/e.c', 'c' * 64), ('doc/d.md', 'd' * 64)])
+        assert changed['dirs']['doc']['digest'] == tree['dirs']['doc']['digest']
+        assert changed['digest'] != tree['digest']
+        assert diff_hash_trees(tree, changed) == [
+            ('src/b.c', 'modified'),
+            ('src/sub/c.c', 'removed'),
+            ('src/sub/e.c', 'added'),
+        ]
+
 
 class TestValidateManagedComponent(object):
     def test_disabled(self, tmp_path, monkeypatch):
@@ -90,3 +141,173 @@ class TestValidateManagedComponent(object):
         (tmp_path / '.component_hash').write_text(u'a' * 64)
         with pytest.raises(HashNotEqualError):
             validate_managed_component_hash(str(tmp_path))
+
+    def test_digest_cache(self, tmp_path, monkeypatch, mocker):
+        component_path = tmp_path / 'cmp'
+        (component_path / 'src').mkdir(parents=True)
+        (component_path / 'src' / 'cmp.c').write_bytes(b'void cmp(void) {}')
+        (component_path / 'cmp.h').write_bytes(b'void cmp(void);')
+        old = time.time() - 60
+        for path in [component_path / 'src' / 'cmp.c', component_path / 'cmp.h']:
+            os.utime(str(path), (old, old))
+        (component_path / HASH_FILENAME).write_text(u'{}'.format(hash_dir(str(component_path))))
+
+        validate_managed_component_hash(str(component_path))
+        assert (component_path / DIGEST_CACHE_FILENAME).is_file()
+
+        hash_file_spy = mocker.spy(hash_tools, 'hash_file')
+        validate_managed_component_hash(str(component_path))
+        assert hash_file_spy.call_count == 0
+
+        # Files changed after the validation are hashed again
+        (component_path / 'cmp.h').write_bytes(b'void cmp(int);')
+        with pytest.raises(HashNotEqualError):
+            validate_managed_component_hash(str(component_path))
+        assert hash_file_spy.call_count == 1
+
+        # Recently modified file is not stored in the cache
+        (component_path / 'cmp.h').write_bytes(b'void cmp(void);')
+        validate_managed_component_hash(str(component_path))
+        validate_managed_component_hash(str(component_path))
+        assert hash_file_spy.call_count == 3
+
+        monkeypatch.setenv('IDF_COMPONENT_STRICT_HASH_CHECK', '1')
+        validate_managed_component_hash(str(component_path))
+        assert hash_file_spy.call_count == 5
+
+    def test_hash_tree_changes(self, tmp_path):
+        component_path = tmp_path / 'cmp'
+        (component_path / 'src').mkdir(parents=True)
+        (component_path / 'src' / 'cmp.c').write_bytes(b'void cmp(void) {}')
+        (component_path / 'src' / 'old.c').write_bytes(b'void old(void) {}')
+        (component_path / 'cmp.h').write_bytes(b'void cmp(void);')
+        component_hash = hash_dir(str(component_path))
+        (component_path / HASH_FILENAME).write_text(u'{}'.format(component_hash))
+
+        write_hash_tree(str(component_path))
+        assert (component_path / HASH_TREE_FILENAME).is_file()
+        # Files of the component manager are not a part of the hash
+        validate_managed_component_hash(str(component_path))
+
+        (component_path / 'cmp.h').write_bytes(b'void cmp(int);')
+        (component_path / 'src' / 'old.c').unlink()
+        (component_path / 'src' / 'new.c').write_bytes(b'void new(void) {}')
+        with pytest.raises(HashNotEqualError) as e:
+            validate_managed_component_hash(str(component_path))
+
+        assert e.value.changes == [('cmp.h', 'modified'), ('src/new.c', 'added'), ('src/old.c', 'removed')]
+
+    def test_hash_tree_outdated(self, tmp_path):
+        component_path = tmp_path / 'cmp'
+        component_path.mkdir()
+        (component_path / 'cmp.h').write_bytes(b'void cmp(void);')
+        write_hash_tree(str(component_path))
+        (component_path / 'cmp.h').write_bytes(b'void cmp(int);')
+        (component_path / HASH_FILENAME).write_text(u'{}'.format(hash_files([('cmp.c', 'a' * 64)])))
+
+        # Tree of other files doesn't report changes
+        with pytest.raises(HashNotEqualError) as e:
+            validate_managed_component_hash(str(component_path))
+
+        assert e.value.changes == []
+
+    def test_stat_integrity(self, tmp_path, monkeypatch, mocker):
+        monkeypatch.setenv('IDF_COMPONENT_INTEGRITY', 'stat')
+        component_path = tmp_path / 'cmp'
+        component_path.mkdir()
+        header = component_path / 'cmp.h'
+        header.write_bytes(b'void cmp(void);')
+        old = time.time() - 60
+        os.utime(str(header), (old, old))
+        component_hash = hash_dir(str(component_path))
+        (component_path / HASH_FILENAME).write_text(u'{}'.format(component_hash))
+        write_stat_snapshot(str(component_path), component_hash)
+        assert (component_path / STAT_SNAPSHOT_FILENAME).is_file()
+
+        hash_file_spy = mocker.spy(hash_tools, 'hash_file')
+        validate_managed_component_hash(str(component_path))
+        assert hash_file_spy.call_count == 0
+
+        # Changes keeping size and mtime are not detected by design
+        header.write_bytes(b'void cmp(char);')
+        os.utime(str(header), (old, old))
+        validate_managed_component_hash(str(component_path))
+        assert hash_file_spy.call_count == 0
+
+        # Full check on demand
+        monkeypatch.setenv('IDF_COMPONENT_STRICT_HASH_CHECK', '1')
+        with pytest.raises(HashNotEqualError):
+            validate_managed_component_hash(str(component_path))
+        assert hash_file_spy.call_count == 1
+        monkeypatch.delenv('IDF_COMPONENT_STRICT_HASH_CHECK')
+
+        # Changed mtime falls back to the full check
+        header.write_bytes(b'void cmp(void);')
+        os.utime(str(header), (old + 1, old + 1))
+        validate_managed_component_hash(str(component_path))
+        assert hash_file_spy.call_count == 2
+
+        # The snapshot is recorded again after the full check
+        validate_managed_component_hash(str(component_path))
+        assert hash_file_spy.call_count == 2
+
+    def test_stat_integrity_periodic_check(self, tmp_path, monkeypatch, mocker):
+        monkeypatch.setenv('IDF_COMPONENT_INTEGRITY', 'stat')
+        monkeypatch.setenv('IDF_COMPONENT_INTEGRITY_CHECK_INTERVAL', '3600')
+        component_path = tmp_path / 'cmp'
+        component_path.mkdir()
+        (component_path / 'cmp.h').write_bytes(b'void cmp(void);')
+        old = time.time() - 60
+        os.utime(str(component_path / 'cmp.h'), (old, old))
+        component_hash = hash_dir(str(component_path))
+        (component_path / HASH_FILENAME).write_text(u'{}'.format(component_hash))
+        write_stat_snapshot(str(component_path), component_hash)
+
+        hash_file_spy = mocker.spy(hash_tools, 'hash_file')
+        mocker.patch('time.time', return_value=time.time() + 3601)
+        validate_managed_component_hash(str(component_path))
+        assert hash_file_spy.call_count == 1
+
+    @pytest.mark.skipif(not hasattr(hashlib, 'blake2b'), reason='blake2b is not available')
+    def test_local_hash_algorithm_stamp(self, tmp_path, monkeypatch, mocker):
+        monkeypatch.setenv('IDF_COMPONENT_LOCAL_HASH_ALGORITHM', 'blake2b')
+        component_path = tmp_path / 'cmp'
+        component_path.mkdir()
+        (component_path / 'cmp.h').write_bytes(b'void cmp(void);')
+        component_hash = hash_dir(str(component_path))
+
+        # The first check uses the registry hash and records the stamp
+        assert validate_filtered_dir(str(component_path), component_hash)
+        stamp = json.loads((component_path / LOCAL_STAMP_FILENAME).read_text())
+        assert stamp['algorithm'] == 'blake2b'
+        assert stamp['root'] == component_hash
+
+        hash_file_spy = mocker.spy(hash_tools, 'hash_file')
+        assert validate_filtered_dir(str(component_path), component_hash)
+        assert [call.args[1] for call in hash_file_spy.call_args_list] == ['blake2b']
+
+        (component_path / 'cmp.h').write_bytes(b'void cmp(int);')
+        assert not validate_filtered_dir(str(component_path), component_hash)
+
+        # Stamps of other algorithms are ignored
+        monkeypatch.setenv('IDF_COMPONENT_LOCAL_HASH_ALGORITHM', 'sha256')
+        assert validate_filtered_dir(str(component_path), hash_dir(str(component_path)))
+
+    @pytest.mark.skipif(not hasattr(hashlib, 'blake2b'), reason='blake2b is not available')
+    def test_strict_hash_check_ignores_local_stamp(self, tmp_path, monkeypatch, mocker):
+        monkeypatch.setenv('IDF_COMPONENT_LOCAL_HASH_ALGORITHM', 'blake2b')
+        component_path = tmp_path / 'cmp'
+        component_path.mkdir()
+        (component_path / 'cmp.h').write_bytes(b'void cmp(void);')
+        component_hash = hash_dir(str(component_path))
+        assert validate_filtered_dir(str(component_path), component_hash)
+
+        monkeypatch.setenv('IDF_COMPONENT_STRICT_HASH_CHECK', '1')
+        hash_file_spy = mocker.spy(hash_tools, 'hash_file')
+        assert validate_filtered_dir(str(component_path), component_hash)
+        assert [call.args[1] for call in hash_file_spy.call_args_list] == ['sha256']
+
+        # A stamp matching the files doesn't replace the registry hash
+        (component_path / 'cmp.h').write_bytes(b'void cmp(int);')
+        hash_tools.write_local_stamp(str(component_path), component_hash, 'blake2b')
+        assert not validate_filtered_dir(str(component_path), component_hash)